@@ -0,0 +1,256 @@
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import gpx_to_directions_route as converter
+from conversion_cache import ConversionCache
+
+# Converts a directory (or glob) of GPX files to DirectionsRoute JSON files, fanning the conversions out over a
+# process pool. Malformed files are reported and skipped; the remaining files are still converted.
+# Output files are named <input file name>.json, next to the input file or in the output directory. There, files
+# found in subdirectories of the input directory or glob (e.g. 'drives/**/*.gpx') keep their relative path, so
+# files with the same name in different directories do not overwrite each other.
+
+
+def find_gpx_files(directory_or_glob):
+    """
+    Resolve a directory or glob pattern to a sorted list of absolute GPX file paths.
+
+    Args:
+        directory_or_glob: Directory containing *.gpx files, or a glob pattern such as 'drives/**/*.gpx'
+
+    Returns:
+        Sorted list of absolute file paths
+    """
+    if os.path.isdir(directory_or_glob):
+        pattern = os.path.join(directory_or_glob, '*.gpx')
+    else:
+        pattern = directory_or_glob
+    return sorted(os.path.abspath(path) for path in glob.glob(pattern, recursive=True) if os.path.isfile(path))
+
+
+def input_root(directory_or_glob):
+    """
+    Directory the GPX files of a directory or glob pattern are found in: the directory itself, or the leading
+    part of the pattern without wildcards (e.g. 'drives' for 'drives/**/*.gpx').
+
+    Returns:
+        Absolute directory path
+    """
+    if os.path.isdir(directory_or_glob):
+        return os.path.abspath(directory_or_glob)
+    root = os.path.dirname(directory_or_glob)
+    while glob.has_magic(root):
+        root = os.path.dirname(root)
+    return os.path.abspath(root)
+
+
+def output_file_path(gpx_file_path, output_directory=None, compression=None, input_root=None):
+    """
+    Deterministic output path for a GPX file: <name>.gpx.json next to the input file or in output_directory,
+    with the suffix of the compression (e.g. <name>.gpx.json.gz).
+
+    Args:
+        gpx_file_path: Absolute path of the GPX file
+        output_directory: Directory for the JSON files (default: next to the GPX file)
+        compression: None, "gzip" or "brotli"
+        input_root: Directory the GPX files were found in (see input_root). The path of the GPX file relative
+            to it is kept below output_directory; without it, all JSON files are written to output_directory.
+    """
+    directory = output_directory if output_directory else os.path.dirname(gpx_file_path)
+    if output_directory and input_root:
+        relative_directory = os.path.relpath(os.path.dirname(gpx_file_path), input_root)
+        if relative_directory.split(os.sep)[0] != os.pardir:
+            directory = os.path.normpath(os.path.join(output_directory, relative_directory))
+    suffix = '.json' + converter.COMPRESSIONS.get(compression, '')
+    return os.path.join(directory, os.path.basename(gpx_file_path) + suffix)
+
+
+def output_file_paths(gpx_file_paths, output_directory=None, compression=None, input_root=None):
+    """
+    Output paths of GPX files (see output_file_path).
+
+    Raises:
+        ValueError: if two GPX files would be written to the same output file
+    """
+    json_file_paths = [output_file_path(path, output_directory, compression, input_root) for path in gpx_file_paths]
+    gpx_file_paths_by_output = {}
+    for gpx_file_path, json_file_path in zip(gpx_file_paths, json_file_paths):
+        other_gpx_file_path = gpx_file_paths_by_output.setdefault(json_file_path, gpx_file_path)
+        if other_gpx_file_path != gpx_file_path:
+            raise ValueError(f"{other_gpx_file_path} and {gpx_file_path} would both be written to {json_file_path}")
+    return json_file_paths
+
+
+def convert_file(gpx_converter, gpx_file_path, json_file_path, compact=False, output_profile="full",
+                 compression=None):
+    """
+    Convert a single GPX file and write its DirectionsRoute JSON, capturing any failure.
+
+    Args:
+        gpx_converter: GpxToDirectionsConverter holding the conversion configuration
+        gpx_file_path: Absolute path of the GPX file
+        json_file_path: Path of the JSON file to write
+        compact: Write compact instead of indented JSON
+        output_profile: "full" or "lean", see gpx_to_directions_route.OUTPUT_PROFILES
+        compression: None, "gzip" or "brotli"
+
+    Returns:
+        Dictionary with file, output, status ('ok' or 'failed'), error, seconds, cache_hit and profile (the
+        ConversionProfile as a dictionary if the converter profiles conversions)
+    """
+    start = time.perf_counter()
+    hits_before = gpx_converter.cache.hits if gpx_converter.cache is not None else 0
+    profile = None
+    try:
+        result = gpx_converter.convert(gpx_file_path)
+        converter.write_route_response(result.response, json_file_path, compact, result.profile, output_profile,
+                                       compression)
+        status, error = 'ok', None
+        if result.profile is not None:
+            profile = result.profile.to_dict()
+    except Exception as e:
+        status, error = 'failed', f"{type(e).__name__}: {e}"
+    return {
+        "file": gpx_file_path,
+        "output": json_file_path if status == 'ok' else None,
+        "status": status,
+        "error": error,
+        "seconds": time.perf_counter() - start,
+        "cache_hit": gpx_converter.cache is not None and gpx_converter.cache.hits > hits_before,
+        "profile": profile
+    }
+
+
+def convert_batch(gpx_file_paths, output_directory=None, workers=None, voice_instruction_distance=0,
+                  leg_percentages=None, ingestion="gpxpy", cache=None, compact=False, tolerance_meters=None,
+                  track_policy="first", profile=False, waypoint_cache=False, coalesce_steps=False,
+                  output_profile="full", compression=None, input_root=None):
+    """
+    Convert GPX files on a process pool.
+
+    Args:
+        gpx_file_paths: List of absolute GPX file paths
+        output_directory: Directory for the JSON files (default: next to each GPX file)
+        workers: Number of worker processes (default: number of CPUs); 1 converts in this process
+        voice_instruction_distance: Desired distance in meters of voice instructions before their maneuver
+        leg_percentages: Leg split of each route, must sum to 100 (default: [100])
+        ingestion: "gpxpy" or "stream", see gpx_to_mapbox_directions_response
+        cache: Optional ConversionCache shared by the workers
+        compact: Write compact instead of indented JSON
+        tolerance_meters: Optional simplification tolerance in meters instead of the default in degrees
+        track_policy: How files with several tracks or segments are converted, see TRACK_POLICIES
+        profile: Record a ConversionProfile of every file (see convert_file)
+        waypoint_cache: Reuse parsed and simplified coordinates from .gpxc files next to the GPX files
+            (see waypoint_cache.py)
+        coalesce_steps: Fold segments without a maneuver into the preceding step (one step per maneuver)
+        output_profile: "full" or "lean" (without debug fields and constant boilerplate)
+        compression: None, "gzip" or "brotli"; the JSON files are written compressed as <name>.gpx.json.gz/.br
+        input_root: Directory the GPX files were found in; their relative paths are kept below output_directory
+            (see output_file_path)
+
+    Returns:
+        List of per-file results (see convert_file) in the order of gpx_file_paths
+
+    Raises:
+        ValueError: if two GPX files would be written to the same output file (checked before converting)
+    """
+    gpx_converter = converter.GpxToDirectionsConverter(leg_percentages, voice_instruction_distance,
+                                                       ingestion=ingestion, cache=cache,
+                                                       tolerance_meters=tolerance_meters, track_policy=track_policy,
+                                                       segment_workers=1,  # files already run in parallel
+                                                       profile=profile, waypoint_cache=waypoint_cache,
+                                                       coalesce_steps=coalesce_steps)
+    json_file_paths = output_file_paths(gpx_file_paths, output_directory, compression, input_root)
+    if output_directory:
+        for directory in sorted({os.path.dirname(json_file_path) for json_file_path in json_file_paths}):
+            os.makedirs(directory, exist_ok=True)
+
+    if workers == 1:
+        return [convert_file(gpx_converter, path, json_path, compact, output_profile, compression)
+                for path, json_path in zip(gpx_file_paths, json_file_paths)]
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(convert_file, gpx_converter, path, json_path, compact, output_profile, compression)
+                   for path, json_path in zip(gpx_file_paths, json_file_paths)]
+        # Collect in submission order, so results do not depend on the worker count
+        return [future.result() for future in futures]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Convert a directory of GPX files to DirectionsRoute JSON files")
+    parser.add_argument('input', help="directory containing *.gpx files, or a glob pattern (quote it)")
+    parser.add_argument('--output-dir', help="directory for the JSON files (default: next to each GPX file)")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: number of CPUs)")
+    parser.add_argument('--voice-instruction-distance', type=float, default=100,
+                        help="meters of voice instructions ahead of maneuvers")
+    parser.add_argument('--leg-percentages', type=int, nargs='+', default=[100],
+                        help="leg split in percent, must sum to 100")
+    parser.add_argument('--ingestion', choices=["gpxpy", "stream"], default="gpxpy")
+    parser.add_argument('--report', help="write the per-file results to this JSON file")
+    parser.add_argument('--compact', action='store_true', help="write compact instead of indented JSON")
+    parser.add_argument('--tolerance-meters', type=float, default=None,
+                        help="simplification tolerance in meters (default: 0.00001 degrees)")
+    parser.add_argument('--track-policy', choices=converter.TRACK_POLICIES, default="first",
+                        help="conversion of files with several tracks or segments")
+    parser.add_argument('--profile', action='store_true',
+                        help="record per-stage time, memory and counts of every file (written to --report)")
+    parser.add_argument('--cache-dir', help="reuse conversions of identical GPX content and parameters from here")
+    parser.add_argument('--cache-max-mb', type=float, default=512, help="size bound of the cache directory")
+    parser.add_argument('--waypoint-cache', action='store_true',
+                        help="keep parsed and simplified coordinates in .gpxc files next to the GPX files and reuse "
+                             "them on later runs")
+    parser.add_argument('--coalesce-steps', action='store_true',
+                        help="fold segments without a maneuver into the preceding step (one step per maneuver)")
+    parser.add_argument('--output-profile', choices=converter.OUTPUT_PROFILES, default="full",
+                        help="lean leaves out debug fields and constant boilerplate")
+    parser.add_argument('--compress', choices=list(converter.COMPRESSIONS), default=None,
+                        help="write <name>.gpx.json.gz or .json.br files (brotli needs the brotli package)")
+    args = parser.parse_args()
+
+    gpx_file_paths = find_gpx_files(args.input)
+    if not gpx_file_paths:
+        print(f"No GPX files found for {args.input}")
+        sys.exit(1)
+
+    cache = ConversionCache(args.cache_dir, int(args.cache_max_mb * 1024 * 1024)) if args.cache_dir else None
+    batch_start = time.perf_counter()
+    try:
+        results = convert_batch(gpx_file_paths, args.output_dir, args.workers, args.voice_instruction_distance,
+                                args.leg_percentages, args.ingestion, cache, args.compact, args.tolerance_meters,
+                                args.track_policy, args.profile, args.waypoint_cache, args.coalesce_steps,
+                                args.output_profile, args.compress, input_root(args.input))
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+    batch_seconds = time.perf_counter() - batch_start
+
+    for result in results:
+        if result["status"] == 'ok':
+            print(f"ok      {result['seconds']:8.2f}s  {result['file']} -> {result['output']}")
+        else:
+            print(f"failed  {result['seconds']:8.2f}s  {result['file']}: {result['error']}")
+
+    failed = sum(1 for result in results if result["status"] != 'ok')
+    print(f"Converted {len(results) - failed} of {len(results)} files in {batch_seconds:.2f}s ({failed} failed)")
+    if cache is not None:
+        hits = sum(1 for result in results if result["cache_hit"])
+        print(f"Cache: {hits} hits, {len(results) - hits} misses, {cache.stats()['bytes'] / 1e6:.1f} MB")
+
+    if args.profile:
+        # Stage times summed over all converted files
+        stage_seconds = {}
+        for result in results:
+            for stage in (result["profile"] or {}).get("stages", []):
+                stage_seconds[stage["name"]] = stage_seconds.get(stage["name"], 0.0) + stage["seconds"]
+        print("Stages: " + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in stage_seconds.items()))
+
+    if args.report:
+        with open(args.report, 'w') as report_file:
+            json.dump({"seconds": batch_seconds, "results": results}, report_file, indent=2)
+
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,77 @@
+"""
+Report the peak RSS of the gpxpy and the streaming GPX ingestion paths.
+
+Each measurement runs in a fresh process, so the peak resident set size reflects a single ingestion
+(parsing and simplification) of the file.
+
+Usage:
+    python benchmarks/ingestion_memory.py path/to/track.gpx [more.gpx ...]
+"""
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+INGESTION_MODES = ["gpxpy", "stream"]
+
+
+def _ingest(gpx_file_path, ingestion, results):
+    import gpxpy
+    import gpx_to_directions_route as converter
+
+    # RSS after imports, so the ingestion's own share can be reported
+    baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    if ingestion == "stream":
+        waypoints = converter.stream_gpx_coordinates(gpx_file_path)
+    else:
+        with open(gpx_file_path, 'r') as gpx_file:
+            gpx = gpxpy.parse(gpx_file)
+        waypoints = gpx.tracks[0].segments[0].points if gpx.tracks else gpx.routes[0].points
+    parse_peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    converter.legged_simplification(waypoints, tolerance=0.00001, percentages=[100])
+    elapsed = time.perf_counter() - start
+
+    # ru_maxrss is reported in kilobytes on Linux
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results.put({"baseline_kb": baseline_kb, "parse_peak_kb": parse_peak_kb, "peak_kb": peak_kb, "seconds": elapsed})
+
+
+def measure_ingestion(gpx_file_path, ingestion):
+    """
+    Measure the peak RSS of ingesting one GPX file in a fresh process.
+
+    Args:
+        gpx_file_path: Path of the GPX file
+        ingestion: "gpxpy" or "stream"
+
+    Returns:
+        Dictionary with baseline_kb (after imports), parse_peak_kb (after parsing), peak_kb (after
+        simplification) and seconds
+    """
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=_ingest, args=(gpx_file_path, ingestion, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+
+    print(f"{'file':<30} {'size MB':>8} {'ingestion':>10} {'parse MB':>9} {'peak RSS MB':>12} {'seconds':>8}")
+    for gpx_file_path in sys.argv[1:]:
+        size_mb = os.path.getsize(gpx_file_path) / 1e6
+        for ingestion in INGESTION_MODES:
+            result = measure_ingestion(gpx_file_path, ingestion)
+            # parse MB: RSS growth caused by parsing alone; peak RSS MB: whole process incl. simplification
+            print(f"{os.path.basename(gpx_file_path):<30} {size_mb:>8.1f} {ingestion:>10} "
+                  f"{(result['parse_peak_kb'] - result['baseline_kb']) / 1024:>9.1f} "
+                  f"{result['peak_kb'] / 1024:>12.1f} {result['seconds']:>8.2f}")
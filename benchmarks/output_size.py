@@ -0,0 +1,82 @@
+"""
+Compare the size and encode time of the output variants of converted routes.
+
+Every file is converted once and written in each variant, from the current default (full, indented, uncompressed
+JSON) down to lean compact JSON compressed with gzip or brotli (if the brotli package is installed). The best
+write time of --repeat runs (encoding, compression and the file write) is reported with the file size and the
+size relative to the default. Without files, synthetic tracks of every shape (see synthetic_gpx.py) are used.
+
+Usage:
+    python benchmarks/output_size.py [path/to/track.gpx ...] [--points 100000] [--coalesce-steps]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gpx_to_directions_route as converter
+from synthetic_gpx import SHAPES, synthetic_gpx_file
+
+# (name, output_profile, compact, compression); the first variant is the baseline
+VARIANTS = [
+    ("full indented", "full", False, None),
+    ("full compact", "full", True, None),
+    ("lean compact", "lean", True, None),
+    ("full compact gzip", "full", True, "gzip"),
+    ("lean compact gzip", "lean", True, "gzip"),
+    ("full compact brotli", "full", True, "brotli"),
+    ("lean compact brotli", "lean", True, "brotli"),
+]
+
+
+def measure_output_variants(gpx_file_path, output_directory, voice_instruction_distance=100, coalesce_steps=False,
+                            repeat=3):
+    """
+    Returns:
+        List of dictionaries with the variant, its file size in bytes and best write time in seconds
+    """
+    gpx_converter = converter.GpxToDirectionsConverter([100], voice_instruction_distance, ingestion="stream",
+                                                       coalesce_steps=coalesce_steps)
+    response = gpx_converter.convert(gpx_file_path).response
+    results = []
+    for name, output_profile, compact, compression in VARIANTS:
+        if compression == "brotli" and converter.brotli is None:
+            continue
+        json_file_path = os.path.join(output_directory, "route.json" + converter.COMPRESSIONS.get(compression, ''))
+        seconds = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            converter.write_route_response(response, json_file_path, compact, output_profile=output_profile,
+                                           compression=compression)
+            seconds.append(time.perf_counter() - start)
+        results.append({"variant": name, "bytes": os.path.getsize(json_file_path), "seconds": min(seconds)})
+        os.remove(json_file_path)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="File size and encode time of the output variants")
+    parser.add_argument('gpx_files', nargs='*', help="GPX files (default: synthetic tracks of every shape)")
+    parser.add_argument('--points', type=int, default=100000, help="points of the synthetic tracks")
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), "gpx_benchmark_data"),
+                        help="directory for the generated GPX files (reused across runs)")
+    parser.add_argument('--voice-instruction-distance', type=float, default=100)
+    parser.add_argument('--coalesce-steps', action='store_true', help="convert with one step per maneuver")
+    parser.add_argument('--repeat', type=int, default=3, help="writes per variant, the best time is reported")
+    args = parser.parse_args()
+
+    if converter.brotli is None:
+        print("brotli is not installed, skipping the brotli variants")
+    gpx_file_paths = args.gpx_files or [synthetic_gpx_file(args.data_dir, shape, args.points) for shape in SHAPES]
+    with tempfile.TemporaryDirectory() as output_directory:
+        for gpx_file_path in gpx_file_paths:
+            results = measure_output_variants(gpx_file_path, output_directory, args.voice_instruction_distance,
+                                              args.coalesce_steps, args.repeat)
+            print(f"\n{os.path.basename(gpx_file_path)}")
+            print(f"  {'variant':<22} {'MB':>9} {'size':>7} {'encode s':>9}")
+            for result in results:
+                print(f"  {result['variant']:<22} {result['bytes'] / 1e6:>9.3f} "
+                      f"{result['bytes'] / results[0]['bytes']:>7.1%} {result['seconds']:>9.3f}")
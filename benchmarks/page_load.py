@@ -0,0 +1,158 @@
+"""
+Measure the size and load time of the HTML map view of a large synthetic route.
+
+The map view (create_html_map_view) of a converted synthetic track is written to a temporary directory and served
+over HTTP on localhost. Reported are the HTML and GeoJSON file sizes and:
+
+    data_load      Best time of --repeat fetches of the three GeoJSON files over HTTP with JSON parsing (in
+                   Python). This is the part of the page load that grows with the route, without rendering.
+    page_load      Browser load event of the page (HTML, styles and the Mapbox GL script)
+    map_ready      Time until the map has loaded the route, maneuver and voice instruction sources
+
+page_load and map_ready are measured in headless Chromium with playwright (pip install playwright && playwright
+install chromium), and map_ready needs a valid --mapbox-token and network access for the map style. Without
+them, they are reported as not measured.
+
+Usage:
+    python benchmarks/page_load.py [--shape hairpin] [--points 1000000] [--mapbox-token pk...] [--output page_load.json]
+"""
+import argparse
+import functools
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gpx_to_directions_route as converter
+from synthetic_gpx import SHAPES, synthetic_gpx_file
+
+try:
+    from playwright.sync_api import Error as PlaywrightError, sync_playwright  # optional, browser timings
+except ImportError:
+    sync_playwright = None
+
+# Map sources the page adds in map.on('load'), see create_html_map_view
+MAP_SOURCES = ["route", "maneuvers", "voice-instructions"]
+
+
+class QuietRequestHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def measure_data_load(base_url, data_file_names, repeat=3):
+    """
+    Returns:
+        Best time in seconds of fetching and parsing all GeoJSON files
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for data_file_name in data_file_names:
+            with urllib.request.urlopen(base_url + data_file_name) as response:
+                json.loads(response.read())
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def measure_browser_load(page_url, timeout_seconds=120):
+    """
+    Returns:
+        (page_load seconds, map_ready seconds, reason) with None for the times that could not be measured and
+        the reason why (None if both were measured)
+    """
+    if sync_playwright is None:
+        return None, None, "playwright is not installed"
+    with sync_playwright() as playwright:
+        try:
+            browser = playwright.chromium.launch()
+        except PlaywrightError as e:
+            return None, None, f"no headless browser: {str(e).splitlines()[0]}"
+        try:
+            page = browser.new_page()
+            page.goto(page_url, wait_until="load", timeout=timeout_seconds * 1000)
+            page_load = page.evaluate("performance.getEntriesByType('navigation')[0].loadEventEnd") / 1000
+            try:
+                page.wait_for_function(
+                    "sources => typeof map !== 'undefined' && "
+                    "sources.every(source => map.getSource(source) && map.isSourceLoaded(source))",
+                    arg=MAP_SOURCES, timeout=timeout_seconds * 1000, polling=50)
+            except PlaywrightError:
+                return page_load, None, "the map did not load its sources (check --mapbox-token and network)"
+            return page_load, page.evaluate("performance.now()") / 1000, None
+        finally:
+            browser.close()
+
+
+def measure_page_load(gpx_file_path, output_directory, mapbox_token, voice_instruction_distance=100, repeat=3):
+    """
+    Returns:
+        Dictionary of the route's counts, file sizes in bytes and load times in seconds (None if not measured)
+    """
+    gpx_converter = converter.GpxToDirectionsConverter([100], voice_instruction_distance, ingestion="stream")
+    result = gpx_converter.convert(gpx_file_path)
+    html_file_path = os.path.join(output_directory, "route_visualization.html")
+    file_paths = converter.create_html_map_view(result.response, voice_instruction_distance, result.waypoints,
+                                                mapbox_token, html_file_path)
+    data_file_names = [os.path.basename(file_path) for file_path in file_paths[1:]]
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0),
+                                 functools.partial(QuietRequestHandler, directory=output_directory))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        base_url = f"http://127.0.0.1:{server.server_address[1]}/"
+        data_load = measure_data_load(base_url, data_file_names, repeat)
+        page_load, map_ready, not_measured_reason = measure_browser_load(base_url + os.path.basename(html_file_path))
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    return {
+        "gpx_file": os.path.basename(gpx_file_path),
+        "simplified_points": len(result.waypoints),
+        "steps": sum(len(leg["steps"]) for leg in result.response["routes"][0]["legs"]),
+        "html_bytes": os.path.getsize(html_file_path),
+        "geojson_bytes": sum(os.path.getsize(file_path) for file_path in file_paths[1:]),
+        "data_load_seconds": data_load,
+        "page_load_seconds": page_load,
+        "map_ready_seconds": map_ready,
+        "browser_not_measured_reason": not_measured_reason
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Size and load time of the HTML map view of a synthetic route")
+    parser.add_argument('--shape', choices=SHAPES, default="hairpin")
+    parser.add_argument('--points', type=int, default=1000000, help="points of the synthetic track")
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), "gpx_benchmark_data"),
+                        help="directory for the generated GPX files (reused across runs)")
+    parser.add_argument('--voice-instruction-distance', type=float, default=100)
+    parser.add_argument('--mapbox-token', default="benchmark-token", help="token for the map style (map_ready)")
+    parser.add_argument('--repeat', type=int, default=3, help="data loads, the fastest is reported")
+    parser.add_argument('--output', help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    gpx_file_path = synthetic_gpx_file(args.data_dir, args.shape, args.points)
+    with tempfile.TemporaryDirectory() as output_directory:
+        results = measure_page_load(gpx_file_path, output_directory, args.mapbox_token,
+                                    args.voice_instruction_distance, args.repeat)
+
+    print(f"{results['gpx_file']}: {results['simplified_points']} simplified points, {results['steps']} steps")
+    print(f"  HTML          {results['html_bytes'] / 1e6:>9.3f} MB")
+    print(f"  GeoJSON       {results['geojson_bytes'] / 1e6:>9.3f} MB")
+    print(f"  data_load     {results['data_load_seconds']:>9.3f}s")
+    for name in ("page_load", "map_ready"):
+        seconds = results[f"{name}_seconds"]
+        if seconds is None:
+            print(f"  {name:<13} not measured: {results['browser_not_measured_reason']}")
+        else:
+            print(f"  {name:<13} {seconds:>9.3f}s")
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
@@ -0,0 +1,214 @@
+"""
+Stage-level benchmark suite of the GPX converter.
+
+Synthetic tracks (see synthetic_gpx.py) of every shape and size are converted stage by stage, and the best
+time of each stage is recorded:
+
+    parse_gpxpy          gpxpy.parse of the file
+    parse_stream         stream_gpx_coordinates of the file
+    simplification       legged_simplification of the streamed coordinates
+    maneuver_detection   compute_leg_geometry and classify_maneuvers over the simplified leg
+    voice_placement      calculate_safe_voice_instruction_distances and find_position_before_point (with a
+                         RouteIndex) for every maneuver
+    step_building        GpxToDirectionsConverter.convert_waypoints (steps, voice instructions, route geometry)
+    serialize_compact    serialize_route_response(compact=True)
+    serialize_indented   serialize_route_response
+    html_map_view        create_html_map_view into a temporary directory (HTML and GeoJSON files); the write
+                         time only, the page load time is measured by page_load.py
+
+Results are written to a JSON file. Pass an earlier results file with --compare to list stages that became
+slower than --threshold times their previous time; the exit code is then 1.
+
+Usage:
+    python benchmarks/run_benchmarks.py --output benchmark_results.json
+    python benchmarks/run_benchmarks.py --sizes 1000 10000 --compare benchmark_results.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import gpxpy
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gpx_to_directions_route as converter
+from synthetic_gpx import SHAPES, synthetic_gpx_file
+
+DEFAULT_SIZES = [1000, 10000, 100000, 1000000]
+
+# Stages faster than this are too noisy to be reported as regressions
+NOISE_FLOOR_SECONDS = 0.005
+
+
+def best_of(function, repeat):
+    """
+    Return (result, fastest time in seconds) of repeat calls of function.
+    """
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def detect_maneuvers(waypoints):
+    """
+    Segment indices starting with a maneuver, detected like iter_leg_steps does.
+
+    Returns:
+        Tuple (maneuver indices, per-segment distances)
+    """
+    bearings, bearing_deltas, distances = converter.compute_leg_geometry(waypoints)
+    maneuver_indices = np.flatnonzero(converter.classify_maneuvers(bearings, bearing_deltas)).tolist()
+    return maneuver_indices, distances.tolist()
+
+
+def place_voice_instructions(waypoints, maneuver_indices, distances, voice_instruction_distance):
+    """
+    Safe distance and location of every maneuver's voice instruction, via the module-level helpers.
+    """
+    route_index = converter.RouteIndex(waypoints, distances, maneuver_indices)
+    maneuver_locations = [[waypoints[i]["longitude"], waypoints[i]["latitude"]] for i in maneuver_indices]
+    safe_distances = converter.calculate_safe_voice_instruction_distances(
+        maneuver_locations, waypoints, voice_instruction_distance, route_index)
+    return [converter.find_position_before_point(waypoints, location, safe_distance, route_index)
+            for location, safe_distance in zip(maneuver_locations, safe_distances)]
+
+
+def benchmark_file(gpx_file_path, voice_instruction_distance=100, repeat=3):
+    """
+    Time every stage of converting one GPX file.
+
+    Returns:
+        Tuple (dictionary of stage name to seconds, number of simplified points, number of maneuvers)
+    """
+    timings = {}
+    with open(gpx_file_path, 'rb') as gpx_file:
+        gpx_data = gpx_file.read()
+
+    _, timings["parse_gpxpy"] = best_of(lambda: gpxpy.parse(gpx_data.decode('utf-8')), repeat)
+    coordinates, timings["parse_stream"] = best_of(lambda: converter.stream_gpx_coordinates(gpx_file_path), repeat)
+    waypoints_array, timings["simplification"] = best_of(
+        lambda: converter.legged_simplification(coordinates, percentages=[100]), repeat)
+    waypoints = waypoints_array[0]
+
+    (maneuver_indices, distances), timings["maneuver_detection"] = best_of(lambda: detect_maneuvers(waypoints),
+                                                                           repeat)
+    _, timings["voice_placement"] = best_of(
+        lambda: place_voice_instructions(waypoints, maneuver_indices, distances, voice_instruction_distance), repeat)
+
+    gpx_converter = converter.GpxToDirectionsConverter([100], voice_instruction_distance)
+    result, timings["step_building"] = best_of(lambda: gpx_converter.convert_waypoints(waypoints_array), repeat)
+    _, timings["serialize_compact"] = best_of(
+        lambda: converter.serialize_route_response(result.response, compact=True), repeat)
+    _, timings["serialize_indented"] = best_of(lambda: converter.serialize_route_response(result.response), repeat)
+
+    with tempfile.TemporaryDirectory() as directory:
+        html_file_path = os.path.join(directory, "route_visualization.html")
+        _, timings["html_map_view"] = best_of(
+            lambda: converter.create_html_map_view(result.response, voice_instruction_distance, result.waypoints,
+                                                   "benchmark-token", html_file_path), repeat)
+
+    return timings, len(waypoints), len(maneuver_indices)
+
+
+def git_commit():
+    # Commit of the benchmarked tree, if it is a git checkout
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(shapes, sizes, data_directory, voice_instruction_distance=100, repeat=3):
+    """
+    Run the benchmark suite.
+
+    Returns:
+        Results dictionary as written to the output file
+    """
+    results = []
+    for shape in shapes:
+        for point_count in sizes:
+            gpx_file_path = synthetic_gpx_file(data_directory, shape, point_count)
+            # Very large inputs take seconds per stage; one run is enough there
+            timings, simplified_points, maneuvers = benchmark_file(
+                gpx_file_path, voice_instruction_distance, repeat if point_count < 1000000 else 1)
+            for stage, seconds in timings.items():
+                results.append({
+                    "shape": shape,
+                    "points": point_count,
+                    "simplified_points": simplified_points,
+                    "maneuvers": maneuvers,
+                    "stage": stage,
+                    "seconds": seconds
+                })
+                print(f"{shape:<11} {point_count:>8} {stage:<19} {seconds:>9.4f}s", flush=True)
+
+    return {
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "orjson": converter.orjson is not None,
+        "voice_instruction_distance": voice_instruction_distance,
+        "repeat": repeat,
+        "results": results
+    }
+
+
+def compare_results(previous, current, threshold=1.2):
+    """
+    Stages that became slower than threshold times their previous time.
+
+    Returns:
+        List of (shape, points, stage, previous seconds, current seconds)
+    """
+    previous_seconds = {(r["shape"], r["points"], r["stage"]): r["seconds"] for r in previous["results"]}
+    regressions = []
+    for result in current["results"]:
+        key = (result["shape"], result["points"], result["stage"])
+        if key not in previous_seconds:
+            continue
+        before, after = previous_seconds[key], result["seconds"]
+        if after > before * threshold and after - before > NOISE_FLOOR_SECONDS:
+            regressions.append(key + (before, after))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Time every conversion stage on synthetic GPX tracks")
+    parser.add_argument('--shapes', nargs='+', choices=SHAPES, default=list(SHAPES))
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help="track points")
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), "gpx_benchmark_data"),
+                        help="directory for the generated GPX files (reused across runs)")
+    parser.add_argument('--voice-instruction-distance', type=float, default=100)
+    parser.add_argument('--repeat', type=int, default=3, help="runs per stage, the fastest is reported")
+    parser.add_argument('--output', default="benchmark_results.json")
+    parser.add_argument('--compare', help="earlier results file to check for regressions")
+    parser.add_argument('--threshold', type=float, default=1.2, help="slowdown factor reported as a regression")
+    args = parser.parse_args()
+
+    current = run_benchmarks(args.shapes, args.sizes, args.data_dir, args.voice_instruction_distance, args.repeat)
+    with open(args.output, 'w') as output_file:
+        json.dump(current, output_file, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as previous_file:
+            previous = json.load(previous_file)
+        regressions = compare_results(previous, current, args.threshold)
+        for shape, point_count, stage, before, after in regressions:
+            print(f"REGRESSION {shape} {point_count} {stage}: {before:.4f}s -> {after:.4f}s ({after / before:.2f}x)")
+        print(f"{len(regressions)} regressions against {args.compare} (commit {previous.get('git_commit')})")
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,90 @@
+"""
+Time the two stages of legged_simplification separately.
+
+Stage 1 builds the LineString: the previous GeoJSON text round trip (str() of the coordinate list, then
+geojson.loads and shapely's shape) against waypoints_line_string, which feeds the coordinate arrays
+directly. Stage 2 simplifies it: with the tolerance in degrees against simplify_in_meters. GPX parsing is
+not included. The GeoJSON stage is skipped if the geojson package is not installed.
+
+Usage:
+    python benchmarks/simplification.py path/to/track.gpx [--tolerance 0.00001] [--tolerance-meters 1]
+"""
+import argparse
+import os
+import sys
+import time
+
+import gpxpy
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gpx_to_directions_route as converter
+
+try:
+    import geojson
+    from shapely.geometry import shape
+except ImportError:
+    geojson = None
+
+
+def geojson_line_string(waypoints):
+    # LineString construction of legged_simplification before the direct path
+    coordinates_array = [[waypoint.longitude, waypoint.latitude] for waypoint in waypoints]
+    input_geojson = ('{"type": "Feature","geometry": {"type": "LineString", "coordinates": '
+                     + str(coordinates_array) + '},"properties": {}}')
+    return shape(geojson.loads(input_geojson)['geometry'])
+
+
+def best_of(function, repeat):
+    """
+    Return (result, fastest time in seconds) of repeat calls of function.
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def measure_simplification(waypoints, tolerance=0.00001, tolerance_meters=1.0, repeat=3):
+    """
+    Returns:
+        Dictionary of stage timings in seconds (geometry_geojson, geometry_direct, simplify_degrees,
+        simplify_meters) and the vertex counts before and after simplification
+    """
+    results = {"points": len(waypoints)}
+    geom, results["geometry_direct"] = best_of(lambda: converter.waypoints_line_string(waypoints), repeat)
+    if geojson is not None:
+        geojson_geom, results["geometry_geojson"] = best_of(lambda: geojson_line_string(waypoints), repeat)
+        if not np.array_equal(np.asarray(geojson_geom.coords), np.asarray(geom.coords)):
+            raise AssertionError("Direct LineString differs from the GeoJSON round trip")
+
+    simplified, results["simplify_degrees"] = best_of(lambda: geom.simplify(tolerance), repeat)
+    results["points_degrees"] = len(simplified.coords)
+    simplified, results["simplify_meters"] = best_of(lambda: converter.simplify_in_meters(geom, tolerance_meters),
+                                                     repeat)
+    results["points_meters"] = len(simplified.coords)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Time LineString construction and simplification separately")
+    parser.add_argument('gpx_files', nargs='+')
+    parser.add_argument('--tolerance', type=float, default=0.00001, help="degrees")
+    parser.add_argument('--tolerance-meters', type=float, default=1.0)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'file':<24} {'points':>8} {'geojson s':>10} {'direct s':>9} "
+          f"{'deg s':>7} {'deg pts':>8} {'meter s':>8} {'m pts':>7}")
+    for gpx_file_path in args.gpx_files:
+        with open(gpx_file_path, 'r') as gpx_file:
+            gpx = gpxpy.parse(gpx_file)
+        waypoints = gpx.tracks[0].segments[0].points if gpx.tracks else gpx.routes[0].points
+        result = measure_simplification(waypoints, args.tolerance, args.tolerance_meters, args.repeat)
+        geojson_seconds = f"{result['geometry_geojson']:>10.3f}" if "geometry_geojson" in result else f"{'-':>10}"
+        print(f"{os.path.basename(gpx_file_path):<24} {result['points']:>8} {geojson_seconds} "
+              f"{result['geometry_direct']:>9.3f} {result['simplify_degrees']:>7.3f} {result['points_degrees']:>8} "
+              f"{result['simplify_meters']:>8.3f} {result['points_meters']:>7}")
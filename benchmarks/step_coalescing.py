@@ -0,0 +1,59 @@
+"""
+Report how much step coalescing shrinks converted routes.
+
+Every file is converted with one step per simplified segment and with coalesce_steps (one step per maneuver),
+and the step counts and the sizes of the compact and indented JSON are compared. Without files, synthetic
+tracks of every shape (see synthetic_gpx.py) are used.
+
+Usage:
+    python benchmarks/step_coalescing.py [path/to/track.gpx ...] [--points 100000] [--voice-instruction-distance 100]
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gpx_to_directions_route as converter
+from synthetic_gpx import SHAPES, synthetic_gpx_file
+
+
+def measure_coalescing(gpx_file_path, voice_instruction_distance=100):
+    """
+    Returns:
+        Dictionary with "segments" and "coalesced" entries, each holding the step count and the compact and
+        indented JSON sizes in bytes
+    """
+    results = {}
+    for mode, coalesce_steps in (("segments", False), ("coalesced", True)):
+        gpx_converter = converter.GpxToDirectionsConverter([100], voice_instruction_distance, ingestion="stream",
+                                                           coalesce_steps=coalesce_steps)
+        response = gpx_converter.convert(gpx_file_path).response
+        results[mode] = {
+            "steps": sum(len(leg["steps"]) for route in response["routes"] for leg in route["legs"]),
+            "compact_bytes": len(converter.serialize_route_response(response, compact=True)),
+            "indented_bytes": len(converter.serialize_route_response(response))
+        }
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Step count and JSON size with and without step coalescing")
+    parser.add_argument('gpx_files', nargs='*', help="GPX files (default: synthetic tracks of every shape)")
+    parser.add_argument('--points', type=int, default=100000, help="points of the synthetic tracks")
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), "gpx_benchmark_data"),
+                        help="directory for the generated GPX files (reused across runs)")
+    parser.add_argument('--voice-instruction-distance', type=float, default=100)
+    args = parser.parse_args()
+
+    gpx_file_paths = args.gpx_files or [synthetic_gpx_file(args.data_dir, shape, args.points) for shape in SHAPES]
+    print(f"{'file':<28} {'steps':>8} {'coalesced':>10} {'compact MB':>11} {'coalesced':>10} "
+          f"{'indented MB':>12} {'coalesced':>10} {'saved':>6}")
+    for gpx_file_path in gpx_file_paths:
+        result = measure_coalescing(gpx_file_path, args.voice_instruction_distance)
+        segments, coalesced = result["segments"], result["coalesced"]
+        saved = 1 - coalesced["compact_bytes"] / segments["compact_bytes"]
+        print(f"{os.path.basename(gpx_file_path):<28} {segments['steps']:>8} {coalesced['steps']:>10} "
+              f"{segments['compact_bytes'] / 1e6:>11.2f} {coalesced['compact_bytes'] / 1e6:>10.2f} "
+              f"{segments['indented_bytes'] / 1e6:>12.2f} {coalesced['indented_bytes'] / 1e6:>10.2f} {saved:>6.0%}")
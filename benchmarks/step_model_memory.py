@@ -0,0 +1,71 @@
+"""
+Compare the memory held by a leg's steps as RouteStep records and as Mapbox step dictionaries.
+
+A zigzag route with the requested number of steps is built with build_leg (RouteStep records). The same
+steps are then expanded with RouteStep.to_dict, which is what the converter held per step before the
+compact model. Allocations are measured with tracemalloc, excluding the input waypoints.
+
+Usage:
+    python benchmarks/step_model_memory.py [--steps 100000] [--voice-instruction-distance 100]
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gpx_to_directions_route as converter
+
+
+def zigzag_waypoints(step_count):
+    """
+    Waypoints of a route turning left and right every ~100 m, so most steps carry a maneuver.
+    """
+    waypoints = []
+    for i in range(step_count + 1):
+        waypoints.append({"latitude": 52.0 + i * 0.0009, "longitude": 13.0 + (i % 2) * 0.0006})
+    return waypoints
+
+
+def measure_step_models(step_count, voice_instruction_distance=100):
+    """
+    Returns:
+        Dictionary with the step count and, for the "records" and "dicts" models, the retained bytes of the
+        steps and the seconds taken to build them
+    """
+    waypoints = zigzag_waypoints(step_count)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    leg = converter.build_leg(waypoints, voice_instruction_distance)
+    records_seconds = time.perf_counter() - start
+    records_bytes = tracemalloc.get_traced_memory()[0]
+
+    start = time.perf_counter()
+    step_dicts = [step.to_dict() for step in leg["steps"]]
+    dicts_seconds = time.perf_counter() - start
+    dicts_bytes = tracemalloc.get_traced_memory()[0] - records_bytes
+    tracemalloc.stop()
+
+    return {
+        "steps": len(step_dicts),
+        "records": {"bytes": records_bytes, "seconds": records_seconds},
+        "dicts": {"bytes": dicts_bytes, "seconds": dicts_seconds}
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Memory of RouteStep records vs. Mapbox step dictionaries")
+    parser.add_argument('--steps', type=int, default=100000)
+    parser.add_argument('--voice-instruction-distance', type=float, default=100)
+    args = parser.parse_args()
+
+    result = measure_step_models(args.steps, args.voice_instruction_distance)
+    print(f"{result['steps']} steps")
+    print(f"{'model':<8} {'MB':>8} {'bytes/step':>11} {'seconds':>8}")
+    for model in ("records", "dicts"):
+        model_bytes = result[model]["bytes"]
+        print(f"{model:<8} {model_bytes / 1e6:>8.1f} {model_bytes / result['steps']:>11.0f} "
+              f"{result[model]['seconds']:>8.2f}")
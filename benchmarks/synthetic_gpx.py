@@ -0,0 +1,127 @@
+"""
+Generate synthetic GPX tracks for benchmarks.
+
+Shapes:
+    straight    a near-straight drive with GPS jitter (few maneuvers, simplifies to few points)
+    urban_grid  a random walk on a city block grid with 90 degree turns at intersections
+    hairpin     a mountain road of switchbacks with tight 180 degree turns (many sharp maneuvers)
+
+Points are spaced about 5 m apart. Tracks are deterministic for a given shape, size and seed.
+
+Usage:
+    python benchmarks/synthetic_gpx.py urban_grid 100000 urban_grid_100k.gpx [--seed 0]
+"""
+import argparse
+import math
+import os
+import random
+
+SHAPES = ("straight", "urban_grid", "hairpin")
+
+POINT_SPACING_METERS = 5.0
+GPS_NOISE_METERS = 0.2  # standard deviation of the jitter added to every point
+EARTH_RADIUS_METERS = 6371000.0
+ORIGIN = (47.0, 11.0)  # latitude, longitude of the first point
+
+
+def _local_offsets(shape, point_count, rng):
+    # Yield (east, north) offsets in meters from ORIGIN along the generated path
+    east, north = 0.0, 0.0
+    if shape == "straight":
+        heading = math.radians(80)
+        for _ in range(point_count):
+            yield east + rng.gauss(0, GPS_NOISE_METERS), north + rng.gauss(0, GPS_NOISE_METERS)
+            east += POINT_SPACING_METERS * math.sin(heading)
+            north += POINT_SPACING_METERS * math.cos(heading)
+    elif shape == "urban_grid":
+        heading = 0  # multiples of 90 degrees
+        until_intersection = rng.randint(16, 30)
+        for _ in range(point_count):
+            yield east + rng.gauss(0, GPS_NOISE_METERS), north + rng.gauss(0, GPS_NOISE_METERS)
+            east += POINT_SPACING_METERS * math.sin(math.radians(heading))
+            north += POINT_SPACING_METERS * math.cos(math.radians(heading))
+            until_intersection -= 1
+            if until_intersection == 0:
+                heading = (heading + rng.choice((-90, 0, 90))) % 360
+                until_intersection = rng.randint(16, 30)
+    elif shape == "hairpin":
+        heading = 90.0
+        turn_direction = -1  # the first switchback turns left
+        until_turn = rng.randint(20, 40)
+        turn_steps = 0
+        for _ in range(point_count):
+            yield east + rng.gauss(0, GPS_NOISE_METERS), north + rng.gauss(0, GPS_NOISE_METERS)
+            east += POINT_SPACING_METERS * math.sin(math.radians(heading))
+            north += POINT_SPACING_METERS * math.cos(math.radians(heading))
+            if turn_steps:
+                # A switchback: 180 degrees over six points (about a 10 m radius)
+                heading += turn_direction * 30.0
+                turn_steps -= 1
+                if turn_steps == 0:
+                    turn_direction = -turn_direction
+                    until_turn = rng.randint(20, 40)
+            else:
+                until_turn -= 1
+                if until_turn == 0:
+                    turn_steps = 6
+    else:
+        raise ValueError(f"Shape must be one of {', '.join(SHAPES)}")
+
+
+def generate_track(shape, point_count, seed=0):
+    """
+    Generate the coordinates of a synthetic track.
+
+    Args:
+        shape: One of SHAPES
+        point_count: Number of track points
+        seed: Random seed
+
+    Returns:
+        Iterator of (latitude, longitude) tuples
+    """
+    rng = random.Random(f"{shape}-{point_count}-{seed}")
+    latitude_origin, longitude_origin = ORIGIN
+    meters_per_degree_latitude = math.radians(1) * EARTH_RADIUS_METERS
+    meters_per_degree_longitude = meters_per_degree_latitude * math.cos(math.radians(latitude_origin))
+    for east, north in _local_offsets(shape, point_count, rng):
+        yield (latitude_origin + north / meters_per_degree_latitude,
+               longitude_origin + east / meters_per_degree_longitude)
+
+
+def write_gpx(file_path, coordinates):
+    """
+    Write coordinates as a single-segment GPX track, streaming them to the file.
+    """
+    with open(file_path, 'w') as gpx_file:
+        gpx_file.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                       '<gpx version="1.1" creator="synthetic_gpx" xmlns="http://www.topografix.com/GPX/1/1">\n'
+                       '<trk><name>synthetic</name><trkseg>\n')
+        for latitude, longitude in coordinates:
+            gpx_file.write(f'<trkpt lat="{latitude:.7f}" lon="{longitude:.7f}"></trkpt>\n')
+        gpx_file.write('</trkseg></trk>\n</gpx>\n')
+
+
+def synthetic_gpx_file(directory, shape, point_count, seed=0):
+    """
+    Path of a synthetic GPX file in directory, generated unless it already exists.
+    """
+    file_path = os.path.join(directory, f"{shape}_{point_count}_{seed}.gpx")
+    if not os.path.exists(file_path):
+        os.makedirs(directory, exist_ok=True)
+        temporary_path = file_path + '.tmp'
+        write_gpx(temporary_path, generate_track(shape, point_count, seed))
+        os.replace(temporary_path, file_path)
+    return file_path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate a synthetic GPX track")
+    parser.add_argument('shape', choices=SHAPES)
+    parser.add_argument('points', type=int)
+    parser.add_argument('output', help="GPX file to write")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    write_gpx(args.output, generate_track(args.shape, args.points, args.seed))
+    print(f"Wrote {args.points} {args.shape} points to {args.output}")
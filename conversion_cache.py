@@ -0,0 +1,162 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+# On-disk, content-addressed cache of conversion results.
+#
+# Entries are keyed by a hash of the GPX bytes and every parameter that affects the output, and stored as
+# <directory>/<key[:2]>/<key>.json. Entries are written to a temporary file and renamed into place, so concurrent
+# workers (threads or processes) sharing a directory never see partial entries. Hits refresh an entry's
+# modification time, and the least recently used entries are evicted once the cache exceeds max_bytes.
+# The total size is scanned once when a cache object is created and then kept up to date by its puts, so the
+# directory is only scanned again to evict. Entries written by other processes are counted at that next scan,
+# so a directory shared by several processes can exceed max_bytes by what the others wrote in the meantime.
+
+# Bump when the converter's output changes, so older entries are no longer hit
+CACHE_FORMAT_VERSION = 2
+
+
+class ConversionCache:
+    """
+    Size-bounded LRU cache of compact DirectionsResponse JSON documents on disk.
+    """
+
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024):
+        """
+        Args:
+            directory: Cache directory, created if missing; may be shared between processes
+            max_bytes: Total size of the entries above which least recently used entries are evicted
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._total_bytes = sum(size for _, size, _ in self._entries())
+
+    def __getstate__(self):
+        # Picklable for process pools; every process counts its own hits and misses
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(gpx_data, parameters):
+        """
+        Cache key of a conversion.
+
+        Args:
+            gpx_data: GPX document as bytes
+            parameters: Dictionary of all parameters that affect the output (JSON serializable)
+
+        Returns:
+            Hex SHA-256 digest of the GPX bytes, the parameters and the cache format version
+        """
+        digest = hashlib.sha256()
+        digest.update(gpx_data)
+        digest.update(json.dumps({"version": CACHE_FORMAT_VERSION, "parameters": parameters},
+                                 sort_keys=True).encode('utf-8'))
+        return digest.hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.json')
+
+    def get(self, key):
+        """
+        Return the cached DirectionsResponse JSON bytes for key, or None on a miss.
+        """
+        path = self._entry_path(key)
+        try:
+            with open(path, 'rb') as entry_file:
+                content = entry_file.read()
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        try:
+            os.utime(path)  # mark as recently used
+        except FileNotFoundError:
+            pass  # evicted by another worker in the meantime
+        with self._lock:
+            self.hits += 1
+        return content
+
+    def put(self, key, route_response):
+        """
+        Store DirectionsResponse JSON bytes atomically and evict old entries if the cache is too large.
+        """
+        path = self._entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            replaced_bytes = os.stat(path).st_size
+        except FileNotFoundError:
+            replaced_bytes = 0
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(file_descriptor, 'wb') as entry_file:
+                entry_file.write(route_response)
+            os.replace(temporary_path, path)
+        except BaseException:
+            os.unlink(temporary_path)
+            raise
+        with self._lock:
+            self._total_bytes += len(route_response) - replaced_bytes
+            over_limit = self._total_bytes > self.max_bytes
+        if over_limit:
+            self.evict()
+
+    def _entries(self):
+        entries = []
+        for shard in os.scandir(self.directory):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if not entry.name.endswith('.json'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def evict(self):
+        """
+        Remove least recently used entries until the cache holds at most max_bytes.
+
+        Scans the directory, which also corrects the running total for entries written or removed by other
+        processes.
+        """
+        entries = self._entries()
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass  # already evicted by another worker
+            total_bytes -= size
+        with self._lock:
+            self._total_bytes = total_bytes
+
+    def stats(self):
+        """
+        Hit/miss counters of this cache object and the current size of the cache directory.
+        """
+        entries = self._entries()
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "entries": len(entries),
+            "bytes": sum(size for _, size, _ in entries)
+        }
@@ -0,0 +1,265 @@
+import argparse
+import gzip
+import json
+import math
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from xml.etree.ElementTree import ParseError
+
+from gpxpy.gpx import GPXException
+
+import gpx_to_directions_route as converter
+from conversion_cache import ConversionCache
+
+# Small self-hosted HTTP service around the GPX converter.
+#
+#   POST /convert?voice_instruction_distance=100&leg_percentages=20,80&language=0&compact=1&track_policy=segment_legs
+#                &coalesce_steps=1&output_profile=lean
+#        body: the GPX document (e.g. curl --data-binary @route.gpx -H 'Content-Type: application/gpx+xml')
+#        response: DirectionsRoute JSON (indented unless compact=1), gzip or brotli encoded if the client sends
+#                  Accept-Encoding: gzip / br (br needs the brotli package)
+#   GET  /health
+#
+# Conversions run on a pool of worker processes that are started and warmed up (imports done) before the server
+# accepts requests. At most max_concurrent conversions are in flight; further requests wait up to queue_timeout
+# seconds and are then rejected with 503. Bodies larger than max_request_bytes are rejected with 413.
+
+LANGUAGES = {"0": 0, "1": 1, "en": 0, "ar": 1}
+
+# Response compression of each Accept-Encoding content coding, in order of preference
+CONTENT_ENCODINGS = {"br": "brotli", "gzip": "gzip"}
+
+# Errors caused by the uploaded GPX or the parameters (answered with 400 instead of 500)
+CLIENT_ERRORS = (ValueError, GPXException, ParseError)
+
+
+_cache = None  # ConversionCache of this worker process
+
+
+def _init_worker(cache_directory, cache_max_bytes):
+    global _cache
+    if cache_directory:
+        _cache = ConversionCache(cache_directory, cache_max_bytes)
+
+
+def _warm_up():
+    # Touch the converter's dependencies so the first real request does not pay for imports
+    converter.compute_leg_geometry([{"latitude": 0.0, "longitude": 0.0}, {"latitude": 0.001, "longitude": 0.001}])
+    return True
+
+
+def _convert(gpx_data, leg_percentages, voice_instruction_distance, language, compact, track_policy,
+             coalesce_steps=False, output_profile="full", content_encoding=None):
+    try:
+        # Requests already run in parallel on the pool, so segments are converted serially
+        gpx_converter = converter.GpxToDirectionsConverter(leg_percentages, voice_instruction_distance, language,
+                                                           cache=_cache, track_policy=track_policy,
+                                                           segment_workers=1, coalesce_steps=coalesce_steps)
+        result = gpx_converter.convert_data(gpx_data)
+        # Serialized and compressed in the worker, so only bytes travel back to the server process
+        serialized = converter.serialize_route_response(result.response, compact, output_profile=output_profile)
+        if content_encoding == "gzip":
+            return gzip.compress(serialized, converter.DEFAULT_COMPRESSION_LEVELS["gzip"], mtime=0)
+        if content_encoding == "br":
+            return converter.brotli.compress(serialized, quality=converter.DEFAULT_COMPRESSION_LEVELS["brotli"])
+        return serialized
+    except CLIENT_ERRORS as e:
+        # Re-raised as plain exceptions: gpxpy's exceptions cannot be unpickled and would break the pool
+        raise ValueError(f"{type(e).__name__}: {e}") from None
+    except Exception as e:
+        raise RuntimeError(f"{type(e).__name__}: {e}") from None
+
+
+def parse_conversion_parameters(query):
+    """
+    Parse the conversion parameters of a /convert query string.
+
+    Returns:
+        Tuple (leg_percentages, voice_instruction_distance, language, compact, track_policy, coalesce_steps,
+        output_profile)
+
+    Raises:
+        ValueError: if a parameter is malformed
+    """
+    parameters = parse_qs(query)
+    voice_instruction_distance = float(parameters.get("voice_instruction_distance", ["0"])[0])
+    if not math.isfinite(voice_instruction_distance) or voice_instruction_distance < 0:
+        # nan would end up as null (or bare NaN) distances in the response
+        raise ValueError("Voice instruction distance must be a finite, non-negative number of meters")
+    leg_percentages = [int(p) for p in parameters.get("leg_percentages", ["100"])[0].split(",")]
+    language = parameters.get("language", ["0"])[0]
+    if language not in LANGUAGES:
+        raise ValueError("Language must be 0/en or 1/ar")
+    compact = parameters.get("compact", ["0"])[0] in ("1", "true")
+    track_policy = parameters.get("track_policy", ["first"])[0]
+    if track_policy not in converter.TRACK_POLICIES:
+        raise ValueError(f"Track policy must be one of {', '.join(converter.TRACK_POLICIES)}")
+    coalesce_steps = parameters.get("coalesce_steps", ["0"])[0] in ("1", "true")
+    output_profile = parameters.get("output_profile", ["full"])[0]
+    if output_profile not in converter.OUTPUT_PROFILES:
+        raise ValueError(f"Output profile must be one of {', '.join(converter.OUTPUT_PROFILES)}")
+    return (leg_percentages, voice_instruction_distance, LANGUAGES[language], compact, track_policy, coalesce_steps,
+            output_profile)
+
+
+def negotiate_content_encoding(accept_encoding):
+    """
+    Content coding of a response for the Accept-Encoding header of a request.
+
+    Returns:
+        "br" (if the brotli package is installed), "gzip" or None (identity), see CONTENT_ENCODINGS
+    """
+    accepted = set()
+    for coding in (accept_encoding or "").split(","):
+        name, _, parameters = coding.partition(";")
+        try:
+            if parameters.strip().startswith("q=") and float(parameters.strip()[2:]) == 0:
+                continue  # explicitly not acceptable
+        except ValueError:
+            continue
+        accepted.add(name.strip().lower())
+    for content_encoding in CONTENT_ENCODINGS:
+        if content_encoding in accepted and (content_encoding != "br" or converter.brotli is not None):
+            return content_encoding
+    return None
+
+
+class ConversionServer(ThreadingHTTPServer):
+    """
+    HTTP server handing GPX conversions to a pre-warmed process pool.
+    """
+    daemon_threads = True
+
+    def __init__(self, server_address, workers=None, max_concurrent=None, max_request_bytes=20 * 1024 * 1024,
+                 queue_timeout=30.0, cache_directory=None, cache_max_bytes=512 * 1024 * 1024):
+        """
+        Args:
+            server_address: (host, port) to listen on
+            workers: Number of conversion worker processes (default: number of CPUs)
+            max_concurrent: Maximum number of conversions in flight (default: 2 * workers)
+            max_request_bytes: Maximum size of an uploaded GPX document
+            queue_timeout: Seconds a request waits for a free conversion slot before it is rejected
+            cache_directory: Optional ConversionCache directory shared by the workers
+            cache_max_bytes: Size bound of the cache directory
+        """
+        worker_count = workers or os.cpu_count() or 1
+        self.pool = ProcessPoolExecutor(max_workers=worker_count, initializer=_init_worker,
+                                        initargs=(cache_directory, cache_max_bytes))
+        # Start and warm up every worker before accepting requests
+        for future in [self.pool.submit(_warm_up) for _ in range(worker_count)]:
+            future.result()
+
+        self.conversion_slots = threading.BoundedSemaphore(max_concurrent or 2 * worker_count)
+        self.max_request_bytes = max_request_bytes
+        self.queue_timeout = queue_timeout
+        super().__init__(server_address, ConversionRequestHandler)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown()
+
+
+class ConversionRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if urlparse(self.path).path == "/health":
+            self._send_json(200, {"status": "ok"})
+        else:
+            self._send_json(404, {"error": "Not found"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/convert":
+            self._send_json(404, {"error": "Not found"})
+            return
+
+        content_length = self.headers.get("Content-Length")
+        if content_length is None:
+            self._send_json(411, {"error": "Content-Length required"})
+            return
+        try:
+            content_length = int(content_length)
+        except ValueError:
+            content_length = -1
+        if content_length < 0:
+            # The body's end is unknown, so the connection can't be reused
+            self._send_json(400, {"error": "Content-Length must be a non-negative integer"})
+            self.close_connection = True
+            return
+        if content_length > self.server.max_request_bytes:
+            self._send_json(413, {"error": f"GPX larger than {self.server.max_request_bytes} bytes"})
+            self.close_connection = True
+            return
+
+        try:
+            (leg_percentages, voice_instruction_distance, language, compact, track_policy, coalesce_steps,
+             output_profile) = parse_conversion_parameters(url.query)
+        except ValueError as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        gpx_data = self.rfile.read(content_length)
+        content_encoding = negotiate_content_encoding(self.headers.get("Accept-Encoding"))
+
+        if not self.server.conversion_slots.acquire(timeout=self.server.queue_timeout):
+            self._send_json(503, {"error": "Too many concurrent conversions"})
+            return
+        try:
+            future = self.server.pool.submit(_convert, gpx_data, leg_percentages, voice_instruction_distance,
+                                             language, compact, track_policy, coalesce_steps, output_profile,
+                                             content_encoding)
+            route_response = future.result()
+        except ValueError as e:
+            # Malformed GPX or invalid parameters
+            self._send_json(400, {"error": str(e)})
+            return
+        except Exception as e:
+            self._send_json(500, {"error": str(e)})
+            return
+        finally:
+            self.server.conversion_slots.release()
+
+        self._send_body(200, route_response, content_encoding)
+
+    def _send_json(self, status, content):
+        self._send_body(status, json.dumps(content).encode("utf-8"))
+
+    def _send_body(self, status, body, content_encoding=None):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        if content_encoding is not None:
+            self.send_header("Content-Encoding", content_encoding)
+            self.send_header("Vary", "Accept-Encoding")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve GPX to DirectionsRoute conversions over HTTP")
+    parser.add_argument('--host', default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=None, help="conversion processes (default: number of CPUs)")
+    parser.add_argument('--max-concurrent', type=int, default=None,
+                        help="conversions in flight (default: 2 x workers)")
+    parser.add_argument('--max-request-bytes', type=int, default=20 * 1024 * 1024)
+    parser.add_argument('--queue-timeout', type=float, default=30.0,
+                        help="seconds to wait for a free conversion slot before answering 503")
+    parser.add_argument('--cache-dir', help="reuse conversions of identical GPX content and parameters from here")
+    parser.add_argument('--cache-max-mb', type=float, default=512, help="size bound of the cache directory")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    server = ConversionServer((args.host, args.port), args.workers, args.max_concurrent, args.max_request_bytes,
+                              args.queue_timeout, args.cache_dir, int(args.cache_max_mb * 1024 * 1024))
+    print(f"Workers warmed up in {time.perf_counter() - start:.2f}s, "
+          f"listening on http://{args.host}:{args.port}/convert")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -6,19 +6,311 @@ import json
 import gpxpy
 import polyline
 import json
+import argparse
+import copy
+import gzip
+import io
 import math
+import os
+import sys
+import time
+import tracemalloc
+import warnings
+import xml.etree.ElementTree as ElementTree
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager, nullcontext
+from enum import IntEnum
+from uuid import uuid4
+from itertools import accumulate
 from math import sin, cos, sqrt, atan2, radians
 
-import geojson
-from shapely.geometry import shape, mapping
+import numpy as np
+
+try:
+    import orjson  # optional, faster JSON backend
+except ImportError:
+    orjson = None
+
+try:
+    import brotli  # optional, brotli-compressed output
+except ImportError:
+    brotli = None
+
+try:
+    import resource  # peak RSS in conversion profiles; not available on Windows
+except ImportError:
+    resource = None
+
 from shapely.geometry.linestring import LineString
 
+from waypoint_cache import load_waypoint_cache, store_waypoint_cache
+
 # This script converts a GPX track to a route object (without routeOptions) that can be converted by the navigation SDK
 # (after selecting the route from the route array) to a navigationRoute
-# Ensure that the GPX has only ONE single trkseg!!!
+# By default only the first trkseg is converted; see TRACK_POLICIES for files with several tracks or segments
 # It creates a HTML file to visualize the route for better debugging purposes
 
-def legged_simplification(waypoints, tolerance=0.00001, percentages=None):
+# Compact track coordinates (array('d') of longitudes and latitudes) as produced by stream_gpx_coordinates
+TrackCoordinates = namedtuple('TrackCoordinates', ['longitudes', 'latitudes'])
+
+# How GPX files with several tracks and segments (or routes) are converted:
+#   first:        only the first segment of the first track (or the first route)
+#   segment_legs: one route; every segment is simplified on its own and becomes its own leg(s)
+#   track_routes: one route per track (its segments concatenated); routes are converted like tracks
+#   concatenate:  all segments of all tracks joined into one track
+TRACK_POLICIES = ("first", "segment_legs", "track_routes", "concatenate")
+
+# Tracks with fewer points in total are converted serially, as starting worker processes would cost more
+PARALLEL_MIN_POINTS = 50000
+
+
+def stream_gpx_coordinates(gpx_file_path):
+    """
+    Read the coordinates of a GPX file incrementally without building a gpxpy object tree.
+
+    <trkpt>/<rtept> elements are parsed one at a time into compact coordinate arrays and cleared as soon as
+    they have been read, so memory use is bound by the coordinate arrays rather than the XML tree.
+    Like the gpxpy path of gpx_to_mapbox_directions_response, the first segment of the first track is used,
+    or the first route if the file has no tracks.
+
+    Args:
+        gpx_file_path: Path of the GPX file, or a binary file object
+
+    Returns:
+        TrackCoordinates with the longitudes and latitudes (empty if there are neither tracks nor routes)
+    """
+    track = TrackCoordinates(array('d'), array('d'))
+    route = TrackCoordinates(array('d'), array('d'))
+    track_count = 0
+    segment_count = 0
+    route_count = 0
+    parents = []
+
+    for event, element in ElementTree.iterparse(gpx_file_path, events=('start', 'end')):
+        tag = element.tag.rpartition('}')[2]  # strip the GPX namespace
+        if event == 'start':
+            if tag == 'trk':
+                track_count += 1
+            elif tag == 'trkseg':
+                segment_count += 1
+            elif tag == 'rte':
+                route_count += 1
+            parents.append(element)
+            continue
+
+        parents.pop()
+        if tag == 'trkpt' and track_count == 1 and segment_count == 1:
+            track.longitudes.append(float(element.get('lon')))
+            track.latitudes.append(float(element.get('lat')))
+        elif tag == 'rtept' and route_count == 1 and track_count == 0:
+            route.longitudes.append(float(element.get('lon')))
+            route.latitudes.append(float(element.get('lat')))
+
+        if tag in ('trkpt', 'rtept', 'wpt', 'trkseg', 'trk', 'rte'):
+            # Drop the parsed element and its already processed siblings
+            element.clear()
+            if parents:
+                del parents[-1][:]
+
+    return track if track_count > 0 else route
+
+
+def stream_gpx_tracks(gpx_file_path):
+    """
+    Read the coordinates of all tracks and segments of a GPX file incrementally (see stream_gpx_coordinates).
+
+    Args:
+        gpx_file_path: Path of the GPX file, or a binary file object
+
+    Returns:
+        List of tracks, each a list of TrackCoordinates segments in document order. If the file has no tracks,
+        each route is returned as a track with a single segment.
+    """
+    tracks = []
+    routes = []
+    parents = []
+
+    for event, element in ElementTree.iterparse(gpx_file_path, events=('start', 'end')):
+        tag = element.tag.rpartition('}')[2]  # strip the GPX namespace
+        if event == 'start':
+            if tag == 'trk':
+                tracks.append([])
+            elif tag == 'trkseg' and tracks:
+                tracks[-1].append(TrackCoordinates(array('d'), array('d')))
+            elif tag == 'rte':
+                routes.append([TrackCoordinates(array('d'), array('d'))])
+            parents.append(element)
+            continue
+
+        parents.pop()
+        if tag == 'trkpt' and tracks and tracks[-1]:
+            segment = tracks[-1][-1]
+            segment.longitudes.append(float(element.get('lon')))
+            segment.latitudes.append(float(element.get('lat')))
+        elif tag == 'rtept' and routes:
+            segment = routes[-1][0]
+            segment.longitudes.append(float(element.get('lon')))
+            segment.latitudes.append(float(element.get('lat')))
+
+        if tag in ('trkpt', 'rtept', 'wpt', 'trkseg', 'trk', 'rte'):
+            # Drop the parsed element and its already processed siblings
+            element.clear()
+            if parents:
+                del parents[-1][:]
+
+    return tracks if tracks else routes
+
+
+def gpxpy_tracks(gpx):
+    """
+    Coordinates of all tracks and segments of a parsed gpxpy document, in the form of stream_gpx_tracks.
+    """
+    def coordinates(points):
+        return TrackCoordinates(array('d', (point.longitude for point in points)),
+                                array('d', (point.latitude for point in points)))
+
+    if gpx.tracks:
+        return [[coordinates(segment.points) for segment in track.segments] for track in gpx.tracks]
+    return [[coordinates(route.points)] for route in gpx.routes]
+
+
+def concatenate_track_coordinates(segments):
+    """
+    Join TrackCoordinates segments into one TrackCoordinates.
+    """
+    joined = TrackCoordinates(array('d'), array('d'))
+    for segment in segments:
+        joined.longitudes.extend(segment.longitudes)
+        joined.latitudes.extend(segment.latitudes)
+    return joined
+
+
+def _round_coordinates(values, precision=6):
+    # Python's round (as used by geojson), not np.round, so results are identical to the GeoJSON path
+    return np.fromiter((round(value, precision) for value in values), dtype=np.float64, count=len(values))
+
+
+def waypoints_line_string(waypoints):
+    """
+    Build the LineString of a track directly from its coordinates.
+
+    Coordinates are rounded to 6 decimals with Python's round, exactly like the GeoJSON text parsing
+    (geojson.loads) this replaces, so simplification results are unchanged.
+
+    Args:
+        waypoints: TrackCoordinates or a sequence of points with longitude/latitude attributes (gpxpy)
+
+    Returns:
+        LineString with (longitude, latitude) coordinates
+    """
+    return LineString(np.column_stack(rounded_coordinate_columns(waypoints)))
+
+
+def rounded_coordinate_columns(waypoints):
+    """
+    Longitudes and latitudes of a track rounded to 6 decimals, as used by waypoints_line_string.
+
+    Args:
+        waypoints: TrackCoordinates or a sequence of points with longitude/latitude attributes (gpxpy)
+
+    Returns:
+        Tuple (longitudes, latitudes) of float64 numpy arrays
+    """
+    if isinstance(waypoints, TrackCoordinates):
+        longitudes, latitudes = waypoints.longitudes, waypoints.latitudes
+    else:
+        longitudes = [waypoint.longitude for waypoint in waypoints]
+        latitudes = [waypoint.latitude for waypoint in waypoints]
+    return _round_coordinates(longitudes), _round_coordinates(latitudes)
+
+
+def simplify_in_meters(geom, tolerance_meters):
+    """
+    Simplify a LineString with a tolerance in meters instead of degrees.
+
+    The line is projected to a local equirectangular plane (meters east/north of its mean position, see
+    haversine_distance for the earth radius), simplified there and mapped back to its original vertices,
+    so a tolerance removes the same detail at every latitude. Distortion grows with the track's
+    north-south extent, which is negligible for tracks spanning a few hundred kilometers.
+
+    Args:
+        geom: LineString with (longitude, latitude) coordinates
+        tolerance_meters: Douglas-Peucker tolerance in meters
+
+    Returns:
+        Simplified LineString whose coordinates are a subset of geom's coordinates
+    """
+    coordinates = np.asarray(geom.coords)
+    latitude_origin = coordinates[:, 1].mean()
+    longitude_origin = coordinates[:, 0].mean()
+    meters_per_radian = 6371000.0
+    x = np.radians(coordinates[:, 0] - longitude_origin) * (meters_per_radian * cos(radians(latitude_origin)))
+    y = np.radians(coordinates[:, 1] - latitude_origin) * meters_per_radian
+
+    # Vertex indices ride along as Z values: the simplifier works in 2D and keeps the Z of retained vertices
+    projected = LineString(np.column_stack((x, y, np.arange(len(coordinates), dtype=np.float64))))
+    kept_indices = np.asarray(projected.simplify(tolerance_meters).coords)[:, 2].astype(np.intp)
+    return LineString(coordinates[kept_indices])
+
+
+def simplify_line_string(geom, tolerance=0.00001, tolerance_meters=None):
+    """
+    Simplify a track's LineString with Douglas-Peucker.
+
+    Args:
+        geom: LineString with (longitude, latitude) coordinates, see waypoints_line_string
+        tolerance: Simplification tolerance in degrees
+        tolerance_meters: Optional simplification tolerance in meters, used instead of tolerance
+
+    Returns:
+        Simplified LineString
+    """
+    if tolerance_meters is not None:
+        return simplify_in_meters(geom, tolerance_meters)
+    return geom.simplify(tolerance)
+
+
+def simplify_coordinate_columns(longitudes, latitudes, tolerance=0.00001, tolerance_meters=None):
+    """
+    Simplify a track given as rounded coordinate columns (see rounded_coordinate_columns).
+
+    Returns:
+        (vertices, 2) array of the simplified longitudes and latitudes
+    """
+    return np.asarray(simplify_line_string(LineString(np.column_stack((longitudes, latitudes))), tolerance,
+                                           tolerance_meters).coords)
+
+
+def legged_simplification(waypoints, tolerance=0.00001, percentages=None, tolerance_meters=None):
+    """
+    Simplify a track with Douglas-Peucker and split the result into legs.
+
+    Args:
+        waypoints: TrackCoordinates or a sequence of gpxpy points
+        tolerance: Simplification tolerance in degrees
+        percentages: Integer percentages of the simplified waypoints in each leg, must sum to 100
+        tolerance_meters: Optional simplification tolerance in meters, used instead of tolerance
+            (see simplify_in_meters)
+
+    Returns:
+        List of legs, each a list of waypoint dictionaries with 'latitude' and 'longitude' keys
+    """
+    validate_leg_percentages(percentages)
+
+    # Build the LineString geometry straight from the coordinates and simplify it
+    simplified_geom = simplify_line_string(waypoints_line_string(waypoints), tolerance, tolerance_meters)
+
+    # Extract simplified coordinates
+    return split_into_legs(simplified_geom.coords[:], percentages)
+
+
+def validate_leg_percentages(percentages):
+    """
+    Raise ValueError unless percentages is a list of integer leg percentages summing to 100.
+    """
     # Ensure percentages parameter is provided
     if percentages is None:
         raise ValueError("Percentages parameter must be provided")
@@ -30,22 +322,18 @@ def legged_simplification(waypoints, tolerance=0.00001, percentages=None):
     if sum(percentages) != 100:
         raise ValueError("Percentages must sum to 100")
 
-    # Convert waypoints to a GeoJSON LineString
-    coordinates_array = [[waypoint.longitude, waypoint.latitude] for waypoint in waypoints]
-    input_geojson = '{"type": "Feature","geometry": {"type": "LineString", "coordinates": ' + str(coordinates_array) + '},"properties": {}}'
 
-    # Parse the input GeoJSON
-    geojson_obj = geojson.loads(input_geojson)
-
-    # Extract the LineString geometry
-    geom = shape(geojson_obj['geometry'])
-
-    # Simplify the LineString geometry
-    simplified_geom = geom.simplify(tolerance)
+def split_into_legs(simplified_coordinates, percentages):
+    """
+    Split simplified coordinates into legs, see legged_simplification.
 
-    # Extract simplified coordinates
-    simplified_coordinates = simplified_geom.coords[:]
+    Args:
+        simplified_coordinates: Sequence of (longitude, latitude) pairs
+        percentages: Integer percentages of the coordinates in each leg, must sum to 100
 
+    Returns:
+        List of legs, each a list of waypoint dictionaries with 'latitude' and 'longitude' keys
+    """
     # Determine the size of each subset
     total_points = len(simplified_coordinates)
     subsets_sizes = [int(round(total_points * (p / 100.0))) for p in percentages]
@@ -115,330 +403,1638 @@ def calculate_bearing(lat1, lon1, lat2, lon2):
     return bearing
 
 
-def gpx_to_mapbox_directions_response(gpx_file_path, voice_instruction_distance=0):
-    global global_waypoints
-    global leg_percentages
-    language = 0  # language: 0 = english, 1 = arabic
-    # Parse the GPX file
-    complete_gpx_file_path = "gpx_input_files/"+ str(gpx_file_path)
-    with open(complete_gpx_file_path, 'r') as gpx_file:
-        gpx = gpxpy.parse(gpx_file)
-
-    # Extract waypoints from the GPX file
-    if len(gpx.tracks) > 0:
-        # GPX contains tracks --> parse tracks
-        track = gpx.tracks[0]
-        segment = track.segments[0]
-        waypoints = segment.points
-        # simplify geometry:
-        waypoints_array = legged_simplification(waypoints, tolerance=0.00001, percentages=leg_percentages)
+# Maximum difference between compute_leg_geometry and compute_leg_geometry_reference.
+# NumPy's vectorized trigonometry may round differently from the math module in the last ulp,
+# which shows up as ~1e-13 degrees / ~1e-8 meters even on continent-sized segments.
+BEARING_TOLERANCE_DEGREES = 1e-9
+DISTANCE_TOLERANCE_METERS = 1e-6
 
-    else:
-        if len(gpx.routes) > 0:
-            # parse GPX routes
-            segment = gpx.routes[0]
-            waypoints = segment.points
-            # simplify geometry:
-            waypoints_array = legged_simplification(waypoints, tolerance=0.00001, percentages=leg_percentages)
-        else:
-            print("Neither tracks nor routes in GPX data")
-
-    legs_array = [] # array to hold the legs
-    route_distance_total = 0
-    route_weight_total = 0
-    route_duration_total = 0
-    route_waypoints = None
-    route_waypoints_data = None
-
-
-    for waypoints in waypoints_array:  #iterate over waypoints_lists in waypoints_array
-        # Convert waypoints to the required format
-        waypoints_data = []
-        for point in waypoints:
-            waypoints_data.append({
-                "distance": 0,  # Placeholder for distance
-                "name": "",  # Placeholder for name
-                "location": [point["longitude"], point["latitude"]]
-            })
 
-        # First pass: collect all maneuver locations and instructions for proper voice instruction planning
-        maneuver_data = []  # Will store {location, instruction, index}
-        bearing_old = 0
-
-        for i in range(len(waypoints) - 1):
-            start_point = waypoints[i]
-            end_point = waypoints[i + 1]
-
-            # Calculate the current bearing
-            bearing = calculate_bearing(start_point["latitude"], start_point["longitude"], end_point["latitude"],
-                                             end_point["longitude"])
-            # Calculate deviation from last bearing
-            bearing_delta = bearing - bearing_old
-
-            # Create bearing dependent instructions
-            right_turn_text = ["Make a right turn", "اتجه يمينًا"]
-            sharp_right_turn_text = ["Make a sharp right turn", "قم بالانعطاف الحاد إلى اليمين"]
-            left_turn_text = ["Make a left turn", "اتخذ المنعطف الأيسر"]
-            sharp_left_turn_text = ["Make a sharp left turn", "قم بإجراء انعطاف حاد إلى اليسار"]
-
-            instruction_text = ""
-            if bearing_delta > 0 and abs(bearing_delta) < 20:
-                instruction_text = ""
-            if bearing_delta > 0 and abs(bearing_delta) > 20 and abs(bearing_delta) < 120:
-                instruction_text = right_turn_text[language]
-            if bearing_delta > 0 and abs(bearing_delta) > 120 and abs(bearing_delta) < 180:
-                instruction_text = sharp_right_turn_text[language]
-            if bearing_delta > 0 and abs(bearing_delta) > 180 :
-                instruction_text = sharp_left_turn_text[language]
-            if bearing_delta < 0 and abs(bearing_delta) < 20:
-                instruction_text = ""
-            if bearing_delta < 0 and abs(bearing_delta) > 20 and abs(bearing_delta) < 120:
-                instruction_text = left_turn_text[language]
-            if bearing_delta < 0 and abs(bearing_delta) > 120 and abs(bearing_delta) < 180:
-                instruction_text = sharp_left_turn_text[language]
-            if bearing_old == 0:
-                instruction_text = ""
-
-            # Store maneuver data if it has an instruction
-            if instruction_text and bearing_old != 0:
-                maneuver_data.append({
-                    'location': [start_point["longitude"], start_point["latitude"]],
-                    'instruction': instruction_text,
-                    'step_index': i
-                })
+def compute_leg_geometry(waypoints):
+    """
+    Compute bearings, bearing deltas and distances for all segments of a leg in one batched call.
 
-            bearing_old = bearing
+    This is the NumPy-backed counterpart of calling calculate_bearing and haversine_distance per segment.
+    Results match compute_leg_geometry_reference within BEARING_TOLERANCE_DEGREES and
+    DISTANCE_TOLERANCE_METERS.
 
-        # Calculate safe distances for voice instructions
-        maneuver_locations = [m['location'] for m in maneuver_data]
-        safe_distances = calculate_safe_voice_instruction_distances(maneuver_locations, waypoints, voice_instruction_distance)
+    Args:
+        waypoints: List of waypoint dictionaries with 'latitude' and 'longitude' keys
 
-        # Second pass: generate steps with proper voice instruction positioning
-        steps = []
-        distance_total = 0
-        weight_total = 0
-        duration_total = 0
-        bearing_old = 0
-        bearing = 0
+    Returns:
+        Tuple (bearings, bearing_deltas, distances) of NumPy arrays with one entry per segment.
+        bearing_deltas[i] is bearings[i] minus the previous segment's bearing (0 before the first segment).
+    """
+    lats = np.fromiter((point["latitude"] for point in waypoints), dtype=np.float64, count=len(waypoints))
+    lons = np.fromiter((point["longitude"] for point in waypoints), dtype=np.float64, count=len(waypoints))
+    if len(waypoints) < 2:
+        empty = np.zeros(0, dtype=np.float64)
+        return empty, empty.copy(), empty.copy()
 
-        for i in range(len(waypoints) - 1):
-            start_point = waypoints[i]
-            end_point = waypoints[i + 1]
+    lat1, lat2 = lats[:-1], lats[1:]
+    lon1, lon2 = lons[:-1], lons[1:]
 
-            # calculate the current bearing
-            bearing = calculate_bearing(start_point["latitude"], start_point["longitude"], end_point["latitude"],
-                                             end_point["longitude"])
+    # Haversine distance, same formulation as haversine_distance
+    dlat = np.radians(lat2 - lat1)
+    dlon = np.radians(lon2 - lon1)
+    a = np.sin(dlat / 2) ** 2 + np.cos(np.radians(lat1)) * np.cos(np.radians(lat2)) * np.sin(dlon / 2) ** 2
+    distances = 6371000.0 * (2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a)))
 
-            # calculate deviation from last bearing
-            bearing_delta = bearing - bearing_old
+    # Initial bearing, same formulation as calculate_bearing
+    phi1 = np.radians(lat1)
+    phi2 = np.radians(lat2)
+    d_lambda = np.radians(lon2) - np.radians(lon1)
+    x = np.sin(d_lambda) * np.cos(phi2)
+    y = np.cos(phi1) * np.sin(phi2) - (np.sin(phi1) * np.cos(phi2) * np.cos(d_lambda))
+    bearings = (np.degrees(np.arctan2(x, y)) + 360) % 360
 
-            # Calculate 2D distance between two waypoints using Haversine formula
-            distance_2d = haversine_distance(start_point["latitude"], start_point["longitude"], end_point["latitude"],
-                                             end_point["longitude"])
+    # Deviation from the previous segment's bearing (the converter starts with bearing_old = 0)
+    bearing_deltas = np.diff(bearings, prepend=0.0)
 
-            # Calculate the difference in elevation
-            elevation_diff = 0 # end_point["elevation"] - start_point["elevation"] if end_point["elevation"] and start_point["elevation"] else 0
+    return bearings, bearing_deltas, distances
 
-            # Calculate 3D distance considering the elevation difference
-            distance = sqrt(distance_2d ** 2 + elevation_diff ** 2)
 
-            duration = distance / 10  # Assuming a constant speed of 10 m/s
-            weight = duration
+def compute_leg_geometry_reference(waypoints):
+    """
+    Scalar reference implementation of compute_leg_geometry using calculate_bearing and haversine_distance.
 
-            distance_total += distance
-            duration_total += duration
-            weight_total += weight
+    Args:
+        waypoints: List of waypoint dictionaries with 'latitude' and 'longitude' keys
 
-            # compute when maneuver should be announced
-            distanceAlongGeometry = 30 if distance < 60  else 50
+    Returns:
+        Tuple (bearings, bearing_deltas, distances) of lists with one entry per segment
+    """
+    bearings = []
+    bearing_deltas = []
+    distances = []
+    bearing_old = 0
+    for i in range(len(waypoints) - 1):
+        start_point = waypoints[i]
+        end_point = waypoints[i + 1]
+        bearing = calculate_bearing(start_point["latitude"], start_point["longitude"], end_point["latitude"],
+                                    end_point["longitude"])
+        bearings.append(bearing)
+        bearing_deltas.append(bearing - bearing_old)
+        distances.append(haversine_distance(start_point["latitude"], start_point["longitude"],
+                                            end_point["latitude"], end_point["longitude"]))
+        bearing_old = bearing
+    return bearings, bearing_deltas, distances
+
+
+class ManeuverType(IntEnum):
+    """
+    Maneuver at the start of a segment, classified from the change of bearing (see MANEUVER_CLASSES).
+    """
+    STRAIGHT = 0  # no maneuver
+    RIGHT = 1
+    SHARP_RIGHT = 2
+    LEFT = 3
+    SHARP_LEFT = 4
+
+
+# Classification of bearing deltas normalized to [-180, 180): rows of (smallest absolute delta in degrees,
+# maneuver type of a positive (clockwise) delta, maneuver type of a negative delta). Each row applies from its
+# bound up to the next row's bound, so 20 degrees is a turn and 120 degrees a sharp turn; a U-turn (-180) is
+# a sharp left turn.
+MANEUVER_CLASSES = (
+    (0, ManeuverType.STRAIGHT, ManeuverType.STRAIGHT),
+    (20, ManeuverType.RIGHT, ManeuverType.LEFT),
+    (120, ManeuverType.SHARP_RIGHT, ManeuverType.SHARP_LEFT),
+)
+
+# Bearing dependent instruction texts, indexed by language (0 = english, 1 = arabic)
+right_turn_text = ["Make a right turn", "اتجه يمينًا"]
+sharp_right_turn_text = ["Make a sharp right turn", "قم بالانعطاف الحاد إلى اليمين"]
+left_turn_text = ["Make a left turn", "اتخذ المنعطف الأيسر"]
+sharp_left_turn_text = ["Make a sharp left turn", "قم بإجراء انعطاف حاد إلى اليسار"]
+
+# Instruction text of each maneuver type, indexed by language
+MANEUVER_INSTRUCTION_TEXTS = {
+    ManeuverType.STRAIGHT: ["", ""],
+    ManeuverType.RIGHT: right_turn_text,
+    ManeuverType.SHARP_RIGHT: sharp_right_turn_text,
+    ManeuverType.LEFT: left_turn_text,
+    ManeuverType.SHARP_LEFT: sharp_left_turn_text
+}
+
+# Modifier of the Mapbox maneuver and banner instruction of each maneuver type
+MANEUVER_MODIFIERS = {
+    ManeuverType.STRAIGHT: "straight",
+    ManeuverType.RIGHT: "right",
+    ManeuverType.SHARP_RIGHT: "sharp",
+    ManeuverType.LEFT: "left",
+    ManeuverType.SHARP_LEFT: "sharp"
+}
+
+# Maneuver type of each instruction text, for steps built from a text only
+_MANEUVER_TYPES_BY_TEXT = {text: maneuver_type for maneuver_type, texts in MANEUVER_INSTRUCTION_TEXTS.items()
+                           for text in texts}
+
+_MANEUVER_CLASS_BOUNDS = np.array([row[0] for row in MANEUVER_CLASSES[1:]], dtype=np.float64)
+_MANEUVER_CLASS_TYPES = np.array([[row[1] for row in MANEUVER_CLASSES], [row[2] for row in MANEUVER_CLASSES]],
+                                 dtype=np.int8)
+
+
+def normalize_bearing_deltas(bearing_deltas):
+    """
+    Wrap bearing deltas into [-180, 180) degrees, e.g. 350 -> -10 (a slight left) and -300 -> 60.
 
-            # Get instruction for current step's maneuver
-            current_step_maneuver = None
-            for maneuver in maneuver_data:
-                if maneuver['step_index'] == i:
-                    current_step_maneuver = maneuver
-                    break
+    Deltas already in range are returned unchanged (not recomputed), so they are bit for bit the input.
+    """
+    bearing_deltas = np.asarray(bearing_deltas, dtype=np.float64)
+    out_of_range = (bearing_deltas >= 180) | (bearing_deltas < -180)
+    return np.where(out_of_range, np.remainder(bearing_deltas + 180, 360) - 180, bearing_deltas)
+
+
+def classify_maneuvers(bearings, bearing_deltas):
+    """
+    Classify the maneuver at the start of every segment of a leg in one vectorized pass.
+
+    Args:
+        bearings: Bearing of every segment, see compute_leg_geometry
+        bearing_deltas: Change of bearing at the start of every segment, see compute_leg_geometry
+
+    Returns:
+        NumPy int8 array with the ManeuverType of every segment. The first segment of a leg, and any segment
+        following one with a bearing of exactly 0, has no maneuver (STRAIGHT), as before.
+    """
+    bearings = np.asarray(bearings, dtype=np.float64)
+    # a leg without segments (fewer than 2 vertices) has nothing to classify
+    if len(bearings) == 0:
+        return np.empty(0, dtype=np.int8)
+    normalized = normalize_bearing_deltas(bearing_deltas)
+    rows = np.searchsorted(_MANEUVER_CLASS_BOUNDS, np.abs(normalized), side='right')
+    maneuver_types = np.where(normalized > 0, _MANEUVER_CLASS_TYPES[0][rows], _MANEUVER_CLASS_TYPES[1][rows])
+    previous_bearings = np.concatenate(([0.0], bearings[:-1]))
+    maneuver_types[previous_bearings == 0] = ManeuverType.STRAIGHT
+    return maneuver_types.astype(np.int8)
+
+
+def maneuver_instruction_text(bearing_delta, bearing_old, language=0):
+    """
+    Create the bearing dependent instruction for a segment ("" if there is no maneuver).
+
+    Scalar form of classify_maneuvers followed by the MANEUVER_INSTRUCTION_TEXTS lookup.
+
+    Args:
+        bearing_delta: Deviation in degrees of the segment's bearing from the previous segment's bearing
+        bearing_old: Bearing of the previous segment (0 for the first segment of a leg)
+        language: 0 = english, 1 = arabic
+
+    Returns:
+        Instruction text, empty if the segment does not start with a maneuver
+    """
+    maneuver_type = ManeuverType(int(classify_maneuvers([bearing_old, 0.0], [0.0, bearing_delta])[1]))
+    return MANEUVER_INSTRUCTION_TEXTS[maneuver_type][language]
+
+
+def maneuver_modifier(instruction_text):
+    """
+    Maneuver modifier of an instruction text (see MANEUVER_MODIFIERS), "straight" for an unknown text.
+    """
+    return MANEUVER_MODIFIERS[_MANEUVER_TYPES_BY_TEXT.get(instruction_text, ManeuverType.STRAIGHT)]
+
+
+def iter_leg_steps(waypoints, voice_instruction_distance=0, language=0, route_polyline=None, first_segment=0,
+                   profile=None, previous_steps=None, previous_maneuver_indices=None, leg_geometry=None):
+    """
+    Generate the steps of a leg in a single pass over its segments.
+
+    Each segment's geometry is computed once (see compute_leg_geometry). A step is yielded as soon as no
+    later maneuver can place its voice instruction on it, i.e. once the route has advanced more than
+    voice_instruction_distance meters beyond the step's end, so only that look-ahead window of steps is
+    held in memory.
 
-            # Determine instruction and modifier for current step
-            instruction_text = current_step_maneuver['instruction'] if current_step_maneuver else ""
-
-            # Calculate modifier based on instruction
-            modifier = "straight"  # default
-            if instruction_text:
-                if "right" in instruction_text.lower() or "يمين" in instruction_text:
-                    modifier = "sharp" if "sharp" in instruction_text.lower() or "حاد" in instruction_text else "right"
-                elif "left" in instruction_text.lower() or "يسار" in instruction_text:
-                    modifier = "sharp" if "sharp" in instruction_text.lower() or "حاد" in instruction_text else "left"
-
-            # Create banner instruction object
-            banner_instr_obj = {
-                "primary": {
-                        "components": [
-                          {
-                            "type": "text",
-                            "text": instruction_text
-                          }
-                        ],
-                        "type": "turn",
-                        "modifier": modifier,
+    The generation can resume after the steps of an earlier conversion of a route that waypoints extends
+    (see IncrementalConverter): the first len(previous_steps) steps are then taken as they are and only the
+    following ones are generated. Voice instructions of the generated maneuvers may still land on previous
+    steps, so those within voice_instruction_distance of the first generated step are replaced in
+    previous_steps by copies without voice instructions of maneuvers from that step on.
+
+    Args:
+        waypoints: List of waypoint dictionaries with 'latitude' and 'longitude' keys
+        voice_instruction_distance: Desired distance in meters of voice instructions before their maneuver
+        language: 0 = english, 1 = arabic
+        route_polyline: Optional RoutePolyline of the whole route, from which the step geometries are taken
+        first_segment: Index in route_polyline of the leg's first segment
+        profile: Optional ConversionProfile accumulating the time spent placing voice instructions
+        previous_steps: Optional list of the leg's first steps as generated for the same waypoints; it is
+            modified in place (see above)
+        previous_maneuver_indices: Indices of the steps in previous_steps that start with a maneuver
+        leg_geometry: Optional result of compute_leg_geometry(waypoints), e.g. shared by conversions with
+            different voice instruction distances
+
+    Yields:
+        RouteStep records in route order, from step len(previous_steps) on
+    """
+    if leg_geometry is None:
+        leg_geometry = compute_leg_geometry(waypoints)
+    maneuver_types = classify_maneuvers(leg_geometry[0], leg_geometry[1]).tolist()
+    bearings, _, distances = (values.tolist() for values in leg_geometry)
+    maneuver_type_members = list(ManeuverType)  # indexed by value
+    instruction_texts = [MANEUVER_INSTRUCTION_TEXTS[maneuver_type][language] for maneuver_type in ManeuverType]
+    route_index = RouteIndex(waypoints, distances, previous_maneuver_indices)
+    cumulative_distances = route_index.cumulative_distances
+
+    voice_sweep = VoiceInstructionSweep(cumulative_distances)
+    pending_steps = deque()  # (step_index, step) not yet safe from voice instructions of later maneuvers
+    bearing_old = 0
+    start_step = len(previous_steps) if previous_steps else 0
+    if start_step:
+        bearing_old = bearings[start_step - 1]
+        # Voice instructions of maneuvers from start_step on are placed at or after this step (see horizon
+        # below); the sweep can start there as every earlier position lies before it
+        first_reachable = bisect_right(cumulative_distances,
+                                       cumulative_distances[start_step] - max(voice_instruction_distance, 0)) - 1
+        first_reachable = min(max(first_reachable, 0), start_step - 1)
+        voice_sweep.step_index = first_reachable
+        for step_index in range(first_reachable, start_step):
+            step = copy.copy(previous_steps[step_index])
+            step.voice_instructions = [voice_instruction for voice_instruction in step.voice_instructions
+                                       if voice_instruction.target_maneuver_step < start_step]
+            previous_steps[step_index] = step
+
+    for i in range(start_step, len(waypoints) - 1):
+        start_point = waypoints[i]
+        end_point = waypoints[i + 1]
+        bearing = bearings[i]
+        maneuver_type = maneuver_type_members[maneuver_types[i]]
+        instruction_text = instruction_texts[maneuver_type]
+
+        if maneuver_type:
+            if profile is not None:
+                voice_start = time.perf_counter()
+            # Voice instruction for this maneuver: never closer than half the distance to the previous maneuver
+            maneuver_number = len(route_index.maneuver_indices)
+            route_index.maneuver_indices.append(i)
+            safe_distance = voice_instruction_distance
+            if maneuver_number > 0:
+                distance_to_prev = route_index.distance_between_maneuvers(maneuver_number - 1, maneuver_number)
+                safe_distance = min(voice_instruction_distance, distance_to_prev / 2)
+            voice_instruction_location = route_index.position_before_maneuver(maneuver_number, safe_distance)
+
+            # Place it on the step (before the maneuver) that starts closest to it along the route
+            voice_distance_along = max(cumulative_distances[i] - max(safe_distance, 0), 0)
+            target_step_index = voice_sweep.target_step(voice_distance_along, i)
+            if target_step_index is not None:
+                if target_step_index < start_step:
+                    target_step = previous_steps[target_step_index]
+                else:
+                    target_step = pending_steps[target_step_index - pending_steps[0][0]][1]
+                target_step.voice_instructions.append(
+                    VoiceInstruction(instruction_text, voice_instruction_location, safe_distance, i))
+            if profile is not None:
+                profile.add_seconds("voice_placement", time.perf_counter() - voice_start)
+
+        pending_steps.append((i, RouteStep(start_point, end_point, bearing_old, bearing, distances[i],
+                                           instruction_text, route_polyline, first_segment + i, maneuver_type)))
+
+        # Later maneuvers start at vertex i + 1 or beyond, so their voice instructions cannot reach
+        # steps ending more than voice_instruction_distance before it
+        horizon = cumulative_distances[i + 1] - max(voice_instruction_distance, 0)
+        while pending_steps and cumulative_distances[pending_steps[0][0] + 1] < horizon:
+            yield pending_steps.popleft()[1]
+
+        bearing_old = bearing
+
+    while pending_steps:
+        yield pending_steps.popleft()[1]
+
+
+class VoiceInstruction:
+    """
+    Compact record of a voice instruction; the Mapbox dictionary is built by to_dict when serializing.
+    """
+    __slots__ = ('announcement', 'location', 'safe_distance_used', 'target_maneuver_step')
+
+    def __init__(self, announcement, location, safe_distance_used, target_maneuver_step):
+        self.announcement = announcement
+        self.location = location  # [longitude, latitude]
+        self.safe_distance_used = safe_distance_used
+        self.target_maneuver_step = target_maneuver_step  # index of the step starting with the announced maneuver
+
+    def to_dict(self, lean=False):
+        voice_instruction = {
+            "ssmlAnnouncement": "<speak><amazon:effect name=\"drc\"><prosody rate=\"1.08\">"+ str(self.announcement) +"</prosody></amazon:effect></speak>",
+            "announcement": self.announcement,
+            "distanceAlongGeometry": 30,  # Default distance
+            "location": self.location
+        }
+        if not lean:  # debug fields, see LEAN_OMITTED_FIELDS
+            voice_instruction["safe_distance_used"] = self.safe_distance_used
+            voice_instruction["target_maneuver_step"] = self.target_maneuver_step
+        return voice_instruction
+
+
+class RouteStep:
+    """
+    Compact record of a route step.
+
+    Only the values that differ between steps are stored (a few floats and a shared instruction string), about
+    a tenth of the memory of the nested Mapbox step dictionary. to_dict builds that dictionary, including the
+    encoded geometry, on demand; serialize_route_response calls it step by step while encoding, so the full
+    dictionaries of a route never exist at the same time.
+    """
+    __slots__ = ('start_longitude', 'start_latitude', 'end_longitude', 'end_latitude', 'bearing_before',
+                 'bearing_after', 'distance', 'instruction', 'maneuver_type', 'voice_instructions', 'route_polyline',
+                 'segment_index', 'segment_count')
+
+    def __init__(self, start_point, end_point, bearing_before, bearing, distance_2d, instruction_text,
+                 route_polyline=None, segment_index=0, maneuver_type=None):
+        self.start_longitude = start_point["longitude"]
+        self.start_latitude = start_point["latitude"]
+        self.end_longitude = end_point["longitude"]
+        self.end_latitude = end_point["latitude"]
+        self.bearing_before = bearing_before
+        self.bearing_after = bearing
+
+        # Calculate the difference in elevation
+        elevation_diff = 0 # end_point["elevation"] - start_point["elevation"] if end_point["elevation"] and start_point["elevation"] else 0
+
+        # Calculate 3D distance considering the elevation difference
+        self.distance = sqrt(distance_2d ** 2 + elevation_diff ** 2)
+        self.instruction = instruction_text
+        # ManeuverType, looked up from the instruction text if not given
+        if maneuver_type is None:
+            maneuver_type = _MANEUVER_TYPES_BY_TEXT.get(instruction_text, ManeuverType.STRAIGHT)
+        self.maneuver_type = maneuver_type
+        self.voice_instructions = []  # VoiceInstruction records, added to steps BEFORE their maneuvers
+        self.route_polyline = route_polyline  # RoutePolyline holding the encoded geometry, if any
+        self.segment_index = segment_index
+        self.segment_count = 1  # route segments covered by the step, more than one if coalesced (see coalesce_steps)
+
+    @property
+    def duration(self):
+        return self.distance / 10  # Assuming a constant speed of 10 m/s
+
+    @property
+    def weight(self):
+        return self.duration
+
+    def to_dict(self, lean=False):
+        """
+        Build the Mapbox DirectionsRoute step dictionary.
+
+        Args:
+            lean: Leave out the fields of LEAN_OMITTED_FIELDS (see OUTPUT_PROFILES)
+        """
+        duration = self.duration
+        weight = duration
+        instruction_text = self.instruction
+
+        # compute when maneuver should be announced
+        distanceAlongGeometry = 30 if self.distance < 60  else 50
+
+        modifier = MANEUVER_MODIFIERS[self.maneuver_type]
+
+        # Create banner instruction object
+        banner_instr_obj = {
+            "primary": {
+                    "components": [
+                      {
+                        "type": "text",
                         "text": instruction_text
-                      },
-                "distanceAlongGeometry": distanceAlongGeometry
-            }
-            # Voice instructions are handled separately - they will be added to steps BEFORE maneuvers
-            voice_instr_obj = None
-
-            # Create steps and intersections
-            step = {
-                "bannerInstructions": [banner_instr_obj],
-                "voiceInstructions": [voice_instr_obj] if voice_instr_obj else [],
-                "intersections": [
-                    {
-                        "entry": [True],
-                        "bearings": [0],
-                        "duration": duration,
-                        "mapbox_streets_v8": {"class": "street"},
-                        "is_urban": False,
-                        "admin_index": 0,
-                        "out": 0,
-                        "weight": weight,
-                        "geometry_index": 0,
-                        "location": [start_point["longitude"], start_point["latitude"]]
-                    }
-                ],
-                "maneuver": {
+                      }
+                    ],
                     "type": "turn",
-                    "instruction": instruction_text,
                     "modifier": modifier,
-                    "bearing_after": bearing,
-                    "bearing_before": bearing_old,
-                    "location": [start_point["longitude"], start_point["latitude"]]
-                },
-                "name": "",
-                "duration": duration,
-                "distance": distance,
-                "driving_side": "right",
-                "weight": weight,
-                "mode": "driving",
-                "geometry": polyline.encode(
-                    [(start_point["latitude"], start_point["longitude"]), (end_point["latitude"], end_point["longitude"])], precision=6)
-            }
-            steps.append(step)
+                    "text": instruction_text
+                  },
+            "distanceAlongGeometry": distanceAlongGeometry
+        }
 
-            bearing_old = bearing  # bearing no longer needed
+        # Create steps and intersections
+        step = {
+            "bannerInstructions": [banner_instr_obj],
+            "voiceInstructions": [voice_instruction.to_dict(lean) for voice_instruction in self.voice_instructions],
+            "intersections": [
+                {
+                    "entry": [True],
+                    "bearings": [0],
+                    "duration": duration,
+                    "mapbox_streets_v8": {"class": "street"},
+                    "is_urban": False,
+                    "admin_index": 0,
+                    "out": 0,
+                    "weight": weight,
+                    "geometry_index": 0,
+                    "location": [self.start_longitude, self.start_latitude]
+                }
+            ],
+            "maneuver": {
+                "type": "turn",
+                "instruction": instruction_text,
+                "modifier": modifier,
+                "bearing_after": self.bearing_after,
+                "bearing_before": self.bearing_before,
+                "location": [self.start_longitude, self.start_latitude]
+            },
+            "name": "",
+            "duration": duration,
+            "distance": self.distance,
+            "driving_side": "right",
+            "weight": weight,
+            "mode": "driving",
+            "geometry": self.geometry()
+        }
+        if lean:
+            del step["driving_side"]
+            intersection = step["intersections"][0]
+            for key in LEAN_OMITTED_FIELDS["intersection"]:
+                del intersection[key]
+        return step
+
+    def geometry(self):
+        """
+        Encoded polyline (precision 6) of the step's segment(s).
+        """
+        if self.route_polyline is not None:
+            if self.segment_count > 1:
+                return self.route_polyline.span_geometry(self.segment_index, self.segment_index + self.segment_count)
+            return self.route_polyline.segment_geometry(self.segment_index)
+        return polyline.encode(
+            [(self.start_latitude, self.start_longitude), (self.end_latitude, self.end_longitude)], precision=6)
+
+
+class RoutePolyline:
+    """
+    Encoded polylines (precision 6) of a route and of each of its segments, from one encoding pass.
 
-        # Third pass: Add voice instructions to steps BEFORE their corresponding maneuvers
-        for maneuver_idx, maneuver in enumerate(maneuver_data):
-            maneuver_step_index = maneuver['step_index']
-            maneuver_location = maneuver['location']
-            maneuver_instruction = maneuver['instruction']
+    All coordinates are quantized once and every value's characters are produced in a vectorized pass:
+    the absolute coordinates of each vertex and the deltas of each segment. A segment's polyline is the
+    absolute encoding of its start vertex followed by the segment's delta encoding, and the route's polyline
+    is the first vertex followed by all deltas, so both are slices of the shared buffers. The strings are
+    byte-identical to polyline.encode(..., precision=6).
+    """
 
-            # Get the safe distance for this maneuver
-            safe_distance = safe_distances[maneuver_idx] if maneuver_idx < len(safe_distances) else voice_instruction_distance
+    def __init__(self, waypoints):
+        """
+        Args:
+            waypoints: List of waypoint dictionaries with 'latitude' and 'longitude' keys, or TrackCoordinates
 
-            # Find the position where the voice instruction should be placed
-            voice_instruction_location = find_position_before_point(
-                waypoints,
-                maneuver_location,
-                safe_distance
-            )
+        Raises:
+            ValueError: if there are no waypoints
+        """
+        if isinstance(waypoints, TrackCoordinates):
+            latitudes, longitudes = waypoints.latitudes, waypoints.longitudes
+        else:
+            latitudes = [point["latitude"] for point in waypoints]
+            longitudes = [point["longitude"] for point in waypoints]
+        if len(latitudes) == 0:
+            raise ValueError("A route polyline needs at least one waypoint")
+        # (latitude, longitude) pairs of every vertex, quantized like polyline's Python 2 style rounding
+        coordinates = np.column_stack((np.asarray(latitudes, dtype=np.float64),
+                                       np.asarray(longitudes, dtype=np.float64))) * 1000000
+        quantized = (np.copysign(np.floor(np.abs(coordinates) + 0.5), coordinates)).astype(np.int64)
+
+        self.vertex_characters, vertex_offsets = _encode_polyline_values(quantized.ravel())
+        self.delta_characters, delta_offsets = _encode_polyline_values(np.diff(quantized, axis=0).ravel())
+        # Every vertex / segment is a (latitude, longitude) pair of values
+        self.vertex_offsets = array('q', vertex_offsets[::2].tobytes())
+        self.delta_offsets = array('q', delta_offsets[::2].tobytes())
+
+    def route_geometry(self):
+        """
+        Encoded polyline of the whole route.
+        """
+        return self.vertex_characters[:self.vertex_offsets[1]] + self.delta_characters
+
+    def segment_geometry(self, segment_index):
+        """
+        Encoded polyline of the segment from vertex segment_index to vertex segment_index + 1.
+        """
+        return (self.vertex_characters[self.vertex_offsets[segment_index]:self.vertex_offsets[segment_index + 1]]
+                + self.delta_characters[self.delta_offsets[segment_index]:self.delta_offsets[segment_index + 1]])
+
+    def span_geometry(self, first_vertex, last_vertex):
+        """
+        Encoded polyline of the vertices first_vertex to last_vertex (inclusive).
+        """
+        return (self.vertex_characters[self.vertex_offsets[first_vertex]:self.vertex_offsets[first_vertex + 1]]
+                + self.delta_characters[self.delta_offsets[first_vertex]:self.delta_offsets[last_vertex]])
+
+
+def _encode_polyline_values(values):
+    """
+    Polyline-encode integer values (vectorized).
 
-            # Find which step should contain this voice instruction
-            # This is the step that is closest to (but before) the voice instruction location
-            target_step_index = None
-            min_distance = float('inf')
+    Args:
+        values: int64 numpy array of quantized values or deltas
 
-            for step_idx, step in enumerate(steps):
-                if step_idx >= maneuver_step_index:  # Don't place voice instruction on or after the maneuver step
-                    continue
+    Returns:
+        Tuple (characters, offsets): the concatenated encoded values as a string, and an int64 array whose
+        entries i and i + 1 delimit the characters of value i
+    """
+    # Sign folding: value << 1, inverted for negative values
+    folded = np.where(values < 0, ~(values << 1), values << 1)
+    max_groups = max(1, (int(folded.max(initial=0)).bit_length() + 4) // 5)
+    groups = np.arange(max_groups)
 
-                step_location = step['intersections'][0]['location']
-                distance_to_voice_location = haversine_distance(
-                    voice_instruction_location[1], voice_instruction_location[0],  # lat, lon
-                    step_location[1], step_location[0]  # lat, lon
-                )
+    # Number of 5-bit groups of each value (at least one)
+    group_counts = 1 + (folded[:, None] >= (np.int64(1) << (5 * groups[1:]))).sum(axis=1)
+    characters = ((folded[:, None] >> (5 * groups)) & 0x1f) + 63
+    # Every group but the last of a value carries the continuation bit
+    characters += 0x20 * (groups < (group_counts - 1)[:, None])
 
-                if distance_to_voice_location < min_distance:
-                    min_distance = distance_to_voice_location
-                    target_step_index = step_idx
+    used = groups < group_counts[:, None]
+    offsets = np.zeros(len(values) + 1, dtype=np.int64)
+    np.cumsum(group_counts, out=offsets[1:])
+    return characters[used].astype(np.uint8).tobytes().decode('ascii'), offsets
 
-            # Add voice instruction to the target step
-            if target_step_index is not None:
-                voice_instr_obj = {
-                    "ssmlAnnouncement": "<speak><amazon:effect name=\"drc\"><prosody rate=\"1.08\">"+ str(maneuver_instruction) +"</prosody></amazon:effect></speak>",
-                    "announcement": maneuver_instruction,
-                    "distanceAlongGeometry": 30,  # Default distance
-                    "location": voice_instruction_location,
-                    "safe_distance_used": safe_distance,
-                    "target_maneuver_step": maneuver_step_index
-                }
 
-                # Add to the target step's voice instructions
-                steps[target_step_index]['voiceInstructions'].append(voice_instr_obj)
+def step_dict(step):
+    """
+    Mapbox dictionary of a step, which is a RouteStep record or (e.g. for cached responses) already a dictionary.
+    """
+    return step.to_dict() if isinstance(step, RouteStep) else step
+
+
+def build_leg(waypoints, voice_instruction_distance=0, language=0, route_polyline=None, first_segment=0,
+              profile=None, leg_geometry=None, coalesce=False):
+    """
+    Build a leg object from the steps generated by iter_leg_steps.
+
+    Args:
+        waypoints: List of waypoint dictionaries with 'latitude' and 'longitude' keys
+        voice_instruction_distance: Desired distance in meters of voice instructions before their maneuver
+        language: 0 = english, 1 = arabic
+        route_polyline: Optional RoutePolyline of the whole route, see iter_leg_steps
+        first_segment: Index in route_polyline of the leg's first segment
+        profile: Optional ConversionProfile, see iter_leg_steps
+        leg_geometry: Optional result of compute_leg_geometry(waypoints), see iter_leg_steps
+        coalesce: Fold segments without a maneuver into the preceding step, see coalesce_steps
+
+    Returns:
+        Leg dictionary with RouteStep records as steps and distance, duration and weight totals
+    """
+    if coalesce and route_polyline is None:
+        # Geometries of coalesced steps span several segments, which only a RoutePolyline provides
+        route_polyline, first_segment = RoutePolyline(waypoints), 0
+    leg_steps = iter_leg_steps(waypoints, voice_instruction_distance, language, route_polyline, first_segment,
+                               profile, leg_geometry=leg_geometry)
+    if coalesce:
+        leg_steps = coalesce_steps(leg_steps)
+
+    steps = []
+    distance_total = 0
+    weight_total = 0
+    duration_total = 0
+    for step in leg_steps:
+        steps.append(step)
+        distance_total += step.distance
+        duration_total += step.duration
+        weight_total += step.weight
+    return leg_object(steps, distance_total, duration_total, weight_total)
+
+
+def coalesce_steps(steps):
+    """
+    Fold steps without a maneuver into the preceding step.
+
+    Every maneuver (and the start of the leg) begins a step that extends over the following straight segments:
+    its geometry covers all their vertices, its distance (and so duration and weight) is their sum, and it
+    carries their voice instructions. target_maneuver_step of the voice instructions is renumbered to the
+    coalesced steps; as maneuvers come after their voice instructions, this happens once the announced
+    maneuver has been reached, i.e. after the step carrying the instruction may have been yielded.
+
+    Args:
+        steps: RouteStep records of one leg in route order, as generated by iter_leg_steps (with a
+            route_polyline); they are modified in place
+
+    Yields:
+        Coalesced RouteStep records in route order
+    """
+    coalesced_step = None
+    coalesced_index = -1
+    announcements = {}  # step index of a maneuver still to come -> its voice instructions
+    for step_index, step in enumerate(steps):
+        if coalesced_step is None or step.instruction:
+            if coalesced_step is not None:
+                yield coalesced_step
+            coalesced_step = step
+            coalesced_index += 1
+            for voice_instruction in announcements.pop(step_index, ()):
+                voice_instruction.target_maneuver_step = coalesced_index
+        else:
+            coalesced_step.end_longitude = step.end_longitude
+            coalesced_step.end_latitude = step.end_latitude
+            coalesced_step.distance += step.distance
+            coalesced_step.segment_count += step.segment_count
+            coalesced_step.voice_instructions.extend(step.voice_instructions)
+        for voice_instruction in step.voice_instructions:
+            announcements.setdefault(voice_instruction.target_maneuver_step, []).append(voice_instruction)
+    if coalesced_step is not None:
+        yield coalesced_step
+
+
+def leg_object(steps, distance_total, duration_total, weight_total):
+    """
+    Leg dictionary of a DirectionsRoute with the given steps and totals.
+    """
+    return {
+        "via_waypoints": [],
+        "admins": [{"iso_3166_1_alpha3": "DEU", "iso_3166_1": "DE"}],
+        "weight": weight_total,
+        "duration": duration_total,
+        "steps": steps,
+        "distance": distance_total,
+        "summary": ""  # Placeholder summary
+    }
+
+
+class ConversionProfile:
+    """
+    Wall time, peak memory and counts of the stages of one conversion.
+
+    Stages are recorded in the order they run. Each records its wall time and the process's peak RSS at its
+    end (the high-water mark so far, not the stage's own use). With trace_memory, each also records the peak
+    of memory allocated by Python during the stage (tracemalloc), which slows the conversion down
+    considerably. Work spread over a stage, such as voice placement inside the single pass that builds the
+    legs, is reported as accumulated seconds.
+    """
+    enabled = True
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.stages = []
+        self.accumulated_seconds = {}
+        self.counts = {}
+        self._started_tracing = False
+
+    @contextmanager
+    def stage(self, name):
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracing = True
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            record = {"name": name, "seconds": time.perf_counter() - start}
+            if resource is not None:
+                peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+                record["peak_rss_bytes"] = peak_rss if sys.platform == 'darwin' else peak_rss * 1024
+            if self.trace_memory:
+                record["peak_traced_bytes"] = tracemalloc.get_traced_memory()[1]
+            self.stages.append(record)
+
+    def add_seconds(self, name, seconds):
+        self.accumulated_seconds[name] = self.accumulated_seconds.get(name, 0.0) + seconds
+
+    def count(self, name, value):
+        self.counts[name] = value
+
+    def stop(self):
+        """
+        Stop memory tracing if this profile started it.
+        """
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def to_dict(self):
+        return {
+            "total_seconds": sum(stage["seconds"] for stage in self.stages),
+            "stages": self.stages,
+            "accumulated_seconds": self.accumulated_seconds,
+            "counts": self.counts
+        }
+
+
+class _DisabledProfile:
+    # Stand-in for ConversionProfile when profiling is off; every hook is a no-op
+    enabled = False
+
+    def stage(self, name):
+        return nullcontext()
+
+    def add_seconds(self, name, seconds):
+        pass
+
+    def count(self, name, value):
+        pass
+
+    def stop(self):
+        pass
+
+
+DISABLED_PROFILE = _DisabledProfile()
+
+
+class ConversionResult:
+    """
+    Result of a GPX conversion: the DirectionsResponse and the simplified waypoints of the route.
+    """
+
+    def __init__(self, response, waypoints, profile=None):
+        self.response = response  # DirectionsResponse dictionary with RouteStep steps, see serialize_route_response
+        self.waypoints = waypoints  # waypoint dictionaries with 'latitude' and 'longitude' keys
+        self.profile = profile  # ConversionProfile if the converter profiles conversions, else None
+
+
+class GpxToDirectionsConverter:
+    """
+    Converts GPX files to Mapbox Directions API responses.
+
+    All configuration is passed explicitly and a conversion keeps its state local, so a converter can be
+    shared between threads and used from long-lived services.
+    """
+
+    def __init__(self, leg_percentages=None, voice_instruction_distance=0, language=0, tolerance=0.00001,
+                 ingestion="gpxpy", input_directory="gpx_input_files", cache=None, tolerance_meters=None,
+                 track_policy="first", segment_workers=None, profile=False, trace_memory=False,
+                 waypoint_cache=False, coalesce_steps=False):
+        """
+        Args:
+            leg_percentages: Integer percentages of the simplified waypoints in each leg, must sum to 100
+                (default: [100], a single leg)
+            voice_instruction_distance: Desired distance in meters of voice instructions before their maneuver
+            language: 0 = english, 1 = arabic
+            tolerance: Simplification tolerance in degrees, see legged_simplification
+            ingestion: "gpxpy" to parse files with gpxpy, or "stream" to stream their coordinates into compact
+                arrays (see stream_gpx_coordinates), which bounds memory use on very large tracks
+            input_directory: Directory containing the GPX files
+            cache: Optional ConversionCache (see conversion_cache.py) consulted before converting
+            tolerance_meters: Optional simplification tolerance in meters, used instead of tolerance so that
+                tracks are simplified alike at every latitude
+            track_policy: How files with several tracks or segments are converted, one of TRACK_POLICIES
+            segment_workers: Worker processes converting independent segments/tracks concurrently (default:
+                number of CPUs); 1 converts in this process. Only used for at least PARALLEL_MIN_POINTS points.
+            profile: Record a ConversionProfile of every conversion in ConversionResult.profile
+            trace_memory: Also record the peak Python allocations of every stage (slow), see ConversionProfile
+            waypoint_cache: Keep the parsed and simplified coordinates of converted files in binary files next
+                to them and map those instead of parsing again (see waypoint_cache.py); used by convert with
+                the "first" track policy and without cache
+            coalesce_steps: Fold segments without a maneuver into the preceding maneuver's step, so a route has
+                one step per maneuver (see coalesce_steps)
+        """
+        if ingestion not in ("gpxpy", "stream"):
+            raise ValueError("Ingestion must be 'gpxpy' or 'stream'")
+        if track_policy not in TRACK_POLICIES:
+            raise ValueError(f"Track policy must be one of {', '.join(TRACK_POLICIES)}")
+        self.leg_percentages = list(leg_percentages) if leg_percentages is not None else [100]
+        self.voice_instruction_distance = voice_instruction_distance
+        self.language = language
+        self.tolerance = tolerance
+        self.tolerance_meters = tolerance_meters
+        self.track_policy = track_policy
+        self.segment_workers = segment_workers
+        self.profile = profile
+        self.trace_memory = trace_memory
+        self.waypoint_cache = waypoint_cache
+        self.coalesce_steps = coalesce_steps
+        self.ingestion = ingestion
+        self.input_directory = input_directory
+        self.cache = cache
+
+    def cache_parameters(self):
+        """
+        All parameters that affect the converter's output, as used in cache keys.
+        """
+        return {
+            "leg_percentages": self.leg_percentages,
+            "voice_instruction_distance": self.voice_instruction_distance,
+            "language": self.language,
+            "tolerance": self.tolerance,
+            "tolerance_meters": self.tolerance_meters,
+            "track_policy": self.track_policy,
+            "coalesce_steps": self.coalesce_steps
+        }
+
+    def convert(self, gpx_file_path):
+        """
+        Convert a GPX file.
+
+        With a conversion cache (cache), the file is read and converted through convert_data and the waypoint
+        cache is not used, as the cache key needs the file content anyway. The steps of a response from the
+        conversion cache are Mapbox step dictionaries, those of a new conversion RouteStep records; both
+        serialize alike with serialize_route_response, and step_dict gives the dictionary of either.
+
+        Args:
+            gpx_file_path: Path of the GPX file relative to input_directory (or an absolute path)
+
+        Returns:
+            ConversionResult with the DirectionsResponse and the route's simplified waypoints
+        """
+        if self.cache is not None:
+            # The cache key needs the file content anyway
+            with open(os.path.join(self.input_directory, str(gpx_file_path)), 'rb') as gpx_file:
+                return self.convert_data(gpx_file.read())
+
+        profile = self._new_profile()
+        if self.waypoint_cache and self.track_policy == "first":
+            waypoints_array = self.read_cached_waypoints(os.path.join(self.input_directory, str(gpx_file_path)),
+                                                         profile)
+            return self._finish_profile(self.convert_waypoints(waypoints_array, profile), profile)
+        with open(os.path.join(self.input_directory, str(gpx_file_path)), 'rb') as gpx_file:
+            result = self.convert_gpx(gpx_file, profile)
+        return self._finish_profile(result, profile)
+
+    def _new_profile(self):
+        # Every conversion gets its own profile, so a converter stays safe to share between threads
+        return ConversionProfile(self.trace_memory) if self.profile else DISABLED_PROFILE
+
+    @staticmethod
+    def _finish_profile(result, profile):
+        profile.stop()
+        if profile.enabled:
+            result.profile = profile
+        return result
+
+    def convert_data(self, gpx_data):
+        """
+        Convert GPX content that is already in memory, e.g. an upload.
+
+        The steps of a response from the conversion cache are Mapbox step dictionaries, see convert.
+
+        Args:
+            gpx_data: GPX document as bytes or str
+
+        Returns:
+            ConversionResult with the DirectionsResponse and the route's simplified waypoints
+        """
+        if isinstance(gpx_data, str):
+            gpx_data = gpx_data.encode('utf-8')
+        profile = self._new_profile()
+        profile.count("input_bytes", len(gpx_data))
+
+        if self.cache is not None:
+            with profile.stage("cache_lookup"):
+                cache_key = self.cache.key(gpx_data, self.cache_parameters())
+                cached_response = self.cache.get(cache_key)
+                if cached_response is not None:
+                    response = orjson.loads(cached_response) if orjson is not None else json.loads(cached_response)
+                    # The response's waypoints are the simplified route waypoints
+                    waypoints = [{'latitude': waypoint["location"][1], 'longitude': waypoint["location"][0]}
+                                 for waypoint in response["waypoints"]]
+            profile.count("cache_hit", cached_response is not None)
+            if cached_response is not None:
+                return self._finish_profile(ConversionResult(response, waypoints), profile)
+
+        result = self.convert_gpx(io.BytesIO(gpx_data), profile)
+        if self.cache is not None:
+            with profile.stage("cache_store"):
+                self.cache.put(cache_key, serialize_route_response(result.response, compact=True))
+        return self._finish_profile(result, profile)
+
+    def convert_gpx(self, gpx_file, profile=DISABLED_PROFILE):
+        """
+        Convert a binary GPX file object according to the track policy (no caching).
+        """
+        if self.track_policy == "first":
+            return self.convert_waypoints(self.read_gpx_waypoints(gpx_file, profile), profile)
+        return self.convert_tracks(self.read_gpx_tracks(gpx_file, profile), profile)
+
+    def read_gpx_tracks(self, gpx_file, profile=DISABLED_PROFILE):
+        """
+        Read the coordinates of all tracks and segments of a binary GPX file object, see stream_gpx_tracks.
+        """
+        with profile.stage("parse"):
+            if self.ingestion == "stream":
+                tracks = stream_gpx_tracks(gpx_file)
+            else:
+                tracks = gpxpy_tracks(gpxpy.parse(gpx_file))
+        profile.count("input_points", sum(len(segment.longitudes) for track in tracks for segment in track))
+        return tracks
+
+    def read_waypoints(self, gpx_file_path):
+        """
+        Parse and simplify a GPX file into the waypoint lists of the route's legs.
+        """
+        complete_gpx_file_path = os.path.join(self.input_directory, str(gpx_file_path))
+        with open(complete_gpx_file_path, 'rb') as gpx_file:
+            return self.read_gpx_waypoints(gpx_file)
+
+    def read_coordinates(self, gpx_file_path):
+        """
+        Parse the first segment of the first track (or the first route) of a GPX file.
+
+        Returns:
+            Tuple (longitudes, latitudes) of rounded coordinates, see rounded_coordinate_columns
+        """
+        with open(os.path.join(self.input_directory, str(gpx_file_path)), 'rb') as gpx_file:
+            return rounded_coordinate_columns(self._read_first_segment(gpx_file))
+
+    def read_gpx_waypoints(self, gpx_file, profile=DISABLED_PROFILE):
+        """
+        Parse and simplify a binary GPX file object into the waypoint lists of the route's legs.
+        """
+        with profile.stage("parse"):
+            waypoints = self._read_first_segment(gpx_file)
+        profile.count("input_points",
+                      len(waypoints.longitudes) if isinstance(waypoints, TrackCoordinates) else len(waypoints))
+
+        # simplify geometry:
+        with profile.stage("simplification"):
+            waypoints_array = legged_simplification(waypoints, tolerance=self.tolerance,
+                                                    percentages=self.leg_percentages,
+                                                    tolerance_meters=self.tolerance_meters)
+        profile.count("simplified_points", sum(len(waypoints) for waypoints in waypoints_array))
+        return waypoints_array
+
+    def read_cached_waypoints(self, gpx_file_path, profile=DISABLED_PROFILE):
+        """
+        Like read_gpx_waypoints for a GPX file path, but through the file's waypoint cache.
+
+        A valid cache skips parsing, and also simplification if it was made with the same tolerance. Otherwise
+        the cache is (re)written after simplifying.
+        """
+        validate_leg_percentages(self.leg_percentages)
+        with profile.stage("waypoint_cache_load"):
+            cached = load_waypoint_cache(gpx_file_path)
+        profile.count("waypoint_cache_hit", cached is not None)
+
+        simplified_coordinates = None
+        if cached is not None:
+            longitudes, latitudes = cached.longitudes, cached.latitudes
+            source_size, source_mtime_ns = cached.source_size, cached.source_mtime_ns
+            if cached.simplified_with(self.tolerance, self.tolerance_meters):
+                simplified_coordinates = cached.simplified_coordinates
+        else:
+            # Stat before reading, so that a file changed while being read leaves an outdated cache
+            source_stat = os.stat(gpx_file_path)
+            source_size, source_mtime_ns = source_stat.st_size, source_stat.st_mtime_ns
+            with profile.stage("parse"):
+                with open(gpx_file_path, 'rb') as gpx_file:
+                    longitudes, latitudes = rounded_coordinate_columns(self._read_first_segment(gpx_file))
+        profile.count("input_points", len(longitudes))
+
+        if simplified_coordinates is None:
+            with profile.stage("simplification"):
+                simplified_coordinates = simplify_coordinate_columns(longitudes, latitudes, self.tolerance,
+                                                                     self.tolerance_meters)
+            with profile.stage("waypoint_cache_store"):
+                try:
+                    store_waypoint_cache(gpx_file_path, source_size, source_mtime_ns, longitudes, latitudes,
+                                         simplified_coordinates, self.tolerance, self.tolerance_meters)
+                except OSError as error:
+                    # e.g. a read-only input directory: convert without caching
+                    warnings.warn(f"Waypoint cache of {gpx_file_path} not written: {error}", RuntimeWarning,
+                                  stacklevel=2)
+
+        waypoints_array = split_into_legs(simplified_coordinates.tolist(), self.leg_percentages)
+        profile.count("simplified_points", len(simplified_coordinates))
+        return waypoints_array
+
+    def _read_first_segment(self, gpx_file):
+        # Parse the GPX file
+        if self.ingestion == "stream":
+            coordinates = stream_gpx_coordinates(gpx_file)
+            if len(coordinates.longitudes) > 0:
+                return coordinates
+        else:
+            gpx = gpxpy.parse(gpx_file)
+
+            # Extract waypoints from the GPX file
+            if len(gpx.tracks) > 0:
+                # GPX contains tracks --> parse tracks
+                track = gpx.tracks[0]
+                segment = track.segments[0]
+                return segment.points
+
+            if len(gpx.routes) > 0:
+                # parse GPX routes
+                segment = gpx.routes[0]
+                return segment.points
+
+        raise ValueError("Neither tracks nor routes in GPX data")
+
+    def convert_waypoints(self, waypoints_array, profile=DISABLED_PROFILE, legs_array=None, route_polyline=None):
+        """
+        Build the DirectionsResponse from the simplified waypoint lists of the route's legs.
+
+        legs_array and route_polyline can pass in legs and geometry already built, see build_route.
+        """
+        route_object, route_waypoints, route_waypoints_data = self.build_route(waypoints_array, legs_array, profile,
+                                                                               route_polyline)
+        self._count_route_contents([route_object], profile)
+        return ConversionResult(self._response([route_object], route_waypoints_data), route_waypoints)
+
+    @staticmethod
+    def _count_route_contents(route_objects, profile):
+        if not profile.enabled:
+            return
+        steps = [step for route_object in route_objects for leg in route_object["legs"] for step in leg["steps"]]
+        profile.count("routes", len(route_objects))
+        profile.count("legs", sum(len(route_object["legs"]) for route_object in route_objects))
+        profile.count("steps", len(steps))
+        profile.count("segments", sum(step.segment_count for step in steps))
+        profile.count("maneuvers", sum(1 for step in steps if step.instruction))
+        profile.count("voice_instructions", sum(len(step.voice_instructions) for step in steps))
+
+    def convert_tracks(self, tracks, profile=DISABLED_PROFILE):
+        """
+        Build the DirectionsResponse from all tracks and segments of a GPX file according to the track policy.
+
+        Independent segments (segment_legs) or tracks (track_routes) are simplified and turned into legs
+        concurrently on segment_workers processes; results are merged in document order, so the response
+        does not depend on the number of workers.
+
+        Args:
+            tracks: List of tracks, each a list of TrackCoordinates segments (see stream_gpx_tracks)
+            profile: ConversionProfile; simplification and legs of all units are recorded as one "units" stage
+
+        Returns:
+            ConversionResult; with several routes, its waypoints and the response's waypoints are those of the
+            first route
+        """
+        if self.track_policy == "segment_legs":
+            units = [segment for track in tracks for segment in track]
+        elif self.track_policy == "track_routes":
+            units = [concatenate_track_coordinates(track) for track in tracks]
+        else:
+            units = [concatenate_track_coordinates(segment for track in tracks for segment in track)]
+        # A single point (e.g. a segment cut off at a signal gap) has no geometry to convert
+        units = [unit for unit in units if len(unit.longitudes) > 1]
+        if not units:
+            raise ValueError("Neither tracks nor routes in GPX data")
+
+        with profile.stage("units"):
+            converted_units = self._map_units(units)
+        profile.count("simplified_points", sum(len(waypoints) for waypoints_array, _ in converted_units
+                                               for waypoints in waypoints_array))
+
+        if self.track_policy == "track_routes":
+            routes = [self.build_route(waypoints_array, legs_array, profile)
+                      for waypoints_array, legs_array in converted_units]
+        else:
+            # One route holding the legs of all units in document order
+            waypoints_array = [waypoints for unit_waypoints_array, _ in converted_units
+                               for waypoints in unit_waypoints_array]
+            legs_array = [leg for _, unit_legs_array in converted_units for leg in unit_legs_array]
+            routes = [self.build_route(waypoints_array, legs_array, profile)]
+        self._count_route_contents([route_object for route_object, _, _ in routes], profile)
+        response = self._response([route_object for route_object, _, _ in routes], routes[0][2])
+        return ConversionResult(response, routes[0][1])
+
+    def _map_units(self, units):
+        # Convert units serially or on a process pool, keeping their order
+        workers = self.segment_workers or os.cpu_count() or 1
+        if workers > 1 and len(units) > 1 and sum(len(unit.longitudes) for unit in units) >= PARALLEL_MIN_POINTS:
+            with ProcessPoolExecutor(max_workers=min(workers, len(units))) as pool:
+                return list(pool.map(self.convert_unit, units))
+        return [self.convert_unit(unit) for unit in units]
+
+    def convert_unit(self, coordinates):
+        """
+        Simplify one track or segment and build its legs.
+
+        Args:
+            coordinates: TrackCoordinates
+
+        Returns:
+            Tuple (waypoints_array, legs_array) of the leg waypoint lists and the leg objects
+        """
+        waypoints_array = legged_simplification(coordinates, tolerance=self.tolerance, percentages=self.leg_percentages,
+                                                tolerance_meters=self.tolerance_meters)
+        route_polyline = RoutePolyline([point for waypoints in waypoints_array for point in waypoints])
+        legs_array = []
+        first_segment = 0
+        for waypoints in waypoints_array:
+            legs_array.append(build_leg(waypoints, self.voice_instruction_distance, self.language, route_polyline,
+                                        first_segment, coalesce=self.coalesce_steps))
+            first_segment += len(waypoints)
+        return waypoints_array, legs_array
+
+    def build_route(self, waypoints_array, legs_array=None, profile=DISABLED_PROFILE, route_polyline=None):
+        """
+        Build a route object from the simplified waypoint lists of its legs.
+
+        Args:
+            waypoints_array: List of legs, each a list of waypoint dictionaries
+            legs_array: Optional leg objects already built from waypoints_array (see convert_unit)
+            profile: ConversionProfile recording the "route_geometry" and "legs" stages
+            route_polyline: Optional RoutePolyline of the route's waypoints, e.g. shared by conversions that
+                differ only in leg split or voice instruction distance
+
+        Returns:
+            Tuple (route object, route waypoints, waypoint objects of the response)
+        """
+        route_distance_total = 0
+        route_weight_total = 0
+        route_duration_total = 0
+        route_waypoints = [point for waypoints in waypoints_array for point in waypoints]
+        route_waypoints_data = []
+        # Route and step geometries are encoded together in one pass
+        with profile.stage("route_geometry"):
+            if route_polyline is None:
+                route_polyline = RoutePolyline(route_waypoints)
+        build_legs = legs_array is None
+        if build_legs:
+            legs_array = [] # array to hold the legs
+        first_segment = 0
+
+        # Maneuver detection, step building and voice placement run in one pass per leg
+        with profile.stage("legs"):
+            for leg_number, waypoints in enumerate(waypoints_array):  #iterate over waypoints_lists in waypoints_array
+                # Convert waypoints to the required format
+                waypoints_data = [self._waypoint_object(point) for point in waypoints]
+
+                if build_legs:
+                    # Build the leg's steps (including voice instructions) in a single streaming pass
+                    legs_array.append(build_leg(waypoints, self.voice_instruction_distance, self.language,
+                                                route_polyline, first_segment, profile if profile.enabled else None,
+                                                coalesce=self.coalesce_steps))
+                leg_object = legs_array[leg_number]
+                route_distance_total += leg_object["distance"]
+                route_weight_total += leg_object["weight"]
+                route_duration_total += leg_object["duration"]
+                route_waypoints_data.extend(waypoints_data)
+                first_segment += len(waypoints)
+
+        route_object = self._route_object(legs_array, route_distance_total, route_duration_total,
+                                          route_weight_total, route_polyline.route_geometry())
+        return route_object, route_waypoints, route_waypoints_data
+
+    @staticmethod
+    def _waypoint_object(point):
+        return {
+            "distance": 0,  # Placeholder for distance
+            "name": "",  # Placeholder for name
+            "location": [point["longitude"], point["latitude"]]
+        }
 
-        leg_object = {
-            "via_waypoints": [],
-            "admins": [{"iso_3166_1_alpha3": "DEU", "iso_3166_1": "DE"}],
+    @staticmethod
+    def _route_object(legs_array, distance_total, duration_total, weight_total, geometry):
+        return {
+            "weight_name": "auto",
             "weight": weight_total,
             "duration": duration_total,
-            "steps": steps,
             "distance": distance_total,
-            "summary": ""  # Placeholder summary
+            "legs": legs_array,
+            "geometry": geometry,
+            "voiceLocale": "en-US"
         }
-        legs_array.append(leg_object)
-        route_distance_total += distance_total
-        route_weight_total += weight_total
-        route_duration_total += duration_total
-        route_waypoints = route_waypoints + waypoints if route_waypoints else waypoints
-        route_waypoints_data = route_waypoints_data + waypoints_data if route_waypoints_data else waypoints_data
-
-
-    # Create the final response structure
-    response = {
-        "routes": [
-            {
-                "weight_name": "auto",
-                "weight": route_weight_total,
-                "duration": route_duration_total,
-                "distance": route_distance_total,
-                "legs": legs_array,
-                "geometry": polyline.encode([(p["latitude"], p["longitude"]) for p in route_waypoints], precision=6),
-                "voiceLocale": "en-US"
-            }
-        ],
-        "waypoints": route_waypoints_data,
-        "code": "Ok",
-        "uuid": ""  # Placeholder UUID
-    }
-    global_waypoints = route_waypoints
 
+    @staticmethod
+    def _response(route_objects, route_waypoints_data):
+        # Create the final response structure
+        return {
+            "routes": route_objects,
+            "waypoints": route_waypoints_data,
+            "code": "Ok",
+            "uuid": ""  # Placeholder UUID
+        }
+
+
+class IncrementalConverter:
+    """
+    Converts a growing track (e.g. of a live-tracking unit), extending the route with the new points only.
+
+    The converter keeps the state of its last conversion: the rounded track coordinates, the simplified
+    vertices and the steps with their running totals and maneuvers. On every update the track is simplified
+    again (in GEOS), and the simplified vertices are compared with the previous ones. Steps whose vertices
+    are unchanged are kept, except for the last one, whose end vertex may now be followed by a maneuver;
+    steps from there on are generated again (see iter_leg_steps), and the voice instructions of their
+    maneuvers are placed again on the kept steps within voice_instruction_distance before them. The
+    response is the same as a full conversion of the track by GpxToDirectionsConverter with a single leg.
+
+    Simplification and the encoding of the route geometry still process the whole track on every update,
+    but in C; the Python work of building steps and placing voice instructions is proportional to the
+    changed tail. Douglas-Peucker usually only changes the last few simplified vertices when points are
+    appended, though occasionally a new point changes vertices further back.
+    """
+
+    def __init__(self, voice_instruction_distance=0, language=0, tolerance=0.00001, tolerance_meters=None):
+        """
+        Args:
+            voice_instruction_distance: Desired distance in meters of voice instructions before their maneuver
+            language: 0 = english, 1 = arabic
+            tolerance: Simplification tolerance in degrees, see legged_simplification
+            tolerance_meters: Optional simplification tolerance in meters, used instead of tolerance
+        """
+        # Legs split by percentage would move with every update, so the route always has a single leg
+        self.voice_instruction_distance = voice_instruction_distance
+        self.language = language
+        self.tolerance = tolerance
+        self.tolerance_meters = tolerance_meters
+        self.point_count = 0
+        # Track coordinates rounded like waypoints_line_string, so only new points are rounded
+        self._longitudes = array('d')
+        self._latitudes = array('d')
+        self._simplified_coordinates = np.empty((0, 2))
+        self._waypoints = []
+        self._waypoints_data = []
+        self._steps = []
+        self._step_totals = []  # (distance, duration, weight) totals of the leg up to and including each step
+        self._maneuver_indices = []
+        self.rebuilt_steps = 0  # steps generated by the last update
+
+    def extend(self, points):
+        """
+        Append points to the track and convert it.
+
+        Args:
+            points: TrackCoordinates, or an iterable of (latitude, longitude) pairs
+
+        Returns:
+            ConversionResult of the whole track
+        """
+        if isinstance(points, TrackCoordinates):
+            longitudes, latitudes = points.longitudes, points.latitudes
+        else:
+            latitudes, longitudes = array('d'), array('d')
+            for latitude, longitude in points:
+                latitudes.append(latitude)
+                longitudes.append(longitude)
+        self._longitudes.frombytes(_round_coordinates(longitudes).tobytes())
+        self._latitudes.frombytes(_round_coordinates(latitudes).tobytes())
+        self.point_count = len(self._longitudes)
+        return self._update()
+
+    def extend_from_gpx(self, gpx_file_path):
+        """
+        Convert a GPX file that has grown since the last update, appending the points beyond the known ones.
+
+        The file is read with stream_gpx_coordinates (first segment of the first track, or first route).
+
+        Returns:
+            ConversionResult of the whole track
+        """
+        coordinates = stream_gpx_coordinates(gpx_file_path)
+        if len(coordinates.longitudes) < self.point_count:
+            raise ValueError(f"GPX file has {len(coordinates.longitudes)} points, fewer than the "
+                             f"{self.point_count} already converted")
+        return self.extend(TrackCoordinates(coordinates.longitudes[self.point_count:],
+                                            coordinates.latitudes[self.point_count:]))
+
+    def _update(self):
+        if self.point_count < 2:
+            raise ValueError("At least two track points are needed for a route")
+        simplified_coordinates = simplify_coordinate_columns(np.frombuffer(self._longitudes),
+                                                             np.frombuffer(self._latitudes), self.tolerance,
+                                                             self.tolerance_meters)
+
+        # Number of leading simplified vertices unchanged since the last update
+        previous_coordinates = self._simplified_coordinates
+        common = min(len(previous_coordinates), len(simplified_coordinates))
+        changed = np.flatnonzero((previous_coordinates[:common] != simplified_coordinates[:common]).any(axis=1))
+        unchanged = int(changed[0]) if changed.size else common
+        # The step ending at the first changed vertex changes, and so may the one before it: its end vertex
+        # can have become a maneuver
+        kept_steps = max(unchanged - 1, 0)
+
+        new_waypoints = [{'latitude': latitude, 'longitude': longitude}
+                         for longitude, latitude in simplified_coordinates[unchanged:].tolist()]
+        waypoints = self._waypoints[:unchanged] + new_waypoints
+        waypoints_data = (self._waypoints_data[:unchanged]
+                          + [GpxToDirectionsConverter._waypoint_object(point) for point in new_waypoints])
+
+        steps = self._steps[:kept_steps]
+        step_totals = self._step_totals[:kept_steps]
+        maneuver_indices = self._maneuver_indices[:bisect_left(self._maneuver_indices, kept_steps)]
+        distance_total, duration_total, weight_total = step_totals[-1] if step_totals else (0, 0, 0)
+        # New steps take their geometry from an encoding of the changed tail only, so kept steps do not hold
+        # on to the geometry buffers of every earlier update
+        tail_polyline = RoutePolyline(waypoints[kept_steps:])
+        for step in iter_leg_steps(waypoints, self.voice_instruction_distance, self.language, tail_polyline,
+                                   -kept_steps, previous_steps=steps, previous_maneuver_indices=maneuver_indices):
+            if step.instruction:
+                maneuver_indices.append(len(steps))
+            steps.append(step)
+            distance_total += step.distance
+            duration_total += step.duration
+            weight_total += step.weight
+            step_totals.append((distance_total, duration_total, weight_total))
+
+        self._simplified_coordinates = simplified_coordinates
+        self._waypoints = waypoints
+        self._waypoints_data = waypoints_data
+        self._steps = steps
+        self._step_totals = step_totals
+        self._maneuver_indices = maneuver_indices
+        self.rebuilt_steps = len(steps) - kept_steps
+
+        leg = leg_object(steps, distance_total, duration_total, weight_total)
+        # Route totals are summed over the legs, starting from 0, as in GpxToDirectionsConverter.build_route
+        route_object = GpxToDirectionsConverter._route_object(
+            [leg], 0 + distance_total, 0 + duration_total, 0 + weight_total,
+            RoutePolyline(waypoints).route_geometry())
+        return ConversionResult(GpxToDirectionsConverter._response([route_object], waypoints_data), waypoints)
+
+
+# Waypoints of the route converted by the last gpx_to_mapbox_directions_response call
+global_waypoints = []
+
+
+def gpx_to_mapbox_directions_response(gpx_file_path, voice_instruction_distance=0, ingestion="gpxpy",
+                                      input_directory="gpx_input_files", leg_percentages=None, language=0,
+                                      cache=None):
+    """
+    Convert a GPX file to a Mapbox Directions API response.
+
+    Module-level wrapper around GpxToDirectionsConverter. It also stores the route's waypoints in
+    global_waypoints for waypoints_to_geojson_line_string and create_html_map_view; use the converter
+    class directly from threads.
+
+    Args:
+        gpx_file_path: Path of the GPX file relative to input_directory (or an absolute path)
+        voice_instruction_distance: Desired distance in meters of voice instructions before their maneuver
+        ingestion: "gpxpy" to parse the file with gpxpy, or "stream" to stream its coordinates into compact
+            arrays (see stream_gpx_coordinates), which bounds memory use on very large tracks
+        input_directory: Directory containing the GPX files
+        leg_percentages: Leg split, must sum to 100 (default: the module-level leg_percentages, or [100])
+        language: 0 = english, 1 = arabic
+        cache: Optional ConversionCache (see conversion_cache.py) consulted before converting
+
+    Returns:
+        The DirectionsResponse as a JSON string
+    """
+    global global_waypoints
+    if leg_percentages is None:
+        # Fall back to the configuration set under __main__
+        leg_percentages = globals().get("leg_percentages", [100])
+
+    converter = GpxToDirectionsConverter(leg_percentages, voice_instruction_distance, language,
+                                         ingestion=ingestion, input_directory=input_directory, cache=cache)
+    result = converter.convert(gpx_file_path)
+    global_waypoints = result.waypoints
+    return serialize_route_response(result.response).decode('utf-8')
+
+
+# Output profiles of serialize_route_response and write_route_response:
+#   full  every field the converter produces
+#   lean  without the debug fields of the voice instructions and the constant boilerplate of legs, steps and
+#         intersections, which the Navigation SDK does not need (it assumes right-hand traffic without
+#         driving_side). Everything else, including the key order, is the same as in the full output.
+OUTPUT_PROFILES = ("full", "lean")
+
+# Fields left out of the lean output profile
+LEAN_OMITTED_FIELDS = {
+    "leg": ("admins",),
+    "step": ("driving_side",),
+    "intersection": ("mapbox_streets_v8", "is_urban", "admin_index"),  # admin_index refers to the leg's admins
+    "voice_instruction": ("safe_distance_used", "target_maneuver_step")
+}
+
+# Compressions of write_route_response, with their file name suffix and default level
+COMPRESSIONS = {"gzip": ".gz", "brotli": ".br"}
+DEFAULT_COMPRESSION_LEVELS = {"gzip": 6, "brotli": 5}  # the maximum levels are several times slower
 
+# Serialized steps are collected into chunks of about this size before they are yielded to the writer
+_CHUNK_BYTES = 64 * 1024
 
-    return json.dumps(response, indent=2)
+
+def serialize_route_response(response, compact=False, profile=None, output_profile="full"):
+    """
+    Serialize a DirectionsResponse dictionary to JSON, with orjson if it is installed.
+
+    Args:
+        response: DirectionsResponse dictionary
+        compact: Omit indentation and whitespace (smaller and faster) instead of 2-space indentation
+        profile: Optional ConversionProfile (e.g. ConversionResult.profile) recording a "serialization" stage
+            and the output_bytes count
+        output_profile: "full" or "lean", see OUTPUT_PROFILES
+
+    Returns:
+        UTF-8 encoded JSON bytes
+    """
+    if profile is not None:
+        with profile.stage("serialization"):
+            serialized = serialize_route_response(response, compact, output_profile=output_profile)
+        profile.count("output_bytes", len(serialized))
+        return serialized
+    if output_profile != "full":
+        return b"".join(iter_route_response_chunks(response, compact, output_profile))
+    if orjson is not None:
+        if compact:
+            return orjson.dumps(response, default=_record_to_dict)
+        return orjson.dumps(response, default=_record_to_dict, option=orjson.OPT_INDENT_2)
+    if compact:
+        return json.dumps(response, separators=(',', ':'), ensure_ascii=False, default=_record_to_dict).encode('utf-8')
+    return json.dumps(response, indent=2, ensure_ascii=False, default=_record_to_dict).encode('utf-8')
+
+
+def _record_to_dict(record):
+    # JSON encoder hook expanding RouteStep / VoiceInstruction records into their Mapbox dictionaries
+    if isinstance(record, (RouteStep, VoiceInstruction)):
+        return record.to_dict()
+    raise TypeError(f"Object of type {type(record).__name__} is not JSON serializable")
+
+
+def lean_step_dict(step):
+    """
+    Copy of a Mapbox step dictionary without the fields of LEAN_OMITTED_FIELDS.
+
+    Args:
+        step: RouteStep, or step dictionary (e.g. of a response read back from JSON)
+    """
+    if isinstance(step, RouteStep):
+        return step.to_dict(lean=True)
+    lean_step = {key: value for key, value in step.items() if key not in LEAN_OMITTED_FIELDS["step"]}
+    if "voiceInstructions" in step:
+        lean_step["voiceInstructions"] = [
+            {key: value for key, value in voice_instruction.items()
+             if key not in LEAN_OMITTED_FIELDS["voice_instruction"]}
+            for voice_instruction in step["voiceInstructions"]]
+    if "intersections" in step:
+        lean_step["intersections"] = [
+            {key: value for key, value in intersection.items() if key not in LEAN_OMITTED_FIELDS["intersection"]}
+            for intersection in step["intersections"]]
+    return lean_step
+
+
+def _check_output_profile(output_profile):
+    if output_profile not in OUTPUT_PROFILES:
+        raise ValueError(f"Output profile must be one of {', '.join(OUTPUT_PROFILES)}")
+
+
+def iter_route_response_chunks(response, compact=False, output_profile="full"):
+    """
+    Serialize a DirectionsResponse dictionary to JSON piece by piece.
+
+    The document without the steps is encoded first, then the steps are encoded one at a time and spliced in,
+    re-indented to their depth. Joined, the chunks are byte for byte the output of serialize_route_response,
+    but only one chunk of steps is held at a time, so they can be written or compressed as they come.
+
+    Args:
+        response: DirectionsResponse dictionary
+        compact: Omit indentation and whitespace instead of 2-space indentation
+        output_profile: "full" or "lean", see OUTPUT_PROFILES
+
+    Yields:
+        UTF-8 encoded JSON bytes
+    """
+    _check_output_profile(output_profile)
+    lean = output_profile == "lean"
+
+    # Shallow copy of the document with a unique placeholder string in place of every leg's steps
+    placeholder_prefix = f"steps-{uuid4().hex}-"
+    leg_steps = []
+    skeleton = dict(response)
+    if "routes" in response:
+        skeleton["routes"] = []
+        for route in response["routes"]:
+            route_skeleton = dict(route)
+            route_skeleton["legs"] = []
+            for leg in route.get("legs", []):
+                leg_skeleton = {key: value for key, value in leg.items()
+                                if not (lean and key in LEAN_OMITTED_FIELDS["leg"])}
+                if "steps" in leg:
+                    leg_skeleton["steps"] = f"{placeholder_prefix}{len(leg_steps)}"
+                    leg_steps.append(leg["steps"])
+                route_skeleton["legs"].append(leg_skeleton)
+            skeleton["routes"].append(route_skeleton)
+    document = serialize_route_response(skeleton, compact)
+
+    position = 0
+    for leg_index, steps in enumerate(leg_steps):
+        placeholder = f'"{placeholder_prefix}{leg_index}"'.encode('utf-8')
+        placeholder_position = document.index(placeholder, position)
+        yield document[position:placeholder_position]
+        position = placeholder_position + len(placeholder)
+
+        if not steps:
+            yield b"[]"
+            continue
+        if compact:
+            separator = b","
+            closing = b"]"
+        else:
+            # Steps are one level deeper than the line of the "steps" key
+            line_start = document.rindex(b"\n", 0, placeholder_position) + 1
+            indentation = len(document[line_start:placeholder_position]) - len(
+                document[line_start:placeholder_position].lstrip(b" "))
+            step_newline = b"\n" + b" " * (indentation + 2)
+            separator = b"," + step_newline
+            closing = b"\n" + b" " * indentation + b"]"
+
+        chunk = [b"[" if compact else b"[" + step_newline]
+        chunk_bytes = 0
+        for step_index, step in enumerate(steps):
+            serialized_step = serialize_route_response(lean_step_dict(step) if lean else step, compact)
+            if not compact:
+                serialized_step = serialized_step.replace(b"\n", step_newline)
+            if step_index:
+                chunk.append(separator)
+            chunk.append(serialized_step)
+            chunk_bytes += len(serialized_step)
+            if chunk_bytes >= _CHUNK_BYTES:
+                yield b"".join(chunk)
+                chunk = []
+                chunk_bytes = 0
+        chunk.append(closing)
+        yield b"".join(chunk)
+    yield document[position:]
+
+
+@contextmanager
+def open_route_output(file_path, compression=None, compression_level=None):
+    """
+    Open an output file for writing bytes, compressing them on the fly.
+
+    Args:
+        file_path: Path of the file
+        compression: None, "gzip" or "brotli" (needs the brotli package), see COMPRESSIONS
+        compression_level: Compression level (default: DEFAULT_COMPRESSION_LEVELS)
+
+    Yields:
+        File-like object with a write method
+    """
+    if compression is not None and compression not in COMPRESSIONS:
+        raise ValueError(f"Compression must be one of {', '.join(COMPRESSIONS)}")
+    if compression == "brotli" and brotli is None:
+        raise ValueError("Brotli compression needs the brotli package (pip install brotli)")
+    if compression_level is None and compression is not None:
+        compression_level = DEFAULT_COMPRESSION_LEVELS[compression]
+
+    with open(file_path, 'wb') as output_file:
+        if compression is None:
+            yield output_file
+        elif compression == "gzip":
+            # mtime=0: identical routes give identical files
+            with gzip.GzipFile(filename='', mode='wb', fileobj=output_file, compresslevel=compression_level,
+                               mtime=0) as gzip_file:
+                yield gzip_file
+        else:
+            brotli_writer = _BrotliWriter(output_file, compression_level)
+            yield brotli_writer
+            brotli_writer.finish()
+
+
+class _BrotliWriter:
+    # File-like wrapper feeding written bytes through a streaming brotli compressor
+
+    def __init__(self, output_file, quality):
+        self.output_file = output_file
+        self.compressor = brotli.Compressor(quality=quality)
+
+    def write(self, data):
+        self.output_file.write(self.compressor.process(data))
+        return len(data)
+
+    def finish(self):
+        self.output_file.write(self.compressor.finish())
+
+
+def write_route_response(response, file_path, compact=False, profile=None, output_profile="full", compression=None,
+                         compression_level=None):
+    """
+    Write a DirectionsResponse dictionary to a JSON file.
+
+    With orjson the full document is encoded in one fast call. Without it, compact output uses the json module's
+    C encoder, while indented output is streamed into the file chunk by chunk instead of being built as
+    one large string. Lean or compressed output is streamed step by step (see iter_route_response_chunks)
+    through the compressor into the file. A profile (see serialize_route_response) records the write as its
+    "serialization" stage and the written (compressed) size as output_bytes.
+
+    Args:
+        response: DirectionsResponse dictionary
+        file_path: Path of the file; the suffix of the compression (e.g. .json.gz) is not added
+        compact: Omit indentation and whitespace instead of 2-space indentation
+        profile: Optional ConversionProfile
+        output_profile: "full" or "lean", see OUTPUT_PROFILES
+        compression: None, "gzip" or "brotli", see open_route_output
+        compression_level: Compression level (default: DEFAULT_COMPRESSION_LEVELS)
+    """
+    if profile is not None:
+        with profile.stage("serialization"):
+            write_route_response(response, file_path, compact, output_profile=output_profile,
+                                 compression=compression, compression_level=compression_level)
+        profile.count("output_bytes", os.path.getsize(file_path))
+        return
+    if output_profile != "full" or compression is not None:
+        _check_output_profile(output_profile)  # before the file is created
+        with open_route_output(file_path, compression, compression_level) as output_file:
+            for chunk in iter_route_response_chunks(response, compact, output_profile):
+                output_file.write(chunk)
+    elif orjson is not None or compact:
+        with open(file_path, 'wb') as json_file:
+            json_file.write(serialize_route_response(response, compact))
+    else:
+        with open(file_path, 'w', encoding='utf-8') as json_file:
+            json.dump(response, json_file, indent=2, ensure_ascii=False, default=_record_to_dict)
 
 
 def write_to_json_file(json_content, file_path):
-    with open(file_path, 'w') as json_file:
+    # json_content: JSON string, or a DirectionsResponse dictionary (see write_route_response)
+    if isinstance(json_content, dict):
+        write_route_response(json_content, file_path)
+        return
+    with open(file_path, 'w', encoding='utf-8') as json_file:
         json_file.write(json_content)
 
 
-def waypoints_to_geojson_line_string():
-    global global_waypoints
-    global coordinates_global
-    waypoints = global_waypoints
+def waypoints_to_geojson_line_string(waypoints=None):
     """
     Convert an array of latitude, longitude waypoints into a GeoJSON LineString object.
 
     Parameters:
-    waypoints (list of tuples): A list of tuples where each tuple contains (latitude, longitude).
+    waypoints (list of dicts): Waypoint dictionaries with 'latitude' and 'longitude' keys
+        (default: global_waypoints of the last gpx_to_mapbox_directions_response call).
 
     Returns:
     str: A GeoJSON LineString object as a JSON string.
     """
+    if waypoints is None:
+        waypoints = global_waypoints
+
     # Create the coordinates list from waypoints
     #coordinates = [[lon['longitude'], lat['latitude']] for lon, lat in waypoints]  # Note: GeoJSON uses [longitude, latitude]
     coordinates = [[wp['longitude'], wp['latitude']] for wp in waypoints]
-    coordinates_global = coordinates
 
 
     # Create the GeoJSON LineString object
@@ -455,61 +2051,194 @@ def waypoints_to_geojson_line_string():
     return json.dumps(geojson_line_string, indent=2)
 
 
-def create_html_map_view(route_response, voice_instruction_distance=0):
-    global public_mapbox_token
-    global coordinates_global
-    # visualize the converted route on a map
+def create_html_map_view(route_response, voice_instruction_distance=0, waypoints=None, mapbox_token=None,
+                         output_file_path="route_visualization.html", data_files=True):
+    """
+    Visualize the converted route, its maneuvers and voice instructions on a map in an HTML file.
 
-    geojson_feature_linestring_route = waypoints_to_geojson_line_string()
+    The route, maneuvers and voice instructions are GeoJSON sources drawn by Mapbox GL line and circle layers
+    (on the GPU, instead of one DOM marker per point); maneuvers and voice instructions are clustered at low
+    zoom levels. The GeoJSON is written feature by feature to <name>_route.geojson, <name>_maneuvers.geojson
+    and <name>_voice_instructions.geojson next to the HTML file, which then has to be served over HTTP
+    (e.g. python -m http.server), as browsers do not let pages opened from disk load other files.
 
-    # Parse the route response to extract maneuvers and voice instructions
-    route_data = json.loads(route_response)
+    Args:
+        route_response: DirectionsResponse dictionary (or its JSON string)
+        voice_instruction_distance: Configured voice instruction distance, shown for comparison
+        waypoints: Waypoint dictionaries of the route (default: global_waypoints)
+        mapbox_token: Mapbox access token (default: the module-level public_mapbox_token)
+        output_file_path: Path of the HTML file to write
+        data_files: Write the GeoJSON to separate files; if False it is embedded in the HTML file, which then
+            opens from disk but grows with the route
+
+    Returns:
+        List of the written file paths, the HTML file first
+    """
+    if waypoints is None:
+        waypoints = global_waypoints
+    if mapbox_token is None:
+        mapbox_token = globals().get("public_mapbox_token")
+
+    route_data = json.loads(route_response) if isinstance(route_response, (str, bytes)) else route_response
     route = route_data['routes'][0]
 
-    # Extract maneuvers and voice instructions from all legs and steps
-    maneuvers = []
-    voice_instructions = []
+    # (source name, JavaScript variable, function streaming the source's GeoJSON into a binary file)
+    sources = [
+        ("route", "routeData", lambda data_file: _write_route_line_geojson(data_file, waypoints)),
+        ("maneuvers", "maneuversData",
+         lambda data_file: _write_feature_collection(data_file, _maneuver_features(route))),
+        ("voice_instructions", "voiceInstructionsData", lambda data_file: _write_feature_collection(
+            data_file, _voice_instruction_features(route, voice_instruction_distance)))
+    ]
+    written_files = [output_file_path]
+    feature_counts = {}
+    source_data = {}
+    if data_files:
+        name = os.path.splitext(os.path.basename(output_file_path))[0]
+        for source, _, write_source in sources:
+            data_file_name = f"{name}_{source}.geojson"
+            data_file_path = os.path.join(os.path.dirname(output_file_path), data_file_name)
+            with open(data_file_path, 'wb') as data_file:
+                feature_counts[source] = write_source(data_file)
+            source_data[source] = json.dumps(data_file_name)  # URL relative to the HTML file
+            written_files.append(data_file_path)
+
+    html_head, html_tail = _map_view_html(mapbox_token, [waypoints[0]['longitude'], waypoints[0]['latitude']])
+    with open(output_file_path, 'wb') as html_file:
+        html_file.write(html_head.encode('utf-8'))
+        for source, variable, write_source in sources:
+            html_file.write(f"const {variable} = ".encode('utf-8'))
+            if data_files:
+                html_file.write(source_data[source].encode('utf-8'))
+            else:
+                feature_counts[source] = write_source(_ScriptSafeWriter(html_file))
+            html_file.write(b";\n    ")
+        html_file.write(f"const maneuverCount = {feature_counts['maneuvers']};\n    "
+                        f"const voiceInstructionCount = {feature_counts['voice_instructions']};\n".encode('utf-8'))
+        html_file.write(html_tail.encode('utf-8'))
+    return written_files
+
+
+def _json_bytes(value):
+    return orjson.dumps(value) if orjson is not None else json.dumps(value).encode('utf-8')
+
+
+class _ScriptSafeWriter:
+    # Writes JSON into an inline <script>: "</" would end the script element early
+    def __init__(self, file):
+        self.file = file
+
+    def write(self, data):
+        self.file.write(data.replace(b'</', b'<\\/'))
+
+
+def _write_route_line_geojson(data_file, waypoints, chunk_size=10000):
+    # GeoJSON LineString Feature of the waypoints, written in chunks of coordinates
+    data_file.write(b'{"type":"Feature","properties":{},"geometry":{"type":"LineString","coordinates":[')
+    for start in range(0, len(waypoints), chunk_size):
+        coordinates = [[waypoint['longitude'], waypoint['latitude']]
+                       for waypoint in waypoints[start:start + chunk_size]]
+        if start:
+            data_file.write(b',')
+        data_file.write(_json_bytes(coordinates)[1:-1])
+    data_file.write(b']}}')
+    return 1
+
+
+def _write_feature_collection(data_file, features):
+    # GeoJSON FeatureCollection written one feature at a time; returns the number of features
+    data_file.write(b'{"type":"FeatureCollection","features":[\n')
+    count = 0
+    for feature in features:
+        if count:
+            data_file.write(b',\n')
+        data_file.write(_json_bytes(feature))
+        count += 1
+    data_file.write(b'\n]}')
+    return count
+
+
+def _point_feature(location, properties):
+    return {"type": "Feature", "geometry": {"type": "Point", "coordinates": location}, "properties": properties}
+
+
+def _maneuver_features(route):
+    """
+    Point features of the maneuvers of a route (steps with a non-empty instruction), in route order.
+    """
+    number = 0
+    for leg in route['legs']:
+        for step in leg['steps']:
+            if isinstance(step, RouteStep):
+                # Read the record directly instead of building the whole step dictionary
+                instruction = step.instruction
+                if not instruction:
+                    continue
+                location = [step.start_longitude, step.start_latitude]
+                maneuver_type, modifier = "turn", MANEUVER_MODIFIERS[step.maneuver_type]
+                bearing_before, bearing_after = step.bearing_before, step.bearing_after
+                step_distance, step_duration = step.distance, step.duration
+            else:
+                maneuver = step['maneuver']
+                instruction = maneuver['instruction']
+                if not instruction:  # Only include non-empty instructions
+                    continue
+                location = maneuver['location']
+                maneuver_type, modifier = maneuver['type'], maneuver['modifier']
+                bearing_before, bearing_after = maneuver['bearing_before'], maneuver['bearing_after']
+                step_distance, step_duration = step['distance'], step['duration']
+            number += 1
+            yield _point_feature(location, {
+                'number': number,
+                'instruction': instruction,
+                'type': maneuver_type,
+                'modifier': modifier,
+                'bearing_before': bearing_before,
+                'bearing_after': bearing_after,
+                'step_distance': step_distance,
+                'step_duration': step_duration
+            })
+
 
+def _voice_instruction_features(route, voice_instruction_distance=0):
+    """
+    Point features of the voice instructions of a route, in route order.
+    """
+    number = 0
     for leg in route['legs']:
         for step_idx, step in enumerate(leg['steps']):
-            maneuver = step['maneuver']
-            if maneuver['instruction']:  # Only include non-empty instructions
-                maneuvers.append({
-                    'location': maneuver['location'],
-                    'instruction': maneuver['instruction'],
-                    'type': maneuver['type'],
-                    'modifier': maneuver['modifier'],
-                    'bearing_before': maneuver['bearing_before'],
-                    'bearing_after': maneuver['bearing_after'],
-                    'step_distance': step['distance'],
-                    'step_duration': step['duration']
+            if isinstance(step, RouteStep):
+                maneuver_location = [step.start_longitude, step.start_latitude]
+                voice_instructions = [voice_instruction.to_dict() for voice_instruction in step.voice_instructions]
+            else:
+                maneuver_location = step['maneuver']['location']
+                voice_instructions = step['voiceInstructions']
+
+            for voice_instr in voice_instructions:
+                if not voice_instr['announcement']:  # Only include non-empty announcements
+                    continue
+                # Voice instruction position is determined during route generation; fall back to the maneuver
+                voice_location = voice_instr.get('location') or maneuver_location
+                number += 1
+                yield _point_feature(voice_location, {
+                    'number': number,
+                    'announcement': voice_instr['announcement'],
+                    'ssmlAnnouncement': voice_instr['ssmlAnnouncement'],
+                    'distanceAlongGeometry': voice_instr['distanceAlongGeometry'],
+                    'step_index': step_idx,
+                    # The actual safe distance used, or the configured distance
+                    'distance_from_maneuver': voice_instr.get('safe_distance_used', voice_instruction_distance),
+                    'configured_distance': voice_instruction_distance,
+                    'target_maneuver_step': voice_instr.get('target_maneuver_step', 'N/A')
                 })
 
-            for voice_instr in step['voiceInstructions']:
-                if voice_instr['announcement']:  # Only include non-empty announcements
-                    # Voice instruction position is now determined during route generation
-                    # Check if the voice instruction has a custom location
-                    if 'location' in voice_instr and voice_instr['location']:
-                        voice_location = voice_instr['location']
-                    else:
-                        voice_location = maneuver['location']  # Fallback to maneuver location
-
-                    # Get the actual safe distance used, or fallback to configured distance
-                    actual_distance = voice_instr.get('safe_distance_used', voice_instruction_distance)
-
-                    voice_instructions.append({
-                        'location': voice_location,
-                        'announcement': voice_instr['announcement'],
-                        'ssmlAnnouncement': voice_instr['ssmlAnnouncement'],
-                        'distanceAlongGeometry': voice_instr['distanceAlongGeometry'],
-                        'step_index': step_idx,
-                        'distance_from_maneuver': actual_distance,
-                        'configured_distance': voice_instruction_distance,
-                        'target_maneuver_step': voice_instr.get('target_maneuver_step', 'N/A')
-                    })
-
-    # Define the HTML content
-    html_content = """
+
+def _map_view_html(mapbox_token, center):
+    """
+    HTML of the map view before and after the data declarations (routeData, maneuversData,
+    voiceInstructionsData, maneuverCount and voiceInstructionCount).
+    """
+    html_head = """
     <!DOCTYPE html>
     <html lang="en">
     <head>
@@ -542,22 +2271,11 @@ def create_html_map_view(route_response, voice_instruction_distance=0):
                 font-weight: bold;
                 color: #555;
             }
-            .maneuver-marker {
-                background-color: #ff6b6b;
+            .legend-dot {
+                display: inline-block;
                 border: 2px solid #fff;
                 border-radius: 50%;
-                width: 20px;
-                height: 20px;
-                cursor: pointer;
-                box-shadow: 0 2px 4px rgba(0,0,0,0.3);
-            }
-            .voice-marker {
-                background-color: #4ecdc4;
-                border: 2px solid #fff;
-                border-radius: 50%;
-                width: 16px;
-                height: 16px;
-                cursor: pointer;
+                margin-right: 5px;
                 box-shadow: 0 2px 4px rgba(0,0,0,0.3);
             }
         </style>
@@ -566,31 +2284,87 @@ def create_html_map_view(route_response, voice_instruction_distance=0):
     <div id="map"></div>
     <script>
 	mapboxgl.accessToken = '"""
+    html_head += str(mapbox_token) + "';"
+    html_head += """
 
-    html_content += str(public_mapbox_token) + "';"
-    html_content += """
-
-    // Maneuvers and voice instructions data
-    const maneuvers = """ + json.dumps(maneuvers) + """;
-    const voiceInstructions = """ + json.dumps(voice_instructions) + """;
+    // Route, maneuvers and voice instructions: GeoJSON file URLs or inline GeoJSON
+    """
 
+    html_tail = """
     const map = new mapboxgl.Map({
         container: 'map',
         center: """
-    html_content += str(coordinates_global[0]) + ","
-    html_content += """    zoom: 11
+    html_tail += str(center) + ","
+    html_tail += """    zoom: 11
     });
 
+    // Clustered point source with a circle layer for clusters, their counts and the single points
+    function addPointLayers(name, data, color, radius) {
+        map.addSource(name, {
+            'type': 'geojson',
+            'data': data,
+            'cluster': true,
+            'clusterMaxZoom': 14,
+            'clusterRadius': 40
+        });
+        map.addLayer({
+            'id': name + '-clusters',
+            'type': 'circle',
+            'source': name,
+            'filter': ['has', 'point_count'],
+            'paint': {
+                'circle-color': color,
+                'circle-opacity': 0.8,
+                'circle-radius': ['step', ['get', 'point_count'], 14, 10, 18, 100, 24, 1000, 30],
+                'circle-stroke-width': 2,
+                'circle-stroke-color': '#fff'
+            }
+        });
+        map.addLayer({
+            'id': name + '-cluster-count',
+            'type': 'symbol',
+            'source': name,
+            'filter': ['has', 'point_count'],
+            'layout': {
+                'text-field': ['get', 'point_count_abbreviated'],
+                'text-size': 12
+            }
+        });
+        map.addLayer({
+            'id': name,
+            'type': 'circle',
+            'source': name,
+            'filter': ['!', ['has', 'point_count']],
+            'paint': {
+                'circle-color': color,
+                'circle-radius': radius,
+                'circle-stroke-width': 2,
+                'circle-stroke-color': '#fff'
+            }
+        });
+
+        // Zoom into a cluster when it is clicked
+        map.on('click', name + '-clusters', (e) => {
+            const cluster = e.features[0];
+            map.getSource(name).getClusterExpansionZoom(cluster.properties.cluster_id, (err, zoom) => {
+                if (!err) {
+                    map.easeTo({ center: cluster.geometry.coordinates, zoom: zoom });
+                }
+            });
+        });
+        for (const layer of [name, name + '-clusters']) {
+            map.on('mouseenter', layer, () => { map.getCanvas().style.cursor = 'pointer'; });
+            map.on('mouseleave', layer, () => { map.getCanvas().style.cursor = ''; });
+        }
+    }
+
     map.on('load', () => {
         // Add route line
         map.addSource('route', {
             'type': 'geojson',
             'lineMetrics': true,
-            'data':
-    """
-    html_content += str(geojson_feature_linestring_route)
-    html_content += "})"
-    html_content += """
+            'data': routeData
+        });
 
         map.addLayer({
             'id': 'route',
@@ -613,14 +2387,16 @@ def create_html_map_view(route_response, voice_instruction_distance=0):
             }
         });
 
-        // Add maneuver markers
-        maneuvers.forEach((maneuver, index) => {
-            const el = document.createElement('div');
-            el.className = 'maneuver-marker';
-            el.title = 'Maneuver: ' + maneuver.instruction;
+        addPointLayers('maneuvers', maneuversData, '#ff6b6b', 8);
+        addPointLayers('voice-instructions', voiceInstructionsData, '#4ecdc4', 6);
 
-            const popup = new mapboxgl.Popup({ offset: 25 }).setHTML(`
-                <div class="popup-title"> Maneuver ${index + 1}</div>
+        // Maneuver details
+        map.on('click', 'maneuvers', (e) => {
+            const maneuver = e.features[0].properties;
+            new mapboxgl.Popup({ offset: 15 })
+                .setLngLat(e.features[0].geometry.coordinates)
+                .setHTML(`
+                <div class="popup-title"> Maneuver ${maneuver.number}</div>
                 <div class="popup-details">
                     <div class="popup-detail-item">
                         <span class="popup-detail-label">Instruction:</span> ${maneuver.instruction}
@@ -641,22 +2417,17 @@ def create_html_map_view(route_response, voice_instruction_distance=0):
                         <span class="popup-detail-label">Bearing:</span> ${Math.round(maneuver.bearing_before)}° → ${Math.round(maneuver.bearing_after)}°
                     </div>
                 </div>
-            `);
-
-            new mapboxgl.Marker(el)
-                .setLngLat(maneuver.location)
-                .setPopup(popup)
+            `)
                 .addTo(map);
         });
 
-        // Add voice instruction markers
-        voiceInstructions.forEach((voice, index) => {
-            const el = document.createElement('div');
-            el.className = 'voice-marker';
-            el.title = 'Voice Instruction: ' + voice.announcement;
-
-            const popup = new mapboxgl.Popup({ offset: 25 }).setHTML(`
-                <div class="popup-title">🔊 Voice Instruction ${index + 1}</div>
+        // Voice instruction details
+        map.on('click', 'voice-instructions', (e) => {
+            const voice = e.features[0].properties;
+            new mapboxgl.Popup({ offset: 15 })
+                .setLngLat(e.features[0].geometry.coordinates)
+                .setHTML(`
+                <div class="popup-title">🔊 Voice Instruction ${voice.number}</div>
                 <div class="popup-details">
                     <div class="popup-detail-item">
                         <span class="popup-detail-label">Announcement:</span> ${voice.announcement}
@@ -685,11 +2456,7 @@ def create_html_map_view(route_response, voice_instruction_distance=0):
                         </details>
                     </div>
                 </div>
-            `);
-
-            new mapboxgl.Marker(el)
-                .setLngLat(voice.location)
-                .setPopup(popup)
+            `)
                 .addTo(map);
         });
 
@@ -697,8 +2464,8 @@ def create_html_map_view(route_response, voice_instruction_distance=0):
         const legend = document.createElement('div');
         legend.innerHTML = `
             <div style="position: absolute; top: 10px; left: 10px; background: rgba(255,255,255,0.9); padding: 10px; border-radius: 5px; font-size: 12px; box-shadow: 0 2px 4px rgba(0,0,0,0.2);">
-                <div style="margin-bottom: 5px;"><span class="maneuver-marker" style="display: inline-block; margin-right: 5px;"></span> Maneuvers (${maneuvers.length})</div>
-                <div><span class="voice-marker" style="display: inline-block; margin-right: 5px;"></span> Voice Instructions (${voiceInstructions.length})</div>
+                <div style="margin-bottom: 5px;"><span class="legend-dot" style="background-color: #ff6b6b; width: 16px; height: 16px;"></span> Maneuvers (${maneuverCount})</div>
+                <div><span class="legend-dot" style="background-color: #4ecdc4; width: 12px; height: 12px;"></span> Voice Instructions (${voiceInstructionCount})</div>
             </div>
         `;
         map.getContainer().appendChild(legend);
@@ -707,13 +2474,10 @@ def create_html_map_view(route_response, voice_instruction_distance=0):
     </body>
     </html>
     """
-    # Write the HTML content to a file
-    with open("route_visualization.html", "w", encoding='utf-8') as file:
-        file.write(html_content)
-
+    return html_head, html_tail
 
 
-def calculate_safe_voice_instruction_distances(maneuver_locations, waypoints, desired_distance):
+def calculate_safe_voice_instruction_distances(maneuver_locations, waypoints, desired_distance, route_index=None):
     """
     Calculate safe voice instruction distances for each maneuver to prevent overlapping.
 
@@ -721,6 +2485,8 @@ def calculate_safe_voice_instruction_distances(maneuver_locations, waypoints, de
         maneuver_locations: List of [longitude, latitude] for each maneuver
         waypoints: List of waypoint dictionaries with 'latitude' and 'longitude' keys
         desired_distance: Desired distance in meters before maneuver
+        route_index: Optional RouteIndex of the waypoints. If its maneuver_indices correspond to
+            maneuver_locations, distances are looked up instead of searched along the route.
 
     Returns:
         List of safe distances (in meters) for each maneuver's voice instruction
@@ -730,6 +2496,7 @@ def calculate_safe_voice_instruction_distances(maneuver_locations, waypoints, de
         return [desired_distance] * len(maneuver_locations)
 
     safe_distances = []
+    use_index = route_index is not None and len(route_index.maneuver_indices) == len(maneuver_locations)
 
     for i, current_maneuver in enumerate(maneuver_locations):
         if i == 0:
@@ -737,10 +2504,13 @@ def calculate_safe_voice_instruction_distances(maneuver_locations, waypoints, de
             safe_distances.append(desired_distance)
         else:
             # Calculate distance between current and previous maneuver
-            prev_maneuver = maneuver_locations[i-1]
-            distance_to_prev = calculate_route_distance_between_points(
-                waypoints, prev_maneuver, current_maneuver
-            )
+            if use_index:
+                distance_to_prev = route_index.distance_between_maneuvers(i - 1, i)
+            else:
+                prev_maneuver = maneuver_locations[i-1]
+                distance_to_prev = calculate_route_distance_between_points(
+                    waypoints, prev_maneuver, current_maneuver, route_index
+                )
 
             # Use the smaller of: desired distance or half the distance to previous maneuver
             # This ensures voice instructions don't cross over each other
@@ -750,7 +2520,7 @@ def calculate_safe_voice_instruction_distances(maneuver_locations, waypoints, de
     return safe_distances
 
 
-def calculate_route_distance_between_points(waypoints, point1, point2):
+def calculate_route_distance_between_points(waypoints, point1, point2, route_index=None):
     """
     Calculate the route distance between two points along the waypoints path.
 
@@ -758,6 +2528,8 @@ def calculate_route_distance_between_points(waypoints, point1, point2):
         waypoints: List of waypoint dictionaries with 'latitude' and 'longitude' keys
         point1: [longitude, latitude] of first point
         point2: [longitude, latitude] of second point
+        route_index: Optional RouteIndex of the waypoints; points that are not route vertices are then
+            matched to their nearest vertex with its spatial index instead of a scan over all waypoints
 
     Returns:
         Distance in meters along the route between the two points
@@ -765,6 +2537,11 @@ def calculate_route_distance_between_points(waypoints, point1, point2):
     if not waypoints or len(waypoints) < 2:
         return 0
 
+    if route_index is not None:
+        idx1 = route_index.nearest_vertex_index(point1)
+        idx2 = route_index.nearest_vertex_index(point2)
+        return abs(route_index.distance_between(idx1, idx2))
+
     # Find closest waypoint indices for both points
     def find_closest_waypoint_index(target_point):
         target_lon, target_lat = target_point
@@ -799,7 +2576,7 @@ def calculate_route_distance_between_points(waypoints, point1, point2):
     return total_distance
 
 
-def find_position_before_point(waypoints, target_location, distance_before):
+def find_position_before_point(waypoints, target_location, distance_before, route_index=None):
     """
     Calculate a position along the route geometry at a specified distance before a target point.
 
@@ -807,6 +2584,8 @@ def find_position_before_point(waypoints, target_location, distance_before):
         waypoints: List of waypoint dictionaries with 'latitude' and 'longitude' keys
         target_location: [longitude, latitude] of the target point (maneuver location)
         distance_before: Distance in meters before the target point to find the position
+        route_index: Optional RouteIndex of the waypoints; a target_location that is not a route vertex is then
+            matched to its nearest vertex with its spatial index instead of a scan over all waypoints
 
     Returns:
         [longitude, latitude] of the interpolated position, or target_location if distance cannot be achieved
@@ -814,6 +2593,9 @@ def find_position_before_point(waypoints, target_location, distance_before):
     if not waypoints or len(waypoints) < 2 or distance_before <= 0:
         return target_location
 
+    if route_index is not None:
+        return route_index.position_before(route_index.nearest_vertex_index(target_location), distance_before)
+
     # Find the closest waypoint to the target location
     target_lon, target_lat = target_location
     closest_index = 0
@@ -861,9 +2643,420 @@ def find_position_before_point(waypoints, target_location, distance_before):
     return target_location
 
 
+class RouteIndex:
+    """
+    Per-leg index of prefix-sum route distances and maneuver vertex indices.
+
+    Built once per leg, it answers "distance between two vertices/maneuvers" with a subtraction and
+    "position N meters before a vertex/maneuver" with a bisect over the cumulative distances, instead of
+    the nearest-waypoint scans done by calculate_route_distance_between_points and find_position_before_point.
+    Locations that are not route vertices are looked up in its spatial_index (a WaypointGrid).
+    """
+
+    def __init__(self, waypoints, distances=None, maneuver_indices=None):
+        """
+        Args:
+            waypoints: List of waypoint dictionaries with 'latitude' and 'longitude' keys
+            distances: Optional per-segment distances in meters (as returned by compute_leg_geometry)
+            maneuver_indices: Optional list of waypoint indices at which maneuvers take place, in route order
+        """
+        if distances is None:
+            distances = compute_leg_geometry(waypoints)[2]
+        self.waypoints = waypoints
+        self.distances = list(distances)
+        self.cumulative_distances = [0.0] + list(accumulate(self.distances))
+        self.maneuver_indices = list(maneuver_indices) if maneuver_indices else []
+        self._vertex_indices = None
+        self._spatial_index = None
+
+    def vertex_index(self, location):
+        """
+        Return the index of the first waypoint exactly at location ([longitude, latitude]), or None.
+        """
+        if self._vertex_indices is None:
+            self._vertex_indices = {}
+            for i, waypoint in enumerate(self.waypoints):
+                self._vertex_indices.setdefault((waypoint["longitude"], waypoint["latitude"]), i)
+        return self._vertex_indices.get((location[0], location[1]))
+
+    @property
+    def spatial_index(self):
+        """
+        WaypointGrid of the waypoints, built on first use.
+        """
+        if self._spatial_index is None:
+            self._spatial_index = WaypointGrid(self.waypoints)
+        return self._spatial_index
+
+    def nearest_vertex_index(self, location):
+        """
+        Index of the waypoint at location, or else of the nearest waypoint (see WaypointGrid.nearest_vertex).
+        """
+        vertex_index = self.vertex_index(location)
+        if vertex_index is None:
+            vertex_index = self.spatial_index.nearest_vertex(location)[0]
+        return vertex_index
+
+    def snap_to_route(self, location):
+        """
+        Snap a location, e.g. a depot stop or via-point, onto the nearest point of the route.
+
+        Args:
+            location: [longitude, latitude]
+
+        Returns:
+            Tuple (distance in meters along the route of the snapped point, [longitude, latitude] of the snapped
+            point, distance in meters of the location from the route)
+        """
+        segment_index, fraction, distance = self.spatial_index.nearest_segment(location)
+        if segment_index is None:
+            vertex = self.waypoints[0]
+            return 0.0, [vertex["longitude"], vertex["latitude"]], haversine_distance(
+                location[1], location[0], vertex["latitude"], vertex["longitude"])
+        start_point = self.waypoints[segment_index]
+        end_point = self.waypoints[segment_index + 1]
+        snapped_location = [start_point["longitude"] + fraction * (end_point["longitude"] - start_point["longitude"]),
+                            start_point["latitude"] + fraction * (end_point["latitude"] - start_point["latitude"])]
+        distance_along = self.cumulative_distances[segment_index] + fraction * self.distances[segment_index]
+        return distance_along, snapped_location, distance
+
+    def distance_between(self, index1, index2):
+        """
+        Distance in meters along the route from waypoint index1 to waypoint index2.
+        """
+        return self.cumulative_distances[index2] - self.cumulative_distances[index1]
+
+    def distance_between_maneuvers(self, maneuver1, maneuver2):
+        """
+        Distance in meters along the route between two entries of maneuver_indices.
+        """
+        return abs(self.distance_between(self.maneuver_indices[maneuver1], self.maneuver_indices[maneuver2]))
+
+    def position_before(self, vertex_index, distance_before):
+        """
+        Interpolate the position distance_before meters along the route before waypoint vertex_index.
+
+        Returns:
+            [longitude, latitude] of the position, the vertex itself if distance_before <= 0,
+            or the first waypoint if the route start is reached first
+        """
+        vertex = self.waypoints[vertex_index]
+        if distance_before <= 0:
+            return [vertex["longitude"], vertex["latitude"]]
+
+        # Last segment start that is at least distance_before meters before the vertex
+        target_distance = self.cumulative_distances[vertex_index] - distance_before
+        segment_index = bisect_right(self.cumulative_distances, target_distance, 0, vertex_index) - 1
+        if segment_index < 0:
+            return [self.waypoints[0]["longitude"], self.waypoints[0]["latitude"]]
+
+        previous_point = self.waypoints[segment_index]
+        current_point = self.waypoints[segment_index + 1]
+        remaining_distance = distance_before - self.distance_between(segment_index + 1, vertex_index)
+        t = remaining_distance / self.distances[segment_index]  # 0 = current, 1 = previous
+
+        # Linear interpolation (moving backwards along the segment)
+        interpolated_lon = current_point["longitude"] + t * (previous_point["longitude"] - current_point["longitude"])
+        interpolated_lat = current_point["latitude"] + t * (previous_point["latitude"] - current_point["latitude"])
+        return [interpolated_lon, interpolated_lat]
+
+    def position_before_maneuver(self, maneuver, distance_before):
+        """
+        Interpolate the position distance_before meters along the route before the given maneuver.
+        """
+        return self.position_before(self.maneuver_indices[maneuver], distance_before)
+
+
+def _repeated_ranges(counts):
+    # Concatenation of range(count) for every count, e.g. [2, 3] -> [0, 1, 0, 1, 2]
+    return np.arange(int(counts.sum())) - np.repeat(np.cumsum(counts) - counts, counts)
+
+
+class WaypointGrid:
+    """
+    Uniform grid over the waypoints of a leg for nearest-vertex and nearest-segment queries.
+
+    Waypoints are projected to meters (equirectangular, with the smallest cosine of latitude of the leg, so
+    projected distances never exceed true ones) and bucketed into square cells about one average segment
+    long; each segment is registered in every cell it crosses. A query searches rings of cells around its
+    location and stops once the next ring cannot hold anything closer than the best match so far, so it
+    touches a few cells near the route instead of every waypoint. Legs crossing the antimeridian are
+    searched linearly (vectorized).
+    """
+
+    EARTH_RADIUS_METERS = 6371000.0
+    # Relative slack of the ring search stop, covering the curvature the planar projection ignores
+    SEARCH_SLACK = 1e-3
+
+    def __init__(self, waypoints):
+        """
+        Args:
+            waypoints: List of waypoint dictionaries with 'latitude' and 'longitude' keys
+        """
+        self.longitudes = np.fromiter((point["longitude"] for point in waypoints), dtype=np.float64,
+                                      count=len(waypoints))
+        self.latitudes = np.fromiter((point["latitude"] for point in waypoints), dtype=np.float64,
+                                     count=len(waypoints))
+        self.linear = (len(waypoints) == 0 or
+                       float(self.longitudes.max() - self.longitudes.min()) > 180)  # antimeridian
+        if self.linear:
+            return
+
+        self.cos_reference = max(float(np.cos(np.radians(np.abs(self.latitudes).max()))), 1e-6)
+        x, y = self._project(self.longitudes, self.latitudes)
+        self.x_min, self.y_min = float(x.min()), float(y.min())
+        segment_lengths = np.hypot(np.diff(x), np.diff(y))
+        self.cell_size = max(float(segment_lengths.mean()) if len(segment_lengths) else 0.0, 1.0)
+        grid_x = (x - self.x_min) / self.cell_size
+        grid_y = (y - self.y_min) / self.cell_size
+        cell_x = grid_x.astype(np.int64)
+        cell_y = grid_y.astype(np.int64)
+        self.columns = int(cell_x.max()) + 1
+        self.rows = int(cell_y.max()) + 1
+
+        self._vertex_cells = self._cell_table(cell_x * self.rows + cell_y, np.arange(len(waypoints)))
+        self._segment_cells = self._cell_table(*self._segment_cell_entries(grid_x, grid_y, cell_x, cell_y))
+
+    def _project(self, longitudes, latitudes):
+        meters_per_degree = radians(1) * self.EARTH_RADIUS_METERS
+        return longitudes * (meters_per_degree * self.cos_reference), latitudes * meters_per_degree
+
+    @staticmethod
+    def _cell_table(keys, indices):
+        # Cell key -> array of the indices in it (ascending), from one sort
+        order = np.argsort(keys, kind='stable')
+        keys, indices = keys[order], indices[order]
+        unique_keys, starts = np.unique(keys, return_index=True)
+        ends = np.append(starts[1:], len(keys))
+        return {key: indices[start:end] for key, start, end in zip(unique_keys.tolist(), starts, ends)}
+
+    def _segment_cell_entries(self, grid_x, grid_y, cell_x, cell_y):
+        # (cell key, segment index) pairs of every cell each segment crosses: for every column a segment
+        # spans, the rows of the part of the segment within that column
+        if len(grid_x) < 2:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        first_columns = np.minimum(cell_x[:-1], cell_x[1:])
+        column_counts = np.abs(cell_x[1:] - cell_x[:-1]) + 1
+        segments = np.repeat(np.arange(len(grid_x) - 1), column_counts)
+        columns = first_columns[segments] + _repeated_ranges(column_counts)
+
+        start_x, end_x = grid_x[segments], grid_x[segments + 1]
+        start_y, end_y = grid_y[segments], grid_y[segments + 1]
+        delta_x = end_x - start_x
+        with np.errstate(invalid='ignore', divide='ignore'):
+            t0 = np.where(delta_x != 0, np.clip((columns - start_x) / delta_x, 0.0, 1.0), 0.0)
+            t1 = np.where(delta_x != 0, np.clip((columns + 1 - start_x) / delta_x, 0.0, 1.0), 1.0)
+        row_a = start_y + t0 * (end_y - start_y)
+        row_b = start_y + t1 * (end_y - start_y)
+        first_rows = np.floor(np.minimum(row_a, row_b)).astype(np.int64)
+        last_rows = np.minimum(np.floor(np.maximum(row_a, row_b)).astype(np.int64), self.rows - 1)
+        row_counts = last_rows - first_rows + 1
+
+        entries = np.repeat(np.arange(len(segments)), row_counts)
+        rows = first_rows[entries] + _repeated_ranges(row_counts)
+        return columns[entries] * self.rows + rows, segments[entries]
+
+    def _ring_search(self, location, cells, distances, count):
+        """
+        Best (distance, index) over the cells around location, ring by ring.
+
+        Far from the leg most cells are empty; once more cells have been visited than a vectorized scan
+        of all count indices would cost, the scan is done instead.
+
+        Args:
+            cells: Cell table of vertices or segments
+            distances: Function of (location, index array) returning the true distances in meters
+            count: Number of vertices or segments
+        """
+        query_x, query_y = self._project(float(location[0]), float(location[1]))
+        grid_x = (query_x - self.x_min) / self.cell_size
+        grid_y = (query_y - self.y_min) / self.cell_size
+        cell_x, cell_y = math.floor(grid_x), math.floor(grid_y)
+        # Projected distances of points poleward of the leg can exceed the true ones by this factor
+        scale = max(1.0, self.cos_reference / max(cos(radians(float(location[1]))), 1e-6)) * (1 + self.SEARCH_SLACK)
+
+        # Rings outside the grid hold no cells
+        first_ring = max(0, -cell_x, cell_x - self.columns + 1, -cell_y, cell_y - self.rows + 1)
+        last_ring = max(cell_x, self.columns - 1 - cell_x, cell_y, self.rows - 1 - cell_y)
+        best_distance, best_index = math.inf, None
+        cell_budget = max(256, count // 16)
+        for ring in range(first_ring, last_ring + 1):
+            cell_budget -= 8 * ring or 1
+            if cell_budget < 0:
+                all_distances = distances(location, np.arange(count))
+                index = int(np.argmin(all_distances))  # the first of equal distances
+                return float(all_distances[index]), index
+            if ring > 0:
+                # Anything in this ring lies outside the (2 ring - 1) cells wide block around the query cell
+                margin = min(grid_x - (cell_x - ring + 1), cell_x + ring - grid_x,
+                             grid_y - (cell_y - ring + 1), cell_y + ring - grid_y) * self.cell_size
+                if margin > best_distance * scale:
+                    break
+            for column, row in self._ring_cells(cell_x, cell_y, ring):
+                candidates = cells.get(column * self.rows + row)
+                if candidates is None:
+                    continue
+                candidate_distances = distances(location, candidates)
+                distance = float(candidate_distances.min())
+                index = int(candidates[candidate_distances == distance].min())  # ties: the lowest index
+                if best_index is None or (distance, index) < (best_distance, best_index):
+                    best_distance, best_index = distance, index
+        return best_distance, best_index
+
+    def _ring_cells(self, cell_x, cell_y, ring):
+        # Cells at Chebyshev distance ring from (cell_x, cell_y) that lie in the grid
+        if ring == 0:
+            yield cell_x, cell_y
+            return
+        first_column, last_column = max(cell_x - ring, 0), min(cell_x + ring, self.columns - 1)
+        for row in (cell_y - ring, cell_y + ring):
+            if 0 <= row < self.rows:
+                for column in range(first_column, last_column + 1):
+                    yield column, row
+        for column in (cell_x - ring, cell_x + ring):
+            if 0 <= column < self.columns:
+                for row in range(max(cell_y - ring + 1, 0), min(cell_y + ring - 1, self.rows - 1) + 1):
+                    yield column, row
+
+    def _vertex_distances(self, location, indices):
+        # Haversine distances, same formulation as haversine_distance
+        lon, lat = float(location[0]), float(location[1])
+        latitudes, longitudes = self.latitudes[indices], self.longitudes[indices]
+        dlat = np.radians(latitudes - lat)
+        dlon = np.radians(longitudes - lon)
+        a = np.sin(dlat / 2) ** 2 + cos(radians(lat)) * np.cos(np.radians(latitudes)) * np.sin(dlon / 2) ** 2
+        return self.EARTH_RADIUS_METERS * (2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a)))
+
+    def _segment_projection(self, location, indices):
+        # Fraction along each segment of the point closest to location and its distance, in a local planar
+        # projection around location
+        lon, lat = float(location[0]), float(location[1])
+        meters_per_degree = radians(1) * self.EARTH_RADIUS_METERS
+        cos_lat = cos(radians(lat))
+        start_x = (self.longitudes[indices] - lon) * meters_per_degree * cos_lat
+        start_y = (self.latitudes[indices] - lat) * meters_per_degree
+        delta_x = (self.longitudes[indices + 1] - lon) * meters_per_degree * cos_lat - start_x
+        delta_y = (self.latitudes[indices + 1] - lat) * meters_per_degree - start_y
+        length_squared = delta_x ** 2 + delta_y ** 2
+        with np.errstate(invalid='ignore', divide='ignore'):
+            fractions = np.where(length_squared > 0, -(start_x * delta_x + start_y * delta_y) / length_squared, 0.0)
+        fractions = np.clip(fractions, 0.0, 1.0)
+        return fractions, np.hypot(start_x + fractions * delta_x, start_y + fractions * delta_y)
+
+    def nearest_vertex(self, location):
+        """
+        Nearest waypoint to a location, by haversine distance.
+
+        Args:
+            location: [longitude, latitude]
+
+        Returns:
+            Tuple (waypoint index, distance in meters) of the first nearest waypoint (as a linear scan would
+            find it), or (None, inf) without waypoints
+        """
+        if self.linear:
+            if len(self.longitudes) == 0:
+                return None, math.inf
+            distances = self._vertex_distances(location, np.arange(len(self.longitudes)))
+            index = int(np.argmin(distances))  # the first of equal distances
+            return index, float(distances[index])
+        distance, index = self._ring_search(location, self._vertex_cells, self._vertex_distances,
+                                            len(self.longitudes))
+        return index, distance
+
+    def nearest_segment(self, location):
+        """
+        Nearest point on the leg's segments to a location.
+
+        Args:
+            location: [longitude, latitude]
+
+        Returns:
+            Tuple (segment index, fraction along the segment from 0 at its start to 1 at its end, distance in
+            meters), or (None, 0.0, inf) if the leg has no segments
+        """
+        if len(self.longitudes) < 2:
+            return None, 0.0, math.inf
+        if self.linear:
+            segments = np.arange(len(self.longitudes) - 1)
+            fractions, distances = self._segment_projection(location, segments)
+            index = int(np.argmin(distances))
+            return index, float(fractions[index]), float(distances[index])
+        distance, index = self._ring_search(location, self._segment_cells,
+                                            lambda location, indices: self._segment_projection(location, indices)[1],
+                                            len(self.longitudes) - 1)
+        fractions, _ = self._segment_projection(location, np.array([index]))
+        return index, float(fractions[0]), distance
+
+
+class VoiceInstructionSweep:
+    """
+    Monotonic two-pointer assignment of voice instructions to steps.
+
+    Voice instruction positions are ordered along the route (each one is at most half way back to the
+    previous maneuver), so the step whose start is closest along the route to the next voice instruction
+    is found by advancing a single pointer over the cumulative step start distances.
+    Over a whole leg this takes O(maneuvers + steps) instead of comparing every maneuver with every step.
+    """
+
+    def __init__(self, cumulative_distances):
+        """
+        Args:
+            cumulative_distances: Distance along the route of each waypoint, i.e. of each step start
+        """
+        self.cumulative_distances = cumulative_distances
+        self.step_index = 0
+
+    def target_step(self, voice_distance_along, maneuver_step_index):
+        """
+        Return the index of the step that should carry a voice instruction.
+
+        Args:
+            voice_distance_along: Distance along the route of the voice instruction; must not decrease
+                between calls
+            maneuver_step_index: Index of the step starting with the announced maneuver
+
+        Returns:
+            Index of the step before maneuver_step_index starting closest to the voice instruction,
+            or None if there is no step before the maneuver
+        """
+        if maneuver_step_index <= 0:
+            return None
+
+        cumulative_distances = self.cumulative_distances
+        index = self.step_index
+        while index + 1 < maneuver_step_index and cumulative_distances[index + 1] <= voice_distance_along:
+            index += 1
+        self.step_index = index
+
+        # The voice instruction lies between the start of step index and the next one; pick the nearer start
+        if (index + 1 < maneuver_step_index and
+                cumulative_distances[index + 1] - voice_distance_along < voice_distance_along - cumulative_distances[index]):
+            return index + 1
+        return index
+
+
+def assign_voice_instruction_steps(route_index, safe_distances):
+    """
+    Assign the voice instruction of every maneuver of a leg to a step with a VoiceInstructionSweep.
+
+    Args:
+        route_index: RouteIndex of the leg's waypoints with its maneuver_indices
+        safe_distances: Distance in meters of each maneuver's voice instruction before the maneuver
+
+    Returns:
+        List with the target step index (or None) of each maneuver's voice instruction
+    """
+    cumulative_distances = route_index.cumulative_distances
+    voice_sweep = VoiceInstructionSweep(cumulative_distances)
+    target_steps = []
+    for maneuver_step_index, safe_distance in zip(route_index.maneuver_indices, safe_distances):
+        voice_distance_along = max(cumulative_distances[maneuver_step_index] - max(safe_distance, 0), 0)
+        target_steps.append(voice_sweep.target_step(voice_distance_along, maneuver_step_index))
+    return target_steps
+
+
 if __name__ == '__main__':
-    global_waypoints = []
-    coordinates_global = []
     # integer array of percentages of number of simplified wwaypoints to be part of each leg. Array length = number of legs
     leg_percentages = [100]  # elements must sum to 100
 
@@ -873,15 +3066,50 @@ if __name__ == '__main__':
     voice_instruction_distance = 100  # meters ahead of maneuver
 
     public_mapbox_token = 'YOUR_ACCESS_TOKEN'
-    gpx_input_file_names = ['gpx_input_files/test_file.gpx']
-    gpx_file = gpx_input_file_names[0]
-    route_response = gpx_to_mapbox_directions_response(gpx_file, voice_instruction_distance)
+    gpx_input_file_names = ['test_file.gpx']  # files in gpx_input_files/
+
+    parser = argparse.ArgumentParser(description="Convert a GPX file to a Mapbox DirectionsRoute")
+    parser.add_argument('gpx_file', nargs='?', default=gpx_input_file_names[0], help="file in gpx_input_files/")
+    parser.add_argument('--profile', nargs='?', const='conversion_profile.json', default=None, metavar='REPORT',
+                        help="record the time, memory and counts of every conversion stage and write them as "
+                             "JSON (default file: conversion_profile.json)")
+    parser.add_argument('--trace-memory', action='store_true',
+                        help="with --profile, also trace the Python allocations of every stage (slower)")
+    parser.add_argument('--waypoint-cache', action='store_true',
+                        help="keep the parsed and simplified coordinates in a .gpxc file next to the GPX file and "
+                             "reuse them on later runs")
+    parser.add_argument('--coalesce-steps', action='store_true',
+                        help="fold segments without a maneuver into the preceding step (one step per maneuver)")
+    parser.add_argument('--output-profile', choices=OUTPUT_PROFILES, default="full",
+                        help="lean leaves out debug fields and constant boilerplate (see LEAN_OMITTED_FIELDS)")
+    parser.add_argument('--compress', choices=list(COMPRESSIONS), default=None,
+                        help="write <file>.json.gz or <file>.json.br (brotli needs the brotli package)")
+    args = parser.parse_args()
+
+    gpx_file = args.gpx_file
+    converter = GpxToDirectionsConverter(leg_percentages, voice_instruction_distance, profile=args.profile is not None,
+                                         trace_memory=args.trace_memory, waypoint_cache=args.waypoint_cache,
+                                         coalesce_steps=args.coalesce_steps)
+    result = converter.convert(gpx_file)
+    route_response = result.response
     if route_response:
-        write_to_json_file(route_response, str(gpx_file) + '.json')
-        print(f"Converted route written to {gpx_file}.json")
-    print(route_response)
+        json_file_path = str(gpx_file) + '.json' + COMPRESSIONS.get(args.compress, '')
+        write_route_response(route_response, json_file_path, profile=result.profile,
+                             output_profile=args.output_profile, compression=args.compress)
+        print(f"Converted route written to {json_file_path}")
+
+    if result.profile is not None:
+        for stage in result.profile.stages:
+            print(f"{stage['name']:<16} {stage['seconds']:>9.4f}s")
+        for name, seconds in result.profile.accumulated_seconds.items():
+            print(f"  {name:<14} {seconds:>9.4f}s")
+        print(", ".join(f"{name}: {value}" for name, value in result.profile.counts.items()))
+        with open(args.profile, 'w') as profile_file:
+            json.dump({"file": gpx_file, "profile": result.profile.to_dict()}, profile_file, indent=2)
+        print(f"Conversion profile written to {args.profile}")
 
     # Visualize route
-    create_html_map_view(route_response, voice_instruction_distance)
-    print("Route can be viewed by opening route_visualization.html in a browser")
+    create_html_map_view(route_response, voice_instruction_distance, result.waypoints, public_mapbox_token)
+    print("Route can be viewed by serving this directory (python -m http.server) and opening "
+          "http://localhost:8000/route_visualization.html in a browser")
 
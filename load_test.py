@@ -0,0 +1,84 @@
+import argparse
+import math
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+# Load test for conversion_server.py: posts a GPX file to /convert from concurrent clients and reports
+# throughput and latency percentiles.
+#
+#   python conversion_server.py --workers 4 &
+#   python load_test.py gpx_input_files/test_file.gpx --requests 200 --concurrency 8
+
+
+def percentile(sorted_values, percent):
+    """
+    Nearest-rank percentile of an ascending list of values.
+    """
+    if not sorted_values:
+        return float('nan')
+    rank = max(1, int(math.ceil(percent / 100.0 * len(sorted_values))))
+    return sorted_values[rank - 1]
+
+
+def post_gpx(url, gpx_data):
+    """
+    Post a GPX document and return (HTTP status, latency in seconds).
+    """
+    request = urllib.request.Request(url, data=gpx_data, headers={"Content-Type": "application/gpx+xml"})
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except urllib.error.URLError:
+        status = 0
+    return status, time.perf_counter() - start
+
+
+def run_load_test(url, gpx_data, requests=100, concurrency=4):
+    """
+    Send requests conversions from concurrency clients.
+
+    Returns:
+        Dictionary with requests, errors, seconds, throughput (successful requests per second) and
+        latency percentiles p50/p95/p99 of successful requests in milliseconds
+    """
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as clients:
+        results = list(clients.map(lambda _: post_gpx(url, gpx_data), range(requests)))
+    seconds = time.perf_counter() - start
+
+    latencies = sorted(latency for status, latency in results if status == 200)
+    return {
+        "requests": requests,
+        "errors": requests - len(latencies),
+        "seconds": seconds,
+        "throughput": len(latencies) / seconds,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Measure throughput and latency of conversion_server.py")
+    parser.add_argument('gpx_file', help="GPX file to upload")
+    parser.add_argument('--url', default="http://127.0.0.1:8080/convert?voice_instruction_distance=100")
+    parser.add_argument('--requests', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=4)
+    args = parser.parse_args()
+
+    with open(args.gpx_file, 'rb') as gpx_file:
+        gpx_data = gpx_file.read()
+
+    # One request up front so connection setup and lazy initialization do not skew the numbers
+    post_gpx(args.url, gpx_data)
+
+    result = run_load_test(args.url, gpx_data, args.requests, args.concurrency)
+    print(f"{result['requests']} requests, concurrency {args.concurrency}, {result['errors']} errors")
+    print(f"throughput: {result['throughput']:.1f} req/s")
+    print(f"latency p50: {result['p50_ms']:.1f} ms  p95: {result['p95_ms']:.1f} ms  p99: {result['p99_ms']:.1f} ms")
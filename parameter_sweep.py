@@ -0,0 +1,180 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+import gpx_to_directions_route as converter
+
+# Converts one GPX file with every combination of a grid of simplification tolerances, leg splits and voice
+# instruction distances, e.g. to tune the parameters for a new region. Every stage is computed once per distinct
+# input and shared by all combinations that depend on it:
+#   parse                once per file
+#   simplification       once per tolerance (plus the route geometry, which does not depend on the leg split)
+#   leg_geometry         bearings and distances once per tolerance and leg split
+#   steps                steps and voice instructions once per combination
+# Each combination is written to its own JSON file, identical to a GpxToDirectionsConverter conversion with the
+# same parameters, and a summary of step counts, maneuver counts and timings is printed and written as JSON.
+
+
+def tolerance_label(tolerance, tolerance_meters):
+    return f"tolm{tolerance_meters:g}" if tolerance_meters is not None else f"tol{tolerance:g}"
+
+
+def combination_file_name(gpx_file_path, tolerance, tolerance_meters, leg_percentages, voice_instruction_distance):
+    """
+    Output file name of a combination, e.g. route.gpx.tol1e-05_legs20-80_vd100.json
+    """
+    return (f"{os.path.basename(gpx_file_path)}.{tolerance_label(tolerance, tolerance_meters)}"
+            f"_legs{'-'.join(str(p) for p in leg_percentages)}_vd{voice_instruction_distance:g}.json")
+
+
+def sweep_parameters(gpx_file_path, output_directory, tolerances=None, leg_splits=None,
+                     voice_instruction_distances=None, language=0, ingestion="gpxpy", compact=False):
+    """
+    Convert a GPX file with every combination of the parameter grid.
+
+    Args:
+        gpx_file_path: Path of the GPX file (first segment of the first track, or the first route)
+        output_directory: Directory for the JSON files, created if missing
+        tolerances: List of (tolerance in degrees, tolerance in meters or None) pairs, see
+            GpxToDirectionsConverter (default: the converter's default tolerance)
+        leg_splits: List of leg percentage lists, each summing to 100 (default: [[100]])
+        voice_instruction_distances: List of voice instruction distances in meters (default: [0])
+        language: 0 = english, 1 = arabic
+        ingestion: "gpxpy" or "stream", see GpxToDirectionsConverter
+        compact: Write compact instead of indented JSON
+
+    Returns:
+        Summary dictionary with the file, the timings of the shared stages ("stages") and one result per
+        combination ("results") with its parameters, output file, counts and timings
+    """
+    tolerances = tolerances or [(0.00001, None)]
+    leg_splits = leg_splits or [[100]]
+    voice_instruction_distances = voice_instruction_distances or [0]
+    os.makedirs(output_directory, exist_ok=True)
+    stages = []
+    results = []
+    sweep_start = time.perf_counter()
+
+    start = time.perf_counter()
+    gpx_converter = converter.GpxToDirectionsConverter(language=language, ingestion=ingestion)
+    longitudes, latitudes = gpx_converter.read_coordinates(os.path.abspath(gpx_file_path))
+    stages.append({"stage": "parse", "points": len(longitudes), "seconds": time.perf_counter() - start})
+
+    for tolerance, tolerance_meters in tolerances:
+        start = time.perf_counter()
+        simplified = converter.simplify_coordinate_columns(longitudes, latitudes, tolerance, tolerance_meters)
+        simplified_coordinates = simplified.tolist()
+        route_polyline = converter.RoutePolyline(converter.TrackCoordinates(simplified[:, 0], simplified[:, 1]))
+        stages.append({"stage": "simplification", "tolerance": tolerance, "tolerance_meters": tolerance_meters,
+                       "simplified_points": len(simplified_coordinates), "seconds": time.perf_counter() - start})
+
+        for leg_percentages in leg_splits:
+            start = time.perf_counter()
+            converter.validate_leg_percentages(leg_percentages)
+            waypoints_array = converter.split_into_legs(simplified_coordinates, leg_percentages)
+            leg_geometries = [converter.compute_leg_geometry(waypoints) for waypoints in waypoints_array]
+            stages.append({"stage": "leg_geometry", "tolerance": tolerance, "tolerance_meters": tolerance_meters,
+                           "leg_percentages": leg_percentages, "seconds": time.perf_counter() - start})
+
+            for voice_instruction_distance in voice_instruction_distances:
+                start = time.perf_counter()
+                legs_array = []
+                first_segment = 0
+                for waypoints, leg_geometry in zip(waypoints_array, leg_geometries):
+                    legs_array.append(converter.build_leg(waypoints, voice_instruction_distance, language,
+                                                          route_polyline, first_segment, leg_geometry=leg_geometry))
+                    first_segment += len(waypoints)
+                combination_converter = converter.GpxToDirectionsConverter(
+                    leg_percentages, voice_instruction_distance, language, tolerance,
+                    tolerance_meters=tolerance_meters)
+                result = combination_converter.convert_waypoints(waypoints_array, legs_array=legs_array,
+                                                                 route_polyline=route_polyline)
+                steps_seconds = time.perf_counter() - start
+
+                start = time.perf_counter()
+                json_file_path = os.path.join(output_directory, combination_file_name(
+                    gpx_file_path, tolerance, tolerance_meters, leg_percentages, voice_instruction_distance))
+                converter.write_route_response(result.response, json_file_path, compact)
+                write_seconds = time.perf_counter() - start
+
+                steps = [step for leg in legs_array for step in leg["steps"]]
+                results.append({
+                    "tolerance": tolerance,
+                    "tolerance_meters": tolerance_meters,
+                    "leg_percentages": leg_percentages,
+                    "voice_instruction_distance": voice_instruction_distance,
+                    "output": json_file_path,
+                    "simplified_points": len(simplified_coordinates),
+                    "steps": len(steps),
+                    "maneuvers": sum(1 for step in steps if step.instruction),
+                    "voice_instructions": sum(len(step.voice_instructions) for step in steps),
+                    "seconds": steps_seconds,
+                    "write_seconds": write_seconds
+                })
+
+    return {
+        "file": gpx_file_path,
+        "seconds": time.perf_counter() - sweep_start,
+        "stages": stages,
+        "results": results
+    }
+
+
+def parse_leg_split(value):
+    # "20,80" -> [20, 80]
+    try:
+        return [int(p) for p in value.split(',')]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Leg split must be comma-separated integers, got {value!r}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Convert a GPX file with every combination of a parameter grid")
+    parser.add_argument('gpx_file')
+    parser.add_argument('--output-dir', default="sweep_output", help="directory for the JSON files and the summary")
+    parser.add_argument('--tolerances', type=float, nargs='+', default=[],
+                        help="simplification tolerances in degrees")
+    parser.add_argument('--tolerances-meters', type=float, nargs='+', default=[],
+                        help="simplification tolerances in meters")
+    parser.add_argument('--leg-splits', type=parse_leg_split, nargs='+', default=[[100]],
+                        help="leg splits as comma-separated percentages, e.g. 100 20,80 30,40,30")
+    parser.add_argument('--voice-instruction-distances', type=float, nargs='+', default=[0, 50, 100],
+                        help="meters of voice instructions ahead of maneuvers")
+    parser.add_argument('--language', type=int, choices=[0, 1], default=0, help="0 = english, 1 = arabic")
+    parser.add_argument('--ingestion', choices=["gpxpy", "stream"], default="gpxpy")
+    parser.add_argument('--compact', action='store_true', help="write compact instead of indented JSON")
+    parser.add_argument('--summary', help="summary JSON file (default: sweep_summary.json in --output-dir)")
+    args = parser.parse_args()
+
+    tolerances = ([(tolerance, None) for tolerance in args.tolerances]
+                  + [(0.00001, tolerance_meters) for tolerance_meters in args.tolerances_meters])
+    try:
+        summary = sweep_parameters(args.gpx_file, args.output_dir, tolerances, args.leg_splits,
+                                   args.voice_instruction_distances, args.language, args.ingestion, args.compact)
+    except (OSError, ValueError) as e:
+        print(f"Sweep failed: {type(e).__name__}: {e}")
+        sys.exit(1)
+
+    for stage in summary["stages"]:
+        parameters = ""
+        if "tolerance" in stage:
+            parameters = tolerance_label(stage["tolerance"], stage["tolerance_meters"])
+        if "leg_percentages" in stage:
+            parameters += f" legs {'-'.join(str(p) for p in stage['leg_percentages'])}"
+        print(f"{stage['stage']:<15} {parameters:<24} {stage['seconds']:>9.4f}s")
+
+    print(f"\n{'tolerance':<12} {'legs':<10} {'vd':>6} {'points':>7} {'steps':>7} {'maneuvers':>9} "
+          f"{'voice':>6} {'steps s':>8} {'write s':>8}")
+    for result in summary["results"]:
+        print(f"{tolerance_label(result['tolerance'], result['tolerance_meters']):<12} "
+              f"{'-'.join(str(p) for p in result['leg_percentages']):<10} {result['voice_instruction_distance']:>6g} "
+              f"{result['simplified_points']:>7} {result['steps']:>7} {result['maneuvers']:>9} "
+              f"{result['voice_instructions']:>6} {result['seconds']:>8.4f} {result['write_seconds']:>8.4f}")
+    print(f"{len(summary['results'])} combinations in {summary['seconds']:.2f}s")
+
+    summary_file_path = args.summary or os.path.join(args.output_dir, "sweep_summary.json")
+    with open(summary_file_path, 'w') as summary_file:
+        json.dump(summary, summary_file, indent=2)
+    print(f"Summary written to {summary_file_path}")
@@ -0,0 +1,45 @@
+import os
+
+import pytest
+
+from batch_convert import convert_batch, find_gpx_files, input_root, output_file_path, output_file_paths
+from test_maneuvers import gpx_track
+
+
+def test_input_root(tmp_path):
+    assert input_root(str(tmp_path)) == str(tmp_path)
+    assert input_root(str(tmp_path / "**" / "*.gpx")) == str(tmp_path)
+    assert input_root(str(tmp_path / "drives" / "2024-*" / "*.gpx")) == str(tmp_path / "drives")
+
+
+def test_output_file_path_keeps_relative_path(tmp_path):
+    root = str(tmp_path / "drives")
+    output_directory = str(tmp_path / "out")
+    assert (output_file_path(os.path.join(root, "x", "r.gpx"), output_directory, "gzip", root) ==
+            os.path.join(output_directory, "x", "r.gpx.json.gz"))
+    assert output_file_path(os.path.join(root, "r.gpx"), output_directory, None, root) == \
+        os.path.join(output_directory, "r.gpx.json")
+    # without an output directory the JSON file is written next to the GPX file
+    assert output_file_path(os.path.join(root, "x", "r.gpx")) == os.path.join(root, "x", "r.gpx.json")
+
+
+def test_output_file_paths_collision(tmp_path):
+    gpx_file_paths = [str(tmp_path / "x" / "r.gpx"), str(tmp_path / "y" / "r.gpx")]
+    with pytest.raises(ValueError, match="would both be written to"):
+        output_file_paths(gpx_file_paths, str(tmp_path / "out"))
+    assert len(set(output_file_paths(gpx_file_paths, str(tmp_path / "out"), input_root=str(tmp_path)))) == 2
+
+
+def test_recursive_glob_with_output_directory(tmp_path):
+    for directory, points in [("x", [(13.0, 52.0), (13.01, 52.0)]), ("y", [(13.0, 52.0), (13.0, 52.01)])]:
+        os.makedirs(tmp_path / "drives" / directory)
+        (tmp_path / "drives" / directory / "r.gpx").write_text(gpx_track(points))
+    pattern = str(tmp_path / "drives" / "**" / "*.gpx")
+    gpx_file_paths = find_gpx_files(pattern)
+
+    results = convert_batch(gpx_file_paths, str(tmp_path / "out"), workers=1, input_root=input_root(pattern))
+    assert [result["status"] for result in results] == ['ok', 'ok']
+    assert [os.path.relpath(result["output"], tmp_path / "out") for result in results] == \
+        [os.path.join("x", "r.gpx.json"), os.path.join("y", "r.gpx.json")]
+    with pytest.raises(ValueError):
+        convert_batch(gpx_file_paths, str(tmp_path / "flat"), workers=1)
@@ -0,0 +1,66 @@
+import json
+import os
+import sys
+
+import gpx_to_directions_route as converter
+from conversion_cache import ConversionCache
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+from synthetic_gpx import synthetic_gpx_file  # noqa: E402
+
+
+def count_scans(cache, monkeypatch):
+    scans = []
+    entries = cache._entries
+    monkeypatch.setattr(cache, "_entries", lambda: scans.append(1) or entries())
+    return scans
+
+
+def test_put_scans_directory_only_to_evict(tmp_path, monkeypatch):
+    cache = ConversionCache(str(tmp_path), max_bytes=1000)
+    scans = count_scans(cache, monkeypatch)
+    for i in range(9):
+        cache.put(f"{i:064x}", b"x" * 100)
+    cache.put(f"{0:064x}", b"y" * 100)  # replacing an entry doesn't grow the cache
+    assert scans == []
+    assert cache.stats()["bytes"] == 900
+
+    cache.put(f"{9:064x}", b"x" * 100)
+    cache.put(f"{10:064x}", b"x" * 100)
+    assert len(scans) == 2  # stats() and the eviction above 1000 bytes
+    assert cache.stats() == {"hits": 0, "misses": 0, "entries": 10, "bytes": 1000}
+
+
+def test_running_total_seeded_from_existing_entries(tmp_path):
+    cache = ConversionCache(str(tmp_path), max_bytes=1000)
+    for i in range(10):
+        cache.put(f"{i:064x}", b"x" * 100)
+        # distinct modification times, oldest first
+        os.utime(cache._entry_path(f"{i:064x}"), (i, i))
+    cache.get(f"{0:064x}")  # most recently used now
+
+    reopened = ConversionCache(str(tmp_path), max_bytes=1000)
+    reopened.put(f"{10:064x}", b"x" * 100)
+    assert reopened.get(f"{0:064x}") is not None
+    assert reopened.get(f"{1:064x}") is None
+    assert reopened.stats()["bytes"] == 1000
+
+
+def test_cached_steps_are_dictionaries_that_serialize_alike(tmp_path):
+    gpx_file_path = synthetic_gpx_file(str(tmp_path), "urban_grid", 3000)
+    gpx_converter = converter.GpxToDirectionsConverter([50, 50], 100, waypoint_cache=True,
+                                                       cache=ConversionCache(str(tmp_path / "cache")))
+    converted = gpx_converter.convert(gpx_file_path)
+    cached = gpx_converter.convert(gpx_file_path)
+    # the conversion cache bypasses the waypoint cache
+    assert sorted(os.listdir(tmp_path)) == sorted([os.path.basename(gpx_file_path), "cache"])
+
+    converted_steps = [step for leg in converted.response["routes"][0]["legs"] for step in leg["steps"]]
+    cached_steps = [step for leg in cached.response["routes"][0]["legs"] for step in leg["steps"]]
+    assert all(isinstance(step, converter.RouteStep) for step in converted_steps)
+    assert all(isinstance(step, dict) for step in cached_steps)
+    assert [converter.step_dict(step) for step in cached_steps] == json.loads(json.dumps(
+        [converter.step_dict(step) for step in converted_steps]))
+    assert (converter.serialize_route_response(cached.response, compact=True) ==
+            converter.serialize_route_response(converted.response, compact=True))
+    assert cached.waypoints == converted.waypoints
@@ -0,0 +1,70 @@
+import json
+import socket
+import threading
+
+import pytest
+
+from conversion_server import ConversionServer, parse_conversion_parameters
+
+
+@pytest.fixture(scope="module")
+def server_address():
+    server = ConversionServer(("127.0.0.1", 0), workers=1, max_request_bytes=1024)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server.server_address
+    server.shutdown()
+    server.server_close()
+
+
+def post(server_address, content_length, body=b"", query=""):
+    """
+    Send a raw POST /convert?query with the given Content-Length header and body.
+
+    Returns:
+        (status, decoded JSON body) of the response
+    """
+    with socket.create_connection(server_address, timeout=10) as connection:
+        connection.sendall(f"POST /convert?{query} HTTP/1.1\r\nHost: test\r\nContent-Length: {content_length}\r\n"
+                           f"Connection: close\r\n\r\n".encode() + body)
+        response = b""
+        while chunk := connection.recv(65536):
+            response += chunk
+    head, _, body = response.partition(b"\r\n\r\n")
+    return int(head.split()[1]), json.loads(body)
+
+
+@pytest.mark.parametrize("content_length", ["abc", "-1", "1.5", ""])
+def test_invalid_content_length(server_address, content_length):
+    status, body = post(server_address, content_length, b"<gpx/>")
+    assert status == 400
+    assert "Content-Length" in body["error"]
+
+
+def test_content_length_above_limit(server_address):
+    status, _ = post(server_address, 1025)
+    assert status == 413
+
+
+def test_body_read_up_to_content_length(server_address):
+    # only the announced bytes are read; the rest of the stream is not parsed as GPX
+    status, body = post(server_address, 6, b"<gpx/>trailing bytes")
+    assert status == 400
+    assert "Content-Length" not in body["error"]
+
+
+@pytest.mark.parametrize("voice_instruction_distance", ["nan", "inf", "-inf", "-50", "abc"])
+def test_invalid_voice_instruction_distance(voice_instruction_distance):
+    with pytest.raises(ValueError):
+        parse_conversion_parameters(f"voice_instruction_distance={voice_instruction_distance}")
+
+
+def test_invalid_voice_instruction_distance_rejected(server_address):
+    status, body = post(server_address, 6, b"<gpx/>", "voice_instruction_distance=nan")
+    assert status == 400
+    assert "Voice instruction distance" in body["error"]
+
+
+def test_valid_voice_instruction_distance():
+    assert parse_conversion_parameters("voice_instruction_distance=0")[1] == 0
+    assert parse_conversion_parameters("voice_instruction_distance=50.5")[1] == 50.5
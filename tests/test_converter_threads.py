@@ -0,0 +1,38 @@
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import gpx_to_directions_route as converter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+from synthetic_gpx import SHAPES, synthetic_gpx_file  # noqa: E402
+
+# converters with different settings share the pool, so state leaking between conversions changes the output
+CONVERTERS = [
+    converter.GpxToDirectionsConverter([100], 0),
+    converter.GpxToDirectionsConverter([20, 80], 100),
+    converter.GpxToDirectionsConverter([30, 30, 40], 50, language=1, coalesce_steps=True),
+    converter.GpxToDirectionsConverter([50, 50], 100, ingestion="stream", tolerance_meters=2),
+]
+
+
+@pytest.fixture(scope="module")
+def gpx_file_paths(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("gpx")
+    return [synthetic_gpx_file(str(directory), shape, 3000, seed) for shape in SHAPES for seed in (0, 1)]
+
+
+def serialized_conversion(gpx_converter, gpx_file_path):
+    result = gpx_converter.convert(gpx_file_path)
+    return converter.serialize_route_response(result.response, compact=True), result.waypoints
+
+
+def test_thread_pool_conversions_match_serial(gpx_file_paths):
+    jobs = [(gpx_converter, gpx_file_path) for gpx_converter in CONVERTERS for gpx_file_path in gpx_file_paths]
+    serial_results = [serialized_conversion(*job) for job in jobs]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        # every job twice, so the same converter and file also run concurrently
+        parallel_results = list(pool.map(lambda job: serialized_conversion(*job), jobs + jobs))
+    assert parallel_results == serial_results + serial_results
@@ -0,0 +1,47 @@
+import os
+import random
+import sys
+
+import pytest
+
+import gpx_to_directions_route as converter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+from synthetic_gpx import generate_track  # noqa: E402
+
+
+def gpx_document(coordinates):
+    """
+    Returns:
+        GPX document (bytes) with one track segment through the (latitude, longitude) coordinates
+    """
+    track_points = "".join(f'<trkpt lat="{latitude!r}" lon="{longitude!r}"></trkpt>\n'
+                           for latitude, longitude in coordinates)
+    return ('<?xml version="1.0" encoding="UTF-8"?>\n<gpx version="1.1" xmlns="http://www.topografix.com/GPX/1/1">'
+            f'<trk><trkseg>\n{track_points}</trkseg></trk></gpx>\n').encode('utf-8')
+
+
+@pytest.mark.parametrize("shape", ["urban_grid", "hairpin"])
+@pytest.mark.parametrize("voice_instruction_distance, tolerance_meters", [(0, None), (100, None), (100, 2.0)])
+def test_extend_matches_full_conversion(shape, voice_instruction_distance, tolerance_meters):
+    # rounded like GPX coordinates usually are, so the file and the appended points are the same numbers
+    coordinates = [(round(latitude, 7), round(longitude, 7)) for latitude, longitude in generate_track(shape, 1500, 1)]
+    rng = random.Random(shape)
+    incremental = converter.IncrementalConverter(voice_instruction_distance, tolerance_meters=tolerance_meters)
+    gpx_converter = converter.GpxToDirectionsConverter([100], voice_instruction_distance,
+                                                       tolerance_meters=tolerance_meters)
+    point_count = 0
+    previous = None
+    while point_count < len(coordinates):
+        chunk = coordinates[point_count:point_count + rng.randint(2, 80)]
+        point_count += len(chunk)
+        result = incremental.extend(chunk)
+
+        expected = gpx_converter.convert_data(gpx_document(coordinates[:point_count]))
+        serialized = converter.serialize_route_response(result.response, compact=True)
+        assert serialized == converter.serialize_route_response(expected.response, compact=True)
+        assert result.waypoints == expected.waypoints
+        # later updates leave earlier results untouched
+        if previous is not None:
+            assert converter.serialize_route_response(previous[0].response, compact=True) == previous[1]
+        previous = (result, serialized)
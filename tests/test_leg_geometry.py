@@ -0,0 +1,55 @@
+import os
+import random
+import sys
+
+import numpy as np
+import pytest
+
+import gpx_to_directions_route as converter
+from gpx_to_directions_route import BEARING_TOLERANCE_DEGREES, DISTANCE_TOLERANCE_METERS
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+from synthetic_gpx import SHAPES, generate_track  # noqa: E402
+
+
+def waypoints(coordinates):
+    return [{"latitude": latitude, "longitude": longitude} for latitude, longitude in coordinates]
+
+
+def random_leg(seed, count=2000):
+    # anywhere on the globe, from the same point twice up to continent-sized segments
+    rng = random.Random(seed)
+    coordinates = [(rng.uniform(-90, 90), rng.uniform(-180, 180))]
+    for _ in range(count - 1):
+        latitude, longitude = coordinates[-1]
+        step = rng.choice([0, 1e-7, 1e-4, 0.01, 1, 60])
+        coordinates.append((max(-90.0, min(90.0, latitude + rng.uniform(-step, step))),
+                            (longitude + rng.uniform(-step, step) + 180) % 360 - 180))
+    return waypoints(coordinates)
+
+
+LEGS = {
+    **{shape: waypoints(generate_track(shape, 3000, 0)) for shape in SHAPES},
+    **{f"random_{seed}": random_leg(seed) for seed in range(3)},
+    # due north and south (bearings of 0 and 180), across the antimeridian and over a pole
+    "meridians": waypoints([(0, 10), (1, 10), (0, 10), (0, 179.9), (0, -179.9), (89.9, 0), (89.9, 180), (90, 0)]),
+    "single_point": waypoints([(52.0, 13.0)]),
+    "empty": [],
+}
+
+
+def angle_difference(first, second):
+    # bearings of 360 - 1e-14 and 0 are the same direction
+    return np.abs((np.asarray(first) - np.asarray(second) + 180) % 360 - 180)
+
+
+@pytest.mark.parametrize("leg", LEGS)
+def test_compute_leg_geometry_matches_reference(leg):
+    bearings, bearing_deltas, distances = converter.compute_leg_geometry(LEGS[leg])
+    reference_bearings, reference_deltas, reference_distances = converter.compute_leg_geometry_reference(LEGS[leg])
+    assert len(bearings) == len(bearing_deltas) == len(distances) == max(len(LEGS[leg]) - 1, 0)
+    assert len(reference_bearings) == len(bearings)
+    assert np.all(angle_difference(bearings, reference_bearings) <= BEARING_TOLERANCE_DEGREES)
+    # deltas feed classify_maneuvers, which normalizes them, so they may differ by whole turns only
+    assert np.all(angle_difference(bearing_deltas, reference_deltas) <= 2 * BEARING_TOLERANCE_DEGREES)
+    assert np.all(np.abs(distances - np.asarray(reference_distances, dtype=np.float64)) <= DISTANCE_TOLERANCE_METERS)
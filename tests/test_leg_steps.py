@@ -0,0 +1,81 @@
+import json
+import os
+import sys
+
+import pytest
+
+import gpx_to_directions_route as converter
+from test_maneuvers import gpx_track
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+from synthetic_gpx import SHAPES, synthetic_gpx_file  # noqa: E402
+
+# West for ~340 m, a short hairpin to the south and back east on a parallel street ~44 m away, then south again.
+# The start of the first step is closer in a straight line to the last maneuver than any later step start.
+HAIRPIN = [(13.005, 52.0004), (13.0, 52.0004), (12.99999, 52.0), (13.0047, 52.0), (13.0048, 51.997)]
+
+
+def voice_instruction_steps(gpx_data, voice_instruction_distance):
+    """
+    Returns:
+        Dictionary of the target_maneuver_step of every voice instruction of the first leg to the index of the
+        step carrying it
+    """
+    gpx_converter = converter.GpxToDirectionsConverter([100], voice_instruction_distance)
+    response = json.loads(converter.serialize_route_response(gpx_converter.convert_data(gpx_data).response))
+    return {voice_instruction["target_maneuver_step"]: step_index
+            for step_index, step in enumerate(response["routes"][0]["legs"][0]["steps"])
+            for voice_instruction in step["voiceInstructions"]}
+
+
+def test_voice_instruction_at_maneuver_on_step_into_it():
+    assert voice_instruction_steps(gpx_track(HAIRPIN), 0) == {1: 0, 2: 1, 3: 2}
+
+
+def test_voice_instruction_on_closest_step_along_route():
+    # 100 m before the last maneuver lies on the parallel street: it stays on step 2 even though step 0 starts
+    # closer to it in a straight line across the hairpin (where the straight-line rule used to put it)
+    assert voice_instruction_steps(gpx_track(HAIRPIN), 100) == {1: 0, 2: 1, 3: 2}
+
+
+def converted_legs(gpx_file_path, coalesce_steps):
+    gpx_converter = converter.GpxToDirectionsConverter([30, 30, 40], 100, coalesce_steps=coalesce_steps)
+    return gpx_converter.convert(gpx_file_path).response["routes"][0]["legs"]
+
+
+@pytest.mark.parametrize("shape", SHAPES)
+def test_coalesced_voice_instructions_target_their_maneuvers(tmp_path, shape):
+    gpx_file_path = synthetic_gpx_file(str(tmp_path), shape, 3000)
+    for leg, coalesced_leg in zip(converted_legs(gpx_file_path, False), converted_legs(gpx_file_path, True)):
+        steps, coalesced_steps = leg["steps"], coalesced_leg["steps"]
+        # one step per maneuver, plus the first step of the leg
+        assert len(coalesced_steps) == 1 + sum(1 for step in steps[1:] if step.instruction)
+        first_segment = coalesced_steps[0].segment_index
+        announced = [(step_index, voice_instruction) for step_index, step in enumerate(steps)
+                     for voice_instruction in step.voice_instructions]
+        coalesced_announced = [(step_index, voice_instruction)
+                               for step_index, step in enumerate(coalesced_steps)
+                               for voice_instruction in step.voice_instructions]
+        assert len(coalesced_announced) == len(announced)
+        for (step_index, voice_instruction), (coalesced_index, coalesced_instruction) in zip(
+                announced, coalesced_announced):
+            assert coalesced_instruction.announcement == voice_instruction.announcement
+            assert coalesced_instruction.location == voice_instruction.location
+            # carried by the coalesced step covering the segment it was on ...
+            carrying_step = coalesced_steps[coalesced_index]
+            assert 0 <= step_index - (carrying_step.segment_index - first_segment) < carrying_step.segment_count
+            # ... and announcing the maneuver that starts the step it targets, which comes later
+            target_step = coalesced_steps[coalesced_instruction.target_maneuver_step]
+            maneuver_step = steps[voice_instruction.target_maneuver_step]
+            assert coalesced_instruction.target_maneuver_step > coalesced_index
+            assert target_step.segment_index == maneuver_step.segment_index
+            assert target_step.instruction == maneuver_step.instruction
+            assert (target_step.start_longitude, target_step.start_latitude) == (
+                maneuver_step.start_longitude, maneuver_step.start_latitude)
+
+        for totals in (leg, coalesced_leg):
+            assert sum(step.distance for step in totals["steps"]) == pytest.approx(totals["distance"], rel=1e-12)
+            assert sum(step.duration for step in totals["steps"]) == pytest.approx(totals["duration"], rel=1e-12)
+        assert coalesced_leg["distance"] == pytest.approx(leg["distance"], rel=1e-9)
+        assert coalesced_leg["duration"] == pytest.approx(leg["duration"], rel=1e-9)
+        assert coalesced_leg["weight"] == pytest.approx(leg["weight"], rel=1e-9)
@@ -0,0 +1,104 @@
+import gpxpy.gpx
+import numpy as np
+import pytest
+
+import gpx_to_directions_route as converter
+from gpx_to_directions_route import ManeuverType
+
+
+def gpx_track(points):
+    """
+    Returns:
+        GPX document (string) with one track through the given [lon, lat] points
+    """
+    gpx = gpxpy.gpx.GPX()
+    track = gpxpy.gpx.GPXTrack()
+    segment = gpxpy.gpx.GPXTrackSegment()
+    gpx.tracks.append(track)
+    track.segments.append(segment)
+    for lon, lat in points:
+        segment.points.append(gpxpy.gpx.GPXTrackPoint(lat, lon))
+    return gpx.to_xml()
+
+
+def test_classify_maneuvers_empty_leg():
+    maneuver_types = converter.classify_maneuvers([], [])
+    assert maneuver_types.dtype == np.int8
+    assert len(maneuver_types) == 0
+
+
+def test_classify_maneuvers_single_segment():
+    assert converter.classify_maneuvers([90.0], [90.0]).tolist() == [ManeuverType.STRAIGHT]
+
+
+def test_convert_legs_with_zero_and_one_step():
+    # a straight track simplifies to 2 vertices, split into legs that have 0 and 1 steps
+    straight = [(13.0, 52.0), (13.01, 52.0)]
+    turning = [(13.0, 52.0), (13.01, 52.0), (13.01, 52.01)]
+    for points, leg_percentages, expected_step_counts in [
+        (straight, [30, 70], [0, 0]),
+        (straight, [100], [1]),
+        (turning, [30, 70], [0, 1]),
+        (turning, [50, 50], [1, 0]),
+    ]:
+        gpx_converter = converter.GpxToDirectionsConverter(leg_percentages, 100)
+        response = gpx_converter.convert_data(gpx_track(points)).response
+        assert [len(leg["steps"]) for leg in response["routes"][0]["legs"]] == expected_step_counts
+
+
+def if_chain_maneuver(bearing_delta, bearing_old):
+    """
+    The classification before the MANEUVER_CLASSES table: bounds compared with strict inequalities and no
+    wrapping of deltas beyond +-180 degrees.
+    """
+    maneuver_type = ManeuverType.STRAIGHT
+    if bearing_delta > 0 and 20 < abs(bearing_delta) < 120:
+        maneuver_type = ManeuverType.RIGHT
+    if bearing_delta > 0 and 120 < abs(bearing_delta) < 180:
+        maneuver_type = ManeuverType.SHARP_RIGHT
+    if bearing_delta > 0 and abs(bearing_delta) > 180:
+        maneuver_type = ManeuverType.SHARP_LEFT
+    if bearing_delta < 0 and 20 < abs(bearing_delta) < 120:
+        maneuver_type = ManeuverType.LEFT
+    if bearing_delta < 0 and 120 < abs(bearing_delta) < 180:
+        maneuver_type = ManeuverType.SHARP_LEFT
+    if bearing_old == 0:
+        maneuver_type = ManeuverType.STRAIGHT
+    return maneuver_type
+
+
+def classify(bearing_deltas, bearing_old=90.0):
+    # every delta as the second segment of a leg whose first segment has bearing bearing_old
+    bearings = [bearing_old] * (len(bearing_deltas) + 1)
+    return [ManeuverType(t) for t in converter.classify_maneuvers(bearings, [0.0] + list(bearing_deltas))[1:]]
+
+
+def test_classify_maneuvers_matches_if_chain():
+    # every delta within (-180, 180) except the bounds themselves
+    bearing_deltas = [delta for delta in np.arange(-179.75, 180, 0.25).tolist() if abs(delta) not in (20, 120)]
+    for bearing_old in (90.0, 0.0):
+        assert classify(bearing_deltas, bearing_old) == [if_chain_maneuver(delta, bearing_old)
+                                                         for delta in bearing_deltas]
+
+
+@pytest.mark.parametrize("bearing_delta, if_chain_type, maneuver_type", [
+    # a bound belongs to the row it starts (the if-chain left exact bounds without a maneuver)
+    (20, ManeuverType.STRAIGHT, ManeuverType.RIGHT),
+    (-20, ManeuverType.STRAIGHT, ManeuverType.LEFT),
+    (120, ManeuverType.STRAIGHT, ManeuverType.SHARP_RIGHT),
+    (-120, ManeuverType.STRAIGHT, ManeuverType.SHARP_LEFT),
+    # U-turns are sharp left turns
+    (180, ManeuverType.STRAIGHT, ManeuverType.SHARP_LEFT),
+    (-180, ManeuverType.STRAIGHT, ManeuverType.SHARP_LEFT),
+    # deltas beyond +-180 degrees are wrapped: 360 is no turn, 340 a left and -340 a right turn
+    (360, ManeuverType.SHARP_LEFT, ManeuverType.STRAIGHT),
+    (340, ManeuverType.SHARP_LEFT, ManeuverType.LEFT),
+    (-340, ManeuverType.STRAIGHT, ManeuverType.RIGHT),
+    (-200, ManeuverType.STRAIGHT, ManeuverType.SHARP_RIGHT),
+    (200, ManeuverType.SHARP_LEFT, ManeuverType.SHARP_LEFT),
+])
+def test_classify_maneuvers_bounds_and_wrap_around(bearing_delta, if_chain_type, maneuver_type):
+    assert if_chain_maneuver(bearing_delta, 90.0) == if_chain_type
+    assert classify([bearing_delta]) == [maneuver_type]
+    assert converter.maneuver_instruction_text(bearing_delta, 90.0) == \
+        converter.MANEUVER_INSTRUCTION_TEXTS[maneuver_type][0]
@@ -0,0 +1,47 @@
+import random
+
+import polyline
+import pytest
+
+import gpx_to_directions_route as converter
+
+
+def random_route(rng, point_count):
+    # steps from centimeters to degrees, so values of every encoded length occur, anywhere on the globe
+    latitude, longitude = rng.uniform(-85, 85), rng.uniform(-180, 180)
+    waypoints = []
+    for _ in range(point_count):
+        waypoints.append({"latitude": latitude, "longitude": longitude})
+        scale = 10 ** rng.uniform(-7, 0)
+        latitude = min(max(latitude + rng.uniform(-scale, scale), -89.9), 89.9)
+        longitude = min(max(longitude + rng.uniform(-scale, scale), -180.0), 180.0)
+    return waypoints
+
+
+def encode(waypoints):
+    return polyline.encode([(point["latitude"], point["longitude"]) for point in waypoints], precision=6)
+
+
+def test_encodings_match_polyline_encode():
+    rng = random.Random(0)
+    for _ in range(300):
+        waypoints = random_route(rng, rng.randint(1, 60))
+        route_polyline = converter.RoutePolyline(waypoints)
+        assert route_polyline.route_geometry() == encode(waypoints)
+        for segment_index in range(len(waypoints) - 1):
+            assert route_polyline.segment_geometry(segment_index) == encode(waypoints[segment_index:segment_index + 2])
+        first_vertex = rng.randrange(len(waypoints))
+        last_vertex = rng.randrange(first_vertex, len(waypoints))
+        assert (route_polyline.span_geometry(first_vertex, last_vertex) ==
+                encode(waypoints[first_vertex:last_vertex + 1]))
+
+
+def test_rounding_of_half_microdegrees():
+    # polyline rounds halves away from zero
+    waypoints = [{"latitude": 0.0000005, "longitude": -0.0000005}, {"latitude": 1.0000015, "longitude": -2.5000025}]
+    assert converter.RoutePolyline(waypoints).route_geometry() == encode(waypoints)
+
+
+def test_empty_route():
+    with pytest.raises(ValueError, match="at least one waypoint"):
+        converter.RoutePolyline([])
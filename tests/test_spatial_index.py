@@ -0,0 +1,74 @@
+import math
+import os
+import random
+import sys
+
+import numpy as np
+import pytest
+
+import gpx_to_directions_route as converter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+from synthetic_gpx import generate_track  # noqa: E402
+
+
+def simplified_leg(shape, point_count):
+    latitudes, longitudes = np.array(list(generate_track(shape, point_count, 2))).T
+    return converter.split_into_legs(
+        converter.simplify_coordinate_columns(longitudes, latitudes, 0.00001, None).tolist(), [100])[0]
+
+
+def antimeridian_leg():
+    # crosses from 179.9 to -179.8 degrees longitude
+    return [{"longitude": (179.9 + 0.001 * i + 180) % 360 - 180, "latitude": 10 + 0.0005 * i} for i in range(300)]
+
+
+LEGS = {
+    "urban_grid": lambda: simplified_leg("urban_grid", 3000),
+    "hairpin": lambda: simplified_leg("hairpin", 3000),
+    # every vertex twice, so nearest matches tie
+    "out_and_back": lambda: simplified_leg("hairpin", 1000) + simplified_leg("hairpin", 1000)[::-1],
+    "antimeridian": antimeridian_leg,
+    "polar": lambda: [{"longitude": 0.01 * i, "latitude": 80 + 0.001 * (i % 7)} for i in range(500)],
+    "two_points": lambda: [{"longitude": 1.0, "latitude": 2.0}, {"longitude": 1.001, "latitude": 2.0}],
+}
+
+
+def queries(waypoints, rng):
+    # near the route and up to several degrees away from it, plus the vertices themselves
+    locations = []
+    for _ in range(200):
+        waypoint = rng.choice(waypoints)
+        radius = rng.choice([0.00001, 0.0005, 0.01, 0.5, 5])
+        longitude = (waypoint["longitude"] + rng.uniform(-radius, radius) + 180) % 360 - 180
+        latitude = max(-89.0, min(89.0, waypoint["latitude"] + rng.uniform(-radius, radius)))
+        locations.append([longitude, latitude])
+    return locations + [[point["longitude"], point["latitude"]] for point in rng.sample(waypoints, min(20, len(waypoints)))]
+
+
+def brute_force_vertex(waypoints, location):
+    distances = [converter.haversine_distance(location[1], location[0], point["latitude"], point["longitude"])
+                 for point in waypoints]
+    return int(np.argmin(distances)), min(distances)
+
+
+@pytest.mark.parametrize("leg", LEGS)
+def test_grid_matches_brute_force(leg):
+    waypoints = LEGS[leg]()
+    grid = converter.WaypointGrid(waypoints)
+    assert grid.linear == (leg == "antimeridian")
+    rng = random.Random(leg)
+    for location in queries(waypoints, rng):
+        vertex_index, vertex_distance = grid.nearest_vertex(location)
+        expected_index, expected_distance = brute_force_vertex(waypoints, location)
+        assert vertex_distance == pytest.approx(expected_distance, rel=1e-9, abs=1e-6)
+        assert vertex_index == expected_index or math.isclose(
+            converter.haversine_distance(location[1], location[0], waypoints[vertex_index]["latitude"],
+                                         waypoints[vertex_index]["longitude"]), expected_distance, rel_tol=1e-9)
+
+        # every segment measured with the grid's own projection
+        segment_index, fraction, segment_distance = grid.nearest_segment(location)
+        _, distances = grid._segment_projection(location, np.arange(len(waypoints) - 1))
+        assert segment_distance == pytest.approx(float(distances.min()), rel=1e-9, abs=1e-6)
+        assert distances[segment_index] == pytest.approx(segment_distance, rel=1e-9, abs=1e-6)
+        assert 0 <= fraction <= 1
@@ -0,0 +1,112 @@
+import math
+import random
+
+import pytest
+
+import gpx_to_directions_route as converter
+
+
+def road_like_track(seed, max_turn, points=300):
+    """
+    Random track heading roughly east, with segments of 10-200 m and turns of up to max_turn degrees.
+
+    Returns:
+        List of waypoint dictionaries
+    """
+    rng = random.Random(seed)
+    lon, lat, heading = 13.0, 52.0, 90.0
+    waypoints = []
+    for _ in range(points):
+        waypoints.append({"longitude": lon, "latitude": lat})
+        # never heading west of north or south, so the track can only come back near itself through sharp turns
+        heading = min(max(heading + rng.uniform(-max_turn, max_turn), 10.0), 170.0)
+        distance = rng.uniform(10, 200)
+        lat += distance * math.cos(math.radians(heading)) / 111195.0
+        lon += distance * math.sin(math.radians(heading)) / (111195.0 * math.cos(math.radians(lat)))
+    return waypoints
+
+
+def leg_voice_placement(waypoints, voice_instruction_distance):
+    """
+    Returns:
+        (RouteIndex with the leg's maneuver_indices, safe distance of every maneuver's voice instruction)
+    """
+    bearings, bearing_deltas, distances = converter.compute_leg_geometry(waypoints)
+    maneuver_indices = [i for i, maneuver_type in enumerate(converter.classify_maneuvers(bearings, bearing_deltas))
+                        if maneuver_type]
+    route_index = converter.RouteIndex(waypoints, distances, maneuver_indices)
+    maneuver_locations = [[waypoints[i]["longitude"], waypoints[i]["latitude"]] for i in maneuver_indices]
+    safe_distances = converter.calculate_safe_voice_instruction_distances(
+        maneuver_locations, waypoints, voice_instruction_distance, route_index)
+    return route_index, safe_distances
+
+
+def nearest_step_scan(waypoints, maneuver_indices, safe_distances):
+    """
+    The original placement: the step before the maneuver whose start is closest in a straight line to the
+    voice instruction position, found by comparing every maneuver with every step.
+    """
+    target_steps = []
+    for maneuver_step_index, safe_distance in zip(maneuver_indices, safe_distances):
+        maneuver_point = waypoints[maneuver_step_index]
+        voice_instruction_location = converter.find_position_before_point(
+            waypoints, [maneuver_point["longitude"], maneuver_point["latitude"]], safe_distance)
+        target_step_index = None
+        min_distance = float('inf')
+        for step_index in range(maneuver_step_index):
+            distance = converter.haversine_distance(voice_instruction_location[1], voice_instruction_location[0],
+                                                    waypoints[step_index]["latitude"],
+                                                    waypoints[step_index]["longitude"])
+            if distance < min_distance:
+                min_distance = distance
+                target_step_index = step_index
+        target_steps.append(target_step_index)
+    return target_steps
+
+
+@pytest.mark.parametrize("voice_instruction_distance", [0, 50, 100, 300])
+def test_sweep_matches_nearest_step_scan(voice_instruction_distance):
+    """
+    Parity of the sweep with the original straight-line placement, checked only for tracks that don't double
+    back: with turns of at most 60 degrees a track never comes back near itself. On tracks that do, the two
+    placements differ (see test_sweep_differs_only_where_track_comes_back). The legs are built directly from
+    waypoints, not from GPX files through gpx_to_mapbox_directions_response.
+    """
+    for seed in range(8):
+        waypoints = road_like_track(seed, max_turn=60)
+        route_index, safe_distances = leg_voice_placement(waypoints, voice_instruction_distance)
+        assert (converter.assign_voice_instruction_steps(route_index, safe_distances) ==
+                nearest_step_scan(waypoints, route_index.maneuver_indices, safe_distances))
+
+
+@pytest.mark.parametrize("voice_instruction_distance", [0, 100])
+def test_sweep_differs_only_where_track_comes_back(voice_instruction_distance):
+    # Sharp turns let a track double back, so a step far back along the route can start closer in a straight
+    # line than the steps around the voice instruction; the sweep keeps the closest step along the route
+    differences = 0
+    for seed in range(8):
+        waypoints = road_like_track(seed, max_turn=120)
+        route_index, safe_distances = leg_voice_placement(waypoints, voice_instruction_distance)
+        cumulative_distances = route_index.cumulative_distances
+        swept_steps = converter.assign_voice_instruction_steps(route_index, safe_distances)
+        scanned_steps = nearest_step_scan(waypoints, route_index.maneuver_indices, safe_distances)
+        for maneuver_step_index, safe_distance, swept_step, scanned_step in zip(
+                route_index.maneuver_indices, safe_distances, swept_steps, scanned_steps):
+            if swept_step == scanned_step:
+                continue
+            differences += 1
+            voice_distance_along = max(cumulative_distances[maneuver_step_index] - safe_distance, 0)
+            assert (abs(cumulative_distances[swept_step] - voice_distance_along) <
+                    abs(cumulative_distances[scanned_step] - voice_distance_along))
+            # the straight-line choice is further back along the route than the step before the sweep's
+            assert scanned_step < swept_step
+    assert differences > 0
+
+
+def test_sweep_step_before_maneuver():
+    voice_sweep = converter.VoiceInstructionSweep([0.0, 100.0, 200.0, 300.0, 400.0])
+    assert voice_sweep.target_step(0.0, 0) is None
+    # nearer of the two surrounding step starts, but never the maneuver's own step or a later one
+    assert voice_sweep.target_step(140.0, 3) == 1
+    assert voice_sweep.target_step(160.0, 3) == 2
+    assert voice_sweep.target_step(390.0, 3) == 2
@@ -0,0 +1,139 @@
+import json
+import os
+import signal
+
+import pytest
+
+import gpx_to_directions_route as converter
+from test_maneuvers import gpx_track
+from watch_folder import MAX_WORKER_CRASHES, FolderWatcher
+
+TRACK = gpx_track([(13.0, 52.0), (13.01, 52.0), (13.01, 52.01)])
+
+
+@pytest.fixture
+def watch_directory(tmp_path):
+    (tmp_path / "a.gpx").write_text(TRACK)
+    return tmp_path
+
+
+def run_until_idle(watcher, polls=100):
+    """
+    Returns:
+        The conversions finished until the watcher is idle
+    """
+    results = []
+    for _ in range(polls):
+        results += watcher.poll(0.05)
+        if watcher.idle():
+            return results
+    raise AssertionError("watcher did not become idle")
+
+
+def make_watcher(watch_directory, voice_instruction_distance=100, **options):
+    gpx_converter = converter.GpxToDirectionsConverter([100], voice_instruction_distance, segment_workers=1)
+    return FolderWatcher(str(watch_directory), settle_seconds=0, gpx_converter=gpx_converter, **options)
+
+
+def test_restart_with_other_parameters_converts_again(watch_directory):
+    watcher = make_watcher(watch_directory)
+    assert [result["status"] for result in run_until_idle(watcher)] == ['ok']
+    watcher.close()
+
+    same = make_watcher(watch_directory)
+    assert same.scan() == 0
+    same.close()
+
+    for options in [{"voice_instruction_distance": 50}, {"compact": True}, {"output_profile": "lean"}]:
+        other = make_watcher(watch_directory, **options)
+        assert other.scan() == 1
+        assert [result["status"] for result in run_until_idle(other)] == ['ok']
+        other.close()
+
+
+class CrashingConverter(converter.GpxToDirectionsConverter):
+    # Ends the worker process like an out-of-memory kill or a crash in a native library
+    def convert_data(self, gpx_data):
+        os._exit(1)
+
+
+def test_dead_worker_pool_is_replaced(watch_directory):
+    watcher = make_watcher(watch_directory)
+    for process_id in list(watcher.pool._processes):
+        os.kill(process_id, signal.SIGKILL)
+    # the conversion in flight (or submitted) when the pool broke is converted on a new pool
+    assert [result["status"] for result in run_until_idle(watcher)] == ['ok']
+    assert watcher.stats()["pool_restarts"] == 1
+    watcher.close()
+
+
+def test_file_crashing_every_worker_fails(watch_directory):
+    gpx_converter = CrashingConverter([100], 100, segment_workers=1)
+    watcher = FolderWatcher(str(watch_directory), settle_seconds=0, gpx_converter=gpx_converter)
+    results = run_until_idle(watcher)
+    assert [result["status"] for result in results] == ['failed']
+    assert "BrokenProcessPool" in results[0]["error"]
+    assert watcher.stats()["pool_restarts"] == MAX_WORKER_CRASHES
+    # not retried until the file changes
+    assert watcher.scan() == 0
+    watcher.close()
+
+
+def test_scan_waits_for_file_to_settle(watch_directory):
+    watcher = make_watcher(watch_directory)
+    watcher.settle_seconds = 2.0
+    assert watcher.scan(now=100.0) == 0  # first seen
+    assert watcher.scan(now=101.0) == 0
+    # still being written: the settle time starts again
+    with open(watch_directory / "a.gpx", 'a') as gpx_file:
+        gpx_file.write("\n")
+    assert watcher.scan(now=101.5) == 0
+    assert watcher.scan(now=103.0) == 0
+    assert watcher.scan(now=103.5) == 1
+    assert watcher.scan(now=110.0) == 0  # queued already
+    watcher.close()
+
+
+def test_scan_skips_converted_and_touched_files(watch_directory):
+    watcher = make_watcher(watch_directory)
+    assert [result["status"] for result in run_until_idle(watcher)] == ['ok']
+    assert watcher.scan(now=1000.0) == 0  # matches its manifest entry, not read
+
+    # touched: queued by size/modification time, but the hash shows the content is the same
+    os.utime(watch_directory / "a.gpx", ns=(1, 1))
+    assert watcher.scan(now=1001.0) == 1
+    assert [result["status"] for result in run_until_idle(watcher)] == ['unchanged']
+    assert watcher.manifest["a.gpx"]["mtime_ns"] == 1
+    assert watcher.scan(now=1002.0) == 0
+    watcher.close()
+
+
+def test_scan_forgets_removed_files(watch_directory):
+    watcher = make_watcher(watch_directory)
+    run_until_idle(watcher)
+    (watch_directory / "b.gpx").write_text(TRACK)
+    watcher.settle_seconds = 2.0
+    assert watcher.scan(now=100.0) == 0
+    assert set(watcher.unsettled) == {"b.gpx"}
+
+    os.remove(watch_directory / "a.gpx")
+    os.remove(watch_directory / "b.gpx")
+    assert watcher.scan(now=101.0) == 0
+    assert watcher.unsettled == {}
+    assert watcher.manifest == {}
+    with open(watcher.manifest_path) as manifest_file:
+        assert json.load(manifest_file)["files"] == {}
+    watcher.close()
+
+
+def test_failed_file_retried_once_changed(watch_directory):
+    (watch_directory / "a.gpx").write_text("<gpx")
+    watcher = make_watcher(watch_directory)
+    assert [result["status"] for result in run_until_idle(watcher)] == ['failed']
+    assert watcher.scan(now=1000.0) == 0
+
+    (watch_directory / "a.gpx").write_text(TRACK)
+    assert watcher.scan(now=1001.0) == 1
+    assert [result["status"] for result in run_until_idle(watcher)] == ['ok']
+    assert watcher.failed == {}
+    watcher.close()
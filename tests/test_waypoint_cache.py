@@ -0,0 +1,20 @@
+import pytest
+
+import gpx_to_directions_route as converter
+from test_maneuvers import gpx_track
+
+
+def test_unwritable_waypoint_cache_warns(tmp_path, monkeypatch, capsys):
+    def store_waypoint_cache(gpx_file_path, *args):
+        raise PermissionError(f"read-only directory: {gpx_file_path}")
+
+    monkeypatch.setattr(converter, "store_waypoint_cache", store_waypoint_cache)
+    gpx_file_path = tmp_path / "track.gpx"
+    gpx_file_path.write_text(gpx_track([(13.0, 52.0), (13.01, 52.0), (13.01, 52.01)]))
+    gpx_converter = converter.GpxToDirectionsConverter([100], 100, waypoint_cache=True)
+
+    with pytest.warns(RuntimeWarning, match="Waypoint cache of .* not written"):
+        result = gpx_converter.convert(str(gpx_file_path))
+    # the conversion still succeeds, and nothing is printed to stdout
+    assert len(result.waypoints) == 3
+    assert capsys.readouterr().out == ""
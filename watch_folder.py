@@ -0,0 +1,467 @@
+import argparse
+import fnmatch
+import hashlib
+import json
+import os
+import signal
+import sys
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import gpx_to_directions_route as converter
+from batch_convert import output_file_path
+from conversion_cache import ConversionCache
+
+# Long-running watch mode: converts GPX files as they land in a directory (default gpx_input_files/).
+#
+# The directory is polled every --interval seconds (os.scandir, no extra dependency). A new or changed file is
+# converted once its size and modification time have stayed the same for --settle seconds, so files still being
+# uploaded are not picked up half written. Conversions run on a pool of worker processes that are started and
+# warmed up (imports done) once; at most 2 x workers conversions are submitted at a time, further ready files
+# wait in a queue.
+#
+# A manifest (.gpx_manifest.json in the watched directory) records the size, modification time and SHA-256 of
+# every converted file, and a fingerprint of the conversion parameters it was converted with (a restart with other
+# parameters converts every file again). Files matching their manifest entry are skipped without being read, also
+# after a restart; a file whose size or modification time changed but whose content hash did not (e.g. touched or
+# copied again) is not converted again. Files that fail to convert are retried once they change. Output files are
+# named like batch_convert.py names them.
+#
+# If a worker process dies (e.g. killed when out of memory), the pool is replaced by a new warmed-up one and the
+# files that were in flight are converted again. A file in flight during MAX_WORKER_CRASHES pool failures counts
+# as failed, so a file that crashes the worker every time does not stop the watcher.
+#
+# Queue depth, counts and latency percentiles are written to a stats JSON file (default .gpx_watch_stats.json in
+# the watched directory) after every poll.
+
+MANIFEST_FILE_NAME = ".gpx_manifest.json"
+STATS_FILE_NAME = ".gpx_watch_stats.json"
+MANIFEST_VERSION = 1
+
+# Conversions kept for the latency percentiles
+LATENCY_WINDOW = 1000
+
+# Pool failures a file may be in flight for before it counts as failed
+MAX_WORKER_CRASHES = 2
+
+
+def write_json_atomically(content, file_path):
+    # Written to a temporary file and renamed into place, so readers never see a partial file
+    file_descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(file_path)),
+                                                       suffix='.tmp')
+    try:
+        with os.fdopen(file_descriptor, 'w') as json_file:
+            json.dump(content, json_file, indent=2)
+        os.replace(temporary_path, file_path)
+    except BaseException:
+        os.unlink(temporary_path)
+        raise
+
+
+def conversion_fingerprint(gpx_converter, compact=False, output_profile="full", compression=None):
+    """
+    Hex SHA-256 of every parameter that affects the output files: the converter's cache parameters (see
+    GpxToDirectionsConverter.cache_parameters) and how the output is written.
+    """
+    parameters = {"converter": gpx_converter.cache_parameters(), "compact": compact,
+                  "output_profile": output_profile, "compression": compression}
+    return hashlib.sha256(json.dumps(parameters, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _warm_up():
+    # Touch the converter's dependencies so the first real conversion does not pay for imports
+    converter.compute_leg_geometry([{"latitude": 0.0, "longitude": 0.0}, {"latitude": 0.001, "longitude": 0.001}])
+    return True
+
+
+def convert_if_changed(gpx_converter, gpx_file_path, json_file_path, known_sha256=None, compact=False,
+                       output_profile="full", compression=None):
+    """
+    Convert a GPX file unless its content hash is known_sha256 and its output exists (runs in a worker).
+
+    The file is read once; its hash and the conversion are of the same bytes. Its size and modification time
+    are taken before reading, so a file changed meanwhile does not match the manifest entry made from them.
+
+    Returns:
+        Dictionary with file, output, status ('ok', 'unchanged' or 'failed'), error, size, mtime_ns, sha256
+        and seconds
+    """
+    start = time.perf_counter()
+    result = {"file": gpx_file_path, "output": None, "status": 'failed', "error": None, "size": None,
+              "mtime_ns": None, "sha256": None}
+    try:
+        source_stat = os.stat(gpx_file_path)
+        with open(gpx_file_path, 'rb') as gpx_file:
+            gpx_data = gpx_file.read()
+        result.update(size=source_stat.st_size, mtime_ns=source_stat.st_mtime_ns,
+                      sha256=hashlib.sha256(gpx_data).hexdigest())
+        if result["sha256"] == known_sha256 and os.path.exists(json_file_path):
+            result["status"] = 'unchanged'
+        else:
+            conversion = gpx_converter.convert_data(gpx_data)
+            converter.write_route_response(conversion.response, json_file_path, compact,
+                                           output_profile=output_profile, compression=compression)
+            result.update(status='ok', output=json_file_path)
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def latency_summary(latencies):
+    """
+    Count, p50, p95 and max of a list of latencies in seconds (None without latencies).
+    """
+    if not latencies:
+        return {"count": 0, "p50": None, "p95": None, "max": None}
+    ordered = sorted(latencies)
+    return {
+        "count": len(ordered),
+        "p50": ordered[int(0.50 * (len(ordered) - 1))],
+        "p95": ordered[int(0.95 * (len(ordered) - 1))],
+        "max": ordered[-1]
+    }
+
+
+class FolderWatcher:
+    """
+    Polls a directory and converts new or changed GPX files on a warm process pool.
+    """
+
+    def __init__(self, watch_directory, output_directory=None, workers=1, settle_seconds=2.0, pattern='*.gpx',
+                 manifest_path=None, gpx_converter=None, compact=False, output_profile="full", compression=None):
+        """
+        Args:
+            watch_directory: Directory receiving the GPX files (not searched recursively)
+            output_directory: Directory for the JSON files (default: next to each GPX file)
+            workers: Number of conversion worker processes
+            settle_seconds: Seconds a file's size and modification time must stay the same before it is
+                converted
+            pattern: File name pattern of the GPX files (case-insensitive)
+            manifest_path: Manifest file (default: .gpx_manifest.json in watch_directory)
+            gpx_converter: GpxToDirectionsConverter holding the conversion configuration
+            compact: Write compact instead of indented JSON
+            output_profile: "full" or "lean", see gpx_to_directions_route.OUTPUT_PROFILES
+            compression: None, "gzip" or "brotli"
+        """
+        self.watch_directory = os.path.abspath(watch_directory)
+        self.output_directory = output_directory
+        self.workers = workers
+        self.max_in_flight = 2 * workers
+        self.settle_seconds = settle_seconds
+        self.pattern = pattern.lower()
+        self.manifest_path = manifest_path or os.path.join(self.watch_directory, MANIFEST_FILE_NAME)
+        self.gpx_converter = gpx_converter or converter.GpxToDirectionsConverter(segment_workers=1)
+        self.compact = compact
+        self.output_profile = output_profile
+        self.compression = compression
+        self.parameters = conversion_fingerprint(self.gpx_converter, compact, output_profile, compression)
+        if output_directory:
+            os.makedirs(output_directory, exist_ok=True)
+
+        self.manifest = self._load_manifest()
+        self.unsettled = {}  # file name -> (size, mtime_ns, time since when they are unchanged)
+        self.ready = deque()  # (file name, time it became ready) waiting for a worker
+        self.queued = set()  # file names in ready or in flight
+        self.in_flight = {}  # future -> (file name, time it became ready)
+        self.failed = {}  # file name -> (size, mtime_ns) of a file that failed to convert
+        self.worker_crashes = {}  # file name -> pool failures while it was in flight
+        self.pool_broken = False
+        self.started = time.time()
+        self.counts = {"converted": 0, "unchanged": 0, "failed": 0, "pool_restarts": 0}
+        self.latencies = deque(maxlen=LATENCY_WINDOW)  # ready -> written, including the wait for a worker
+        self.conversion_seconds = deque(maxlen=LATENCY_WINDOW)
+        self._start_pool()
+
+    def _start_pool(self):
+        self.pool = ProcessPoolExecutor(max_workers=self.workers)
+        # Start and warm up every worker before watching
+        for future in [self.pool.submit(_warm_up) for _ in range(self.workers)]:
+            future.result()
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_path) as manifest_file:
+                manifest = json.load(manifest_file)
+        except (OSError, ValueError):
+            return {}
+        if manifest.get("version") != MANIFEST_VERSION:
+            return {}
+        return manifest.get("files", {})
+
+    def save_manifest(self):
+        write_json_atomically({"version": MANIFEST_VERSION, "files": self.manifest}, self.manifest_path)
+
+    def scan(self, now=None):
+        """
+        Stat the directory's GPX files and queue those that are new or changed and have settled.
+
+        Returns:
+            Number of files queued
+        """
+        now = time.time() if now is None else now
+        seen = set()
+        queued = 0
+        with os.scandir(self.watch_directory) as entries:
+            for entry in sorted(entries, key=lambda entry: entry.name):
+                if not fnmatch.fnmatch(entry.name.lower(), self.pattern):
+                    continue
+                try:
+                    if not entry.is_file():
+                        continue
+                    entry_stat = entry.stat()
+                except OSError:  # removed meanwhile
+                    continue
+                seen.add(entry.name)
+                if entry.name in self.queued:
+                    continue  # looked at again once its conversion is done
+                size, mtime_ns = entry_stat.st_size, entry_stat.st_mtime_ns
+
+                if self.failed.get(entry.name) == (size, mtime_ns):
+                    continue
+
+                known = self._manifest_entry(entry.name)
+                if (known is not None and known["size"] == size and known["mtime_ns"] == mtime_ns
+                        and os.path.exists(self._json_file_path(entry.name))):
+                    self.unsettled.pop(entry.name, None)
+                    continue
+
+                # Debounce: a file still being written keeps changing size or modification time
+                unsettled = self.unsettled.get(entry.name)
+                if unsettled is None or unsettled[:2] != (size, mtime_ns):
+                    self.unsettled[entry.name] = (size, mtime_ns, now)
+                    if self.settle_seconds > 0:
+                        continue
+                elif now - unsettled[2] < self.settle_seconds:
+                    continue
+                del self.unsettled[entry.name]
+                self.ready.append((entry.name, now))
+                self.queued.add(entry.name)
+                queued += 1
+
+        # Forget files that were removed
+        for name in set(self.unsettled) - seen:
+            del self.unsettled[name]
+        for name in set(self.failed) - seen:
+            del self.failed[name]
+        removed = set(self.manifest) - seen
+        for name in removed:
+            del self.manifest[name]
+        if removed:
+            self.save_manifest()
+        return queued
+
+    def _manifest_entry(self, file_name):
+        # Entries made with other conversion parameters are outdated, like those of a changed file
+        known = self.manifest.get(file_name)
+        if known is None or known.get("parameters") != self.parameters:
+            return None
+        return known
+
+    def _json_file_path(self, file_name):
+        return output_file_path(os.path.join(self.watch_directory, file_name), self.output_directory,
+                                self.compression, self.watch_directory)
+
+    def _submit_ready(self):
+        """
+        Hand ready files to the pool, replacing the pool if it broke.
+
+        Returns:
+            List of the conversions finished while replacing the pool (see convert_if_changed)
+        """
+        results = []
+        while self.ready and len(self.in_flight) < self.max_in_flight:
+            file_name, ready_time = self.ready.popleft()
+            known = self._manifest_entry(file_name)
+            try:
+                future = self.pool.submit(convert_if_changed, self.gpx_converter,
+                                          os.path.join(self.watch_directory, file_name),
+                                          self._json_file_path(file_name), known["sha256"] if known else None,
+                                          self.compact, self.output_profile, self.compression)
+            except BrokenProcessPool:
+                self.ready.appendleft((file_name, ready_time))
+                results += self._replace_pool()
+                continue
+            self.in_flight[future] = (file_name, ready_time)
+        return results
+
+    def _replace_pool(self):
+        # Collect the other conversions of the broken pool (they have finished or fail at once), then start over
+        results = self._collect(wait(list(self.in_flight)).done) if self.in_flight else []
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        self._start_pool()
+        self.pool_broken = False
+        self.counts["pool_restarts"] += 1
+        return results
+
+    def _failed_result(self, file_name, error):
+        # The file's current size and modification time, so it is retried once it changes
+        try:
+            source_stat = os.stat(os.path.join(self.watch_directory, file_name))
+            size, mtime_ns = source_stat.st_size, source_stat.st_mtime_ns
+        except OSError:
+            size, mtime_ns = None, None
+        return {"file": os.path.join(self.watch_directory, file_name), "output": None, "status": 'failed',
+                "error": f"{type(error).__name__}: {error}", "size": size, "mtime_ns": mtime_ns, "sha256": None,
+                "seconds": 0.0}
+
+    def _collect(self, futures):
+        results = []
+        for future in futures:
+            file_name, ready_time = self.in_flight.pop(future)
+            try:
+                result = future.result()
+            except BrokenProcessPool as e:
+                # A worker process died; the pool is replaced and the file converted again, unless it was in
+                # flight during too many pool failures
+                self.pool_broken = True
+                self.worker_crashes[file_name] = self.worker_crashes.get(file_name, 0) + 1
+                if self.worker_crashes[file_name] < MAX_WORKER_CRASHES:
+                    self.ready.appendleft((file_name, ready_time))
+                    continue
+                result = self._failed_result(file_name, e)
+            except Exception as e:
+                result = self._failed_result(file_name, e)
+            self.queued.discard(file_name)
+            self.worker_crashes.pop(file_name, None)
+            results.append(result)
+            if result["status"] == 'failed':
+                self.counts["failed"] += 1
+                self.failed[file_name] = (result["size"], result["mtime_ns"])
+                continue
+            self.failed.pop(file_name, None)
+            self.counts["converted" if result["status"] == 'ok' else "unchanged"] += 1
+            if result["status"] == 'ok':
+                self.latencies.append(time.time() - ready_time)
+                self.conversion_seconds.append(result["seconds"])
+            self.manifest[file_name] = {"size": result["size"], "mtime_ns": result["mtime_ns"],
+                                        "sha256": result["sha256"], "parameters": self.parameters,
+                                        "output": self._json_file_path(file_name), "converted_at": time.time()}
+        if results:
+            self.save_manifest()
+        return results
+
+    def poll(self, timeout=0.0):
+        """
+        Scan once, hand ready files to the pool and collect the conversions that finish within timeout seconds.
+
+        Returns:
+            List of the finished conversions (see convert_if_changed)
+        """
+        self.scan()
+        results = self._submit_ready()
+        if not self.in_flight:
+            if timeout > 0:
+                time.sleep(timeout)
+            return results
+        done, _ = wait(list(self.in_flight), timeout=timeout, return_when=FIRST_COMPLETED)
+        results += self._collect(done)
+        if self.pool_broken:
+            results += self._replace_pool()
+        results += self._submit_ready()
+        return results
+
+    def idle(self):
+        """
+        Whether nothing is settling, queued or converting.
+        """
+        return not (self.unsettled or self.ready or self.in_flight)
+
+    def stats(self):
+        """
+        Queue depth, counts and latency percentiles of the watcher.
+        """
+        return {
+            "time": time.time(),
+            "uptime_seconds": time.time() - self.started,
+            "watch_directory": self.watch_directory,
+            "queue_depth": len(self.ready),
+            "in_flight": len(self.in_flight),
+            "settling": len(self.unsettled),
+            "tracked_files": len(self.manifest),
+            "failed_files": len(self.failed),
+            "converted": self.counts["converted"],
+            "unchanged": self.counts["unchanged"],
+            "failed": self.counts["failed"],
+            "pool_restarts": self.counts["pool_restarts"],
+            "latency_seconds": latency_summary(list(self.latencies)),
+            "conversion_seconds": latency_summary(list(self.conversion_seconds))
+        }
+
+    def close(self):
+        # Finish the conversions in flight so their results reach the manifest
+        if self.in_flight:
+            self._collect(wait(list(self.in_flight)).done)
+        self.pool.shutdown()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Watch a directory and convert new or changed GPX files")
+    parser.add_argument('directory', nargs='?', default="gpx_input_files", help="directory receiving the GPX files")
+    parser.add_argument('--output-dir', help="directory for the JSON files (default: next to each GPX file)")
+    parser.add_argument('--workers', type=int, default=1, help="conversion worker processes")
+    parser.add_argument('--interval', type=float, default=1.0, help="seconds between directory scans")
+    parser.add_argument('--settle', type=float, default=2.0,
+                        help="seconds a file must stay unchanged before it is converted")
+    parser.add_argument('--once', action='store_true',
+                        help="convert what is there (without waiting for files to settle) and exit")
+    parser.add_argument('--stats-file', help=f"stats JSON file (default: {STATS_FILE_NAME} in the directory)")
+    parser.add_argument('--voice-instruction-distance', type=float, default=100,
+                        help="meters of voice instructions ahead of maneuvers")
+    parser.add_argument('--leg-percentages', type=int, nargs='+', default=[100],
+                        help="leg split in percent, must sum to 100")
+    parser.add_argument('--ingestion', choices=["gpxpy", "stream"], default="gpxpy")
+    parser.add_argument('--track-policy', choices=converter.TRACK_POLICIES, default="first",
+                        help="conversion of files with several tracks or segments")
+    parser.add_argument('--coalesce-steps', action='store_true',
+                        help="fold segments without a maneuver into the preceding step (one step per maneuver)")
+    parser.add_argument('--compact', action='store_true', help="write compact instead of indented JSON")
+    parser.add_argument('--output-profile', choices=converter.OUTPUT_PROFILES, default="full",
+                        help="lean leaves out debug fields and constant boilerplate")
+    parser.add_argument('--compress', choices=list(converter.COMPRESSIONS), default=None,
+                        help="write <name>.gpx.json.gz or .json.br files (brotli needs the brotli package)")
+    parser.add_argument('--cache-dir', help="reuse conversions of identical GPX content and parameters from here")
+    parser.add_argument('--cache-max-mb', type=float, default=512, help="size bound of the cache directory")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.directory):
+        print(f"{args.directory} is not a directory")
+        sys.exit(1)
+    cache = ConversionCache(args.cache_dir, int(args.cache_max_mb * 1024 * 1024)) if args.cache_dir else None
+    gpx_converter = converter.GpxToDirectionsConverter(args.leg_percentages, args.voice_instruction_distance,
+                                                       ingestion=args.ingestion, cache=cache,
+                                                       track_policy=args.track_policy,
+                                                       segment_workers=1,  # files already run in parallel
+                                                       coalesce_steps=args.coalesce_steps)
+    stats_file_path = args.stats_file or os.path.join(args.directory, STATS_FILE_NAME)
+
+    start = time.perf_counter()
+    watcher = FolderWatcher(args.directory, args.output_dir, args.workers, 0 if args.once else args.settle,
+                            gpx_converter=gpx_converter, compact=args.compact, output_profile=args.output_profile,
+                            compression=args.compress)
+    print(f"Workers warmed up in {time.perf_counter() - start:.2f}s, watching {watcher.watch_directory}")
+    # Stop like on Ctrl+C when a service manager terminates the process
+    signal.signal(signal.SIGTERM, lambda signal_number, frame: sys.exit(0))
+    try:
+        while True:
+            for result in watcher.poll(args.interval):
+                if result["status"] == 'ok':
+                    print(f"ok         {result['seconds']:8.2f}s  {result['file']} -> {result['output']}")
+                elif result["status"] == 'unchanged':
+                    print(f"unchanged  {result['seconds']:8.2f}s  {result['file']}")
+                else:
+                    print(f"failed     {result['seconds']:8.2f}s  {result['file']}: {result['error']}")
+            write_json_atomically(watcher.stats(), stats_file_path)
+            if args.once and watcher.idle():
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+        stats = watcher.stats()
+        write_json_atomically(stats, stats_file_path)
+        print(f"Converted {stats['converted']}, unchanged {stats['unchanged']}, failed {stats['failed']}; "
+              f"stats written to {stats_file_path}")
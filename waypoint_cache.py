@@ -0,0 +1,121 @@
+import mmap
+import math
+import os
+import struct
+import tempfile
+
+import numpy as np
+
+# Binary, memory-mapped cache of the parsed and simplified coordinates of a GPX file.
+#
+# The cache of <name>.gpx is stored next to it as <name>.gpxc: a 64 byte header followed by little-endian float64
+# columns, i.e. the rounded longitudes and latitudes of the track's points and the longitudes and latitudes of
+# its simplified vertices. Later conversions map the file instead of parsing the GPX again; with a different
+# simplification tolerance only the simplification is redone. An entry is valid while the GPX file has the size
+# and modification time (in nanoseconds) recorded in the header. Entries are written to a temporary file and
+# renamed into place.
+
+# Bump when the file layout or the meaning of the stored coordinates changes
+WAYPOINT_CACHE_VERSION = 1
+
+_MAGIC = b'GPXC'
+# magic, version, reserved, source size, source mtime_ns, tolerance, tolerance_meters (NaN: none),
+# number of points, number of simplified vertices
+_HEADER = struct.Struct('<4sHHqqddqq')
+_HEADER_SIZE = 64  # the columns start 8 byte aligned
+
+
+class CachedWaypoints:
+    """
+    Coordinates of a GPX file read from its waypoint cache; the arrays are views of the mapped file.
+    """
+
+    def __init__(self, source_size, source_mtime_ns, tolerance, tolerance_meters, longitudes, latitudes,
+                 simplified_coordinates):
+        self.source_size = source_size
+        self.source_mtime_ns = source_mtime_ns
+        self.tolerance = tolerance
+        self.tolerance_meters = tolerance_meters
+        self.longitudes = longitudes  # rounded to 6 decimals, see waypoints_line_string
+        self.latitudes = latitudes
+        self.simplified_coordinates = simplified_coordinates  # (vertices, 2) array of longitude, latitude
+
+    def simplified_with(self, tolerance, tolerance_meters):
+        """
+        Whether the simplified coordinates were computed with the given tolerances.
+        """
+        if tolerance_meters is not None or self.tolerance_meters is not None:
+            return tolerance_meters == self.tolerance_meters
+        return tolerance == self.tolerance
+
+
+def waypoint_cache_path(gpx_file_path):
+    """
+    Path of the waypoint cache file of a GPX file.
+    """
+    return os.path.splitext(gpx_file_path)[0] + '.gpxc'
+
+
+def load_waypoint_cache(gpx_file_path):
+    """
+    Map the waypoint cache of a GPX file.
+
+    Returns:
+        CachedWaypoints, or None if there is no cache file, it is outdated (the GPX file changed) or unreadable
+    """
+    try:
+        source_stat = os.stat(gpx_file_path)
+        with open(waypoint_cache_path(gpx_file_path), 'rb') as cache_file:
+            mapped = mmap.mmap(cache_file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):  # ValueError: empty file
+        return None
+
+    if len(mapped) < _HEADER_SIZE:
+        return None
+    (magic, version, _, source_size, source_mtime_ns, tolerance, tolerance_meters, point_count,
+     simplified_count) = _HEADER.unpack_from(mapped)
+    if (magic != _MAGIC or version != WAYPOINT_CACHE_VERSION or source_size != source_stat.st_size
+            or source_mtime_ns != source_stat.st_mtime_ns
+            or len(mapped) != _HEADER_SIZE + 16 * (point_count + simplified_count)):
+        return None
+
+    columns = np.frombuffer(mapped, dtype='<f8', offset=_HEADER_SIZE)
+    return CachedWaypoints(
+        source_size, source_mtime_ns, tolerance, None if math.isnan(tolerance_meters) else tolerance_meters,
+        columns[:point_count], columns[point_count:2 * point_count],
+        np.column_stack((columns[2 * point_count:2 * point_count + simplified_count],
+                         columns[2 * point_count + simplified_count:])))
+
+
+def store_waypoint_cache(gpx_file_path, source_size, source_mtime_ns, longitudes, latitudes, simplified_coordinates,
+                         tolerance, tolerance_meters=None):
+    """
+    Write the waypoint cache of a GPX file atomically.
+
+    Args:
+        gpx_file_path: Path of the GPX file
+        source_size: Size of the GPX file when it was read
+        source_mtime_ns: Modification time of the GPX file in nanoseconds when it was read (stat it before
+            reading, so a file changed while it was read is not taken as current)
+        longitudes: Rounded longitudes of the track's points
+        latitudes: Rounded latitudes of the track's points
+        simplified_coordinates: (vertices, 2) array of the simplified longitudes and latitudes
+        tolerance: Simplification tolerance in degrees
+        tolerance_meters: Simplification tolerance in meters, if used instead of tolerance
+    """
+    cache_path = waypoint_cache_path(gpx_file_path)
+    simplified_coordinates = np.asarray(simplified_coordinates, dtype='<f8')
+    header = _HEADER.pack(_MAGIC, WAYPOINT_CACHE_VERSION, 0, source_size, source_mtime_ns, tolerance,
+                          math.nan if tolerance_meters is None else tolerance_meters, len(longitudes),
+                          len(simplified_coordinates))
+    file_descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(cache_path)),
+                                                       suffix='.tmp')
+    try:
+        with os.fdopen(file_descriptor, 'wb') as cache_file:
+            cache_file.write(header.ljust(_HEADER_SIZE, b'\0'))
+            for column in (longitudes, latitudes, simplified_coordinates[:, 0], simplified_coordinates[:, 1]):
+                cache_file.write(np.ascontiguousarray(column, dtype='<f8').tobytes())
+        os.replace(temporary_path, cache_path)
+    except BaseException:
+        os.unlink(temporary_path)
+        raise